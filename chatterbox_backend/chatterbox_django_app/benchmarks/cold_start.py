@@ -0,0 +1,156 @@
+"""
+Worker cold-start and WebSocket handshake benchmark.
+
+Every run starts a fresh Python process, like a worker the autoscaler just added, and times:
+    boot         Django setup (settings, INSTALLED_APPS)
+    asgi         importing the ASGI application (routing, consumers)
+    lifespan     the ASGI lifespan startup (Redis pools, Lua scripts, background tasks)
+    first        the first WebSocket handshake (connect -> accept)
+    handshake    the next --connections handshakes, one at a time
+The handshakes go straight through the ASGI application, without a network, so they
+measure the server-side cost only. The process's total wall time is reported as "process".
+
+Profiles:
+    legacy   CHAT_ONLY=0, AuthMiddlewareStack around the router and no lifespan warm-up (the old stack)
+    full     CHAT_ONLY=0
+    chat     CHAT_ONLY=1, the lean chat-only profile
+
+    python -m benchmarks.cold_start --redis fake --runs 10 --connections 500
+    python -m benchmarks.cold_start --redis local --profiles full chat
+
+Run from the chatterbox_django_app directory.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.stats import summarize
+
+PROFILES = {
+    "legacy": {"CHAT_ONLY": "0"},
+    "full": {"CHAT_ONLY": "0"},
+    "chat": {"CHAT_ONLY": "1"},
+}
+
+STEPS = ["process", "boot", "asgi", "lifespan", "first", "handshake"]
+
+
+async def handshake(application, n: int) -> float:
+    """Opens and closes one WebSocket connection, returns the connect -> accept time in ms."""
+    from channels.testing import WebsocketCommunicator
+
+    user_id = hashlib.sha256(f"cold-start-{n}".encode()).hexdigest()
+    communicator = WebsocketCommunicator(application, f"/ws/textchat?id={user_id}")
+    start = time.perf_counter()
+    connected, code = await communicator.connect()
+    elapsed = (time.perf_counter() - start) * 1000
+    if not connected:
+        raise SystemExit(f"Handshake rejected with close code {code}")
+    await communicator.disconnect()
+    return elapsed
+
+
+async def lifespan_startup(application):
+    from asgiref.testing import ApplicationCommunicator
+
+    lifespan = ApplicationCommunicator(application, {"type": "lifespan"})
+    await lifespan.send_input({"type": "lifespan.startup"})
+    message = await lifespan.receive_output(timeout=30)
+    if message["type"] != "lifespan.startup.complete":
+        raise SystemExit(f"Lifespan startup failed: {message}")
+
+
+async def child(args):
+    """One cold start, in the current (fresh) process. Prints its timings as JSON."""
+    timings = {}
+
+    start = time.perf_counter()
+    from benchmarks.django_env import setup_django
+
+    setup_django(args.redis)
+    timings["boot"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    from chatterbox_django_app.asgi import application
+
+    if args.profile == "legacy":
+        from channels.auth import AuthMiddlewareStack
+        from channels.routing import ProtocolTypeRouter, URLRouter
+        from text_chat_app.routing import websocket_urlpatterns
+
+        application = ProtocolTypeRouter(
+            {"websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns))}
+        )
+    timings["asgi"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if args.profile != "legacy":
+        await lifespan_startup(application)
+    timings["lifespan"] = (time.perf_counter() - start) * 1000
+
+    timings["first"] = await handshake(application, 0)
+    timings["handshake"] = [await handshake(application, n) for n in range(1, args.connections + 1)]
+
+    json.dump(timings, sys.stdout)
+
+
+def run(args, profile: str) -> dict:
+    samples = {step: [] for step in STEPS}
+    env = dict(os.environ, **PROFILES[profile])
+
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [
+                sys.executable, "-m", "benchmarks.cold_start", "--child",
+                "--profile", profile, "--redis", args.redis,
+                "--connections", str(args.connections),
+            ],
+            env=env, capture_output=True, text=True, check=True,
+        )
+        samples["process"].append((time.perf_counter() - start) * 1000)
+
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        for step in STEPS[1:]:
+            value = timings[step]
+            samples[step].extend(value if isinstance(value, list) else [value])
+
+    return {step: summarize(values) for step, values in samples.items()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis", choices=["local", "fake"], default="local", help="redis-server at REDIS_HOST or fakeredis")
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per profile")
+    parser.add_argument("--connections", type=int, default=200, help="Handshakes timed per cold start, after the first")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--profile", choices=list(PROFILES), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.child:
+        asyncio.run(child(args))
+        sys.exit(0)
+
+    results = {
+        "config": {"redis": args.redis, "runs": args.runs, "connections": args.connections},
+        "profiles": {profile: run(args, profile) for profile in args.profiles},
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
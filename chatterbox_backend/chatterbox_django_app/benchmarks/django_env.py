@@ -0,0 +1,50 @@
+import os
+
+
+def setup_django(redis_mode: str):
+    """
+    Boots Django for an in-process benchmark run.
+
+    redis_mode "local" talks to the redis-server at REDIS_HOST (default localhost).
+    redis_mode "fake" swaps Redis for an in-process fakeredis stand-in
+    (pip install "fakeredis[lua]") and uses the in-memory channel layer.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatterbox_django_app.settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "*")
+    os.environ.setdefault("REDIS_HOST", "localhost")
+
+    import django
+    from django.conf import settings
+
+    django.setup()
+
+    if redis_mode == "fake":
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit('redis_mode "fake" needs fakeredis: pip install "fakeredis[lua]"')
+
+        import redis.asyncio as redis
+        from core import redis_client
+
+        server = fakeredis.FakeServer()
+        pool_kwargs = dict(
+            connection_class=fakeredis.aioredis.FakeConnection,
+            server=server,
+            decode_responses=True,
+        )
+        # Common last, it marks the pools as initialized
+        for pool_name in ("infra", "housekeeping", "common"):
+            pool = redis.ConnectionPool(**pool_kwargs)
+            setattr(redis_client, f"_{pool_name}_client", redis.Redis(connection_pool=pool))
+            setattr(redis_client, f"_{pool_name}_pool", pool)
+        settings.CHANNEL_LAYERS = {
+            "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+        }
+    else:
+        settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"] = [
+            (settings.REDIS_HOST, settings.REDIS_PORT)
+        ]
+
+    return settings
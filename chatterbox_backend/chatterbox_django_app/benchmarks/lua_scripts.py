@@ -0,0 +1,328 @@
+"""
+Microbenchmark for the Redis Lua scripts with large-population fixtures.
+
+Seeds a Redis database with --users user_meta:{id} hashes whose interests follow a
+Zipf distribution (so interest:{topic} sets range from huge to tiny), then times every
+script in text_chat_app/lua and core/lua through EVALSHA. Each result reports the
+client-side latency per call and, when the server allows it, the server-side
+duration from SLOWLOG, broken down by interests per user and by hot/cold topics.
+
+    python -m benchmarks.lua_scripts --db 15 --flush --users 100000
+    python -m benchmarks.lua_scripts --fake --users 20000       # fakeredis stand-in, no SLOWLOG
+
+The target database is flushed, so never point this at the production db.
+Run from the chatterbox_django_app directory.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import redis
+
+from benchmarks.stats import summarize
+from text_chat_app.sharded_matching import PRESENCE_KEY, queue_key, user_key
+
+# Lease expiry for seeded users, far enough out that none of them is skipped as a ghost
+LIVE_LEASE_MS = int(time.time() * 1000) + 86_400_000
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+LUA_DIRS = [APP_ROOT / "text_chat_app" / "lua", APP_ROOT / "core" / "lua"]
+
+
+class Bench:
+    def __init__(self, client, args):
+        self.r = client
+        self.args = args
+        self.shas = {}
+        self.topics = [f"topic{i}" for i in range(args.topics)]
+        self.weights = [1 / (rank + 1) ** args.zipf for rank in range(args.topics)]
+        self.slowlog = True
+        self.results = []
+        self.next_id = 0
+        self.seeded = {k: [] for k in args.interests}
+
+    # Fixtures
+
+    def load_scripts(self):
+        for lua_dir in LUA_DIRS:
+            for path in sorted(lua_dir.glob("*.lua")):
+                self.shas[path.stem] = self.r.script_load(path.read_text(encoding="utf-8"))
+
+    def pick_topics(self, count: int, first: str = None) -> list:
+        chosen = [first] if first else []
+        while len(chosen) < min(count, len(self.topics)):
+            topic = random.choices(self.topics, self.weights)[0]
+            if topic not in chosen:
+                chosen.append(topic)
+        return chosen
+
+    def new_user(self, interests_per_user: int, first_topic: str = None) -> str:
+        self.next_id += 1
+        user_id = f"bench{interests_per_user}_{self.next_id}"
+        interests = ",".join(self.pick_topics(interests_per_user, first_topic))
+        self.r.hset(user_key(user_id), mapping={
+            "channel": f"specific.bench!{user_id}",
+            "interests": interests,
+            "status": "searching",
+        })
+        self.r.zadd(PRESENCE_KEY, {user_id: LIVE_LEASE_MS})
+        return user_id
+
+    def seed(self):
+        """Seeds --users waiting users, split evenly across the --interests sizes."""
+        sizes = self.args.interests
+        now_ms = int(time.time() * 1000)
+        pipe = self.r.pipeline(transaction=False)
+        for i in range(self.args.users):
+            k = sizes[i % len(sizes)]
+            self.next_id += 1
+            user_id = f"bench{k}_{self.next_id}"
+            topics = self.pick_topics(k)
+            self.seeded[k].append(user_id)
+            pipe.hset(user_key(user_id), mapping={
+                "channel": f"specific.bench!{user_id}",
+                "interests": ",".join(topics),
+                "status": "searching",
+                "searching_since": now_ms,
+            })
+            pipe.zadd(PRESENCE_KEY, {user_id: LIVE_LEASE_MS})
+            for topic in topics:
+                pipe.sadd(f"interest:{{{topic}}}", user_id)
+                pipe.zadd(queue_key(topic), {user_id: now_ms - random.randint(0, 600_000)})
+                pipe.sadd("queued_interests", topic)
+            if i % 1000 == 999:
+                pipe.execute()
+        pipe.execute()
+
+    def seeded_users(self, interests_per_user: int, count: int) -> list:
+        """Picks seeded users with the given number of interests that are still waiting."""
+        users = []
+        for user_id in self.seeded[interests_per_user]:
+            if self.r.hget(user_key(user_id), "status") == "searching":
+                users.append(user_id)
+                if len(users) >= count:
+                    break
+        return users
+
+    # Measurement
+
+    def slowlog_reset(self):
+        if self.slowlog:
+            try:
+                self.r.slowlog_reset()
+            except redis.exceptions.ResponseError:
+                self.slowlog = False
+
+    def slowlog_durations(self) -> list:
+        if not self.slowlog:
+            return []
+        try:
+            entries = self.r.slowlog_get(self.args.calls * 2)
+        except redis.exceptions.ResponseError:
+            return []
+        return [e["duration"] for e in entries if "EVALSHA" in str(e["command"]).upper()]
+
+    def time_calls(self, name: str, params: dict, calls):
+        """Runs each (numkeys, *args) in calls through EVALSHA and records the latencies."""
+        client_ms = []
+        outcomes = {"nil": 0, "empty": 0, "value": 0}
+        self.slowlog_reset()
+        for numkeys, *call_args in calls:
+            start = time.perf_counter()
+            result = self.r.evalsha(self.shas[name], numkeys, *call_args)
+            client_ms.append((time.perf_counter() - start) * 1000)
+            if result is None:
+                outcomes["nil"] += 1
+            elif result in ([], 0):
+                outcomes["empty"] += 1
+            else:
+                outcomes["value"] += 1
+        self.results.append({
+            "script": name,
+            "params": params,
+            "client_ms": summarize(client_ms),
+            "server_us": summarize(self.slowlog_durations()),
+            "outcomes": outcomes,
+        })
+        print(f"{name} {params}: p50 {self.results[-1]['client_ms']['p50']}ms", file=sys.stderr)
+
+    # Scenarios
+
+    def bench_find_match(self):
+        overlap = [self.args.overlap_candidates, 2, 20]
+        hot, cold = self.topics[0], self.topics[-1]
+        for script, extra in (("find_match", []), ("find_match_fifo", []), ("find_match_overlap", overlap)):
+            for k in self.args.interests:
+                for band, topic in (("hot", hot), ("cold", cold)):
+                    users = [self.new_user(k, topic) for _ in range(self.args.calls)]
+                    self.time_calls(
+                        script,
+                        {"interests_per_user": k, "topic": band, "set_size": self.r.scard(f"interest:{{{topic}}}")},
+                        [(0, user_id, *extra) for user_id in users],
+                    )
+
+    def bench_batch_match(self):
+        overlap = [self.args.overlap_candidates, 2, 20]
+        for script, extra in (("batch_match", []), ("batch_match_fifo", []), ("batch_match_overlap", overlap)):
+            for batch_size in (10, 100):
+                self.time_calls(
+                    script,
+                    {"batch_size": batch_size, "scan_limit": 200},
+                    [(0, batch_size, 200, *extra) for _ in range(self.args.calls)],
+                )
+
+    def bench_profile_and_cleanup(self):
+        for k in self.args.interests:
+            users = [self.new_user(k) for _ in range(self.args.calls)]
+            self.time_calls(
+                "set_profile",
+                {"interests_per_user": k},
+                [(1, user_key(user_id), f"specific.bench!{user_id}", ",".join(self.pick_topics(k))) for user_id in users],
+            )
+
+            waiting = self.seeded_users(k, self.args.calls * 2)
+            half = len(waiting) // 2
+            self.time_calls("stop_matching", {"interests_per_user": k}, [(0, u) for u in waiting[:half]])
+            self.time_calls("clean_up", {"interests_per_user": k}, [(0, u) for u in waiting[half:]])
+
+        for batch in (10, 100):
+            calls = []
+            for _ in range(self.args.calls):
+                users = [self.new_user(2) for _ in range(batch)]
+                calls.append((0, *[arg for u in users for arg in (u, f"specific.bench!{u}")]))
+            self.time_calls("clean_up_batch", {"batch_size": batch}, calls)
+
+        pairs = [(self.new_user(1), self.new_user(1)) for _ in range(self.args.calls)]
+        for a, b in pairs:
+            self.r.hset(user_key(a), mapping={"partner": b, "status": "chatting"})
+            self.r.hset(user_key(b), mapping={"partner": a, "status": "chatting"})
+        self.time_calls("end_chat", {"pairs": len(pairs)}, [(0, a) for a, _ in pairs])
+
+    def bench_sharded(self):
+        """The single-slot steps of sharded mode, one find_match costs a few of these."""
+        for band, topic in (("hot", self.topics[0]), ("cold", self.topics[-1])):
+            self.time_calls(
+                "shard_pop",
+                {"topic": band, "queue_size": self.r.zcard(queue_key(topic))},
+                [(1, queue_key(topic), "") for _ in range(self.args.calls)],
+            )
+
+        for k in self.args.interests:
+            users = self.seeded_users(k, self.args.calls)
+            self.time_calls(
+                "shard_transition",
+                {"interests_per_user": k},
+                [(1, user_key(u), "searching", "matching", "", "") for u in users],
+            )
+
+    def bench_presence(self):
+        """Sweeps of lapsed leases, each ghost waits in its queues like a crashed worker's user."""
+        for script, numkeys in (("sweep_presence", 0), ("shard_expire", 1)):
+            for batch in (10, 100):
+                for _ in range(batch * self.args.calls):
+                    self.r.zadd(PRESENCE_KEY, {self.new_user(2): 0})
+                self.time_calls(
+                    script,
+                    {"batch_size": batch},
+                    [(numkeys, *[PRESENCE_KEY] * numkeys, batch) for _ in range(self.args.calls)],
+                )
+
+    def bench_rate_limit(self):
+        for keys in (1, self.args.calls):
+            self.time_calls(
+                "rate_limit",
+                {"distinct_keys": keys},
+                [(1, f"ratelimit:ws:bench:{i % keys}", 5, 0.5, 1) for i in range(self.args.calls)],
+            )
+
+    def run(self) -> dict:
+        self.load_scripts()
+        started = time.perf_counter()
+        self.seed()
+        seed_s = time.perf_counter() - started
+
+        # Batch matching drains the waiting population, so it runs last
+        self.bench_profile_and_cleanup()
+        self.bench_find_match()
+        self.bench_rate_limit()
+        self.bench_sharded()
+        self.bench_presence()
+        self.bench_batch_match()
+
+        sizes = sorted((self.r.scard(f"interest:{{{t}}}") for t in self.topics), reverse=True)
+        return {
+            "fixture": {
+                "users": self.args.users,
+                "topics": self.args.topics,
+                "zipf": self.args.zipf,
+                "interests_per_user": self.args.interests,
+                "largest_sets": sizes[:5],
+                "smallest_sets": sizes[-5:],
+                "seed_s": round(seed_s, 3),
+            },
+            "slowlog": self.slowlog,
+            "results": self.results,
+        }
+
+
+def connect(args):
+    if args.fake:
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit('--fake needs fakeredis: pip install "fakeredis[lua]"')
+        return fakeredis.FakeRedis(decode_responses=True)
+
+    client = redis.Redis(host=args.host, port=args.port, db=args.db, decode_responses=True)
+    if client.dbsize() and not args.flush:
+        raise SystemExit(f"db {args.db} is not empty, pass --flush to wipe it before seeding")
+    if args.flush:
+        client.flushdb()
+    return client
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=15, help="Database to seed (flushed with --flush)")
+    parser.add_argument("--flush", action="store_true", help="FLUSHDB the target database before seeding")
+    parser.add_argument("--fake", action="store_true", help="Use an in-process fakeredis stand-in")
+    parser.add_argument("--users", type=int, default=100_000, help="Waiting users to seed")
+    parser.add_argument("--topics", type=int, default=1000, help="Distinct interests")
+    parser.add_argument("--zipf", type=float, default=1.2, help="Zipf exponent of topic popularity")
+    parser.add_argument("--interests", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8],
+                        help="Comma-separated interests-per-user sizes to seed and measure")
+    parser.add_argument("--calls", type=int, default=200, help="EVALSHA calls per scenario")
+    parser.add_argument("--overlap-candidates", type=int, default=32, help="Candidate cap for the overlap scripts")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client = connect(args)
+
+    slowlog_threshold = None
+    if not args.fake:
+        # Log every command so SLOWLOG holds the server-side duration of each EVALSHA
+        slowlog_threshold = client.config_get("slowlog-log-slower-than")["slowlog-log-slower-than"]
+        client.config_set("slowlog-log-slower-than", 0)
+        client.config_set("slowlog-max-len", max(1024, args.calls * 2))
+
+    try:
+        results = Bench(client, args).run()
+    finally:
+        if slowlog_threshold is not None:
+            client.config_set("slowlog-log-slower-than", slowlog_threshold)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
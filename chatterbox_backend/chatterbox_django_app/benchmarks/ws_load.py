@@ -0,0 +1,260 @@
+"""
+Load generator and latency benchmark for the /ws/textchat protocol.
+
+Drives N simulated clients through the full ChatConsumer protocol:
+connect?id= -> submit_interests -> start_matching -> webrtc_signal -> chat_message -> end_chat
+and reports connect latency, time-to-match, relay latency (p50/p95/p99) and throughput as JSON.
+
+Against a running server:
+    python -m benchmarks.ws_load --url ws://localhost:8000/ws/textchat --clients 200
+
+In-process (boots the ASGI app with uvicorn on a free port):
+    python -m benchmarks.ws_load --serve --redis local --clients 200   # redis-server at REDIS_HOST
+    python -m benchmarks.ws_load --serve --redis fake --clients 200    # fakeredis stand-in
+
+Run from the chatterbox_django_app directory.
+"""
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import random
+import socket
+import sys
+import time
+import uuid
+
+import websockets
+
+from benchmarks.stats import summarize
+
+
+class Metrics:
+    def __init__(self):
+        self.connect_ms = []
+        self.match_ms = []
+        self.chat_relay_ms = []
+        self.signal_relay_ms = []
+        self.sessions = 0
+        self.messages_relayed = 0
+        self.unmatched = 0
+        self.errors = collections.Counter()
+
+
+def interest_picker(topics: int, zipf: float, per_client: int):
+    """Returns a function picking per_client distinct topics from a Zipf(zipf) distribution (0 = uniform)."""
+    names = [f"topic{i}" for i in range(topics)]
+    weights = [1 / (rank + 1) ** zipf for rank in range(topics)]
+
+    def pick():
+        chosen = set()
+        while len(chosen) < min(per_client, topics):
+            chosen.add(random.choices(names, weights)[0])
+        return sorted(chosen)
+
+    return pick
+
+
+def frame(message_type: str, data=None) -> str:
+    message = {
+        "type": message_type,
+        "description": "benchmark",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    if data is not None:
+        message["data"] = data
+    return json.dumps(message)
+
+
+async def run_client(args, url: str, interests: list, metrics: Metrics):
+    user_id = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+
+    start = time.perf_counter()
+    try:
+        ws = await asyncio.wait_for(websockets.connect(f"{url}?id={user_id}"), args.timeout)
+    except Exception as e:
+        metrics.errors[f"connect:{type(e).__name__}"] += 1
+        return
+
+    try:
+        async with ws:
+            reply = json.loads(await asyncio.wait_for(ws.recv(), args.timeout))
+            if reply["type"] != "connection_established":
+                metrics.errors["connect:rejected"] += 1
+                return
+            metrics.connect_ms.append((time.perf_counter() - start) * 1000)
+
+            await ws.send(frame("submit_interests", {"interests": interests}))
+            await asyncio.wait_for(ws.recv(), args.timeout)
+
+            # Wait for the room assignment, retrying start_matching like older clients if asked to
+            match_start = time.perf_counter()
+            role = None
+            await ws.send(frame("start_matching"))
+            last_try = match_start
+            while role is None:
+                remaining = args.match_timeout - (time.perf_counter() - match_start)
+                if remaining <= 0:
+                    metrics.unmatched += 1
+                    await ws.send(frame("end_matching"))
+                    return
+                wait = remaining if not args.retry_interval else min(remaining, args.retry_interval)
+                try:
+                    reply = json.loads(await asyncio.wait_for(ws.recv(), wait))
+                except asyncio.TimeoutError:
+                    reply = {"type": "timeout"}
+
+                if reply["type"] == "success_matched":
+                    role = reply["data"]["role"]
+                elif args.retry_interval and time.perf_counter() - last_try >= args.retry_interval:
+                    last_try = time.perf_counter()
+                    await ws.send(frame("start_matching"))
+            metrics.match_ms.append((time.perf_counter() - match_start) * 1000)
+
+            # The caller drives the chat: signalling burst, chat messages, then end_chat
+            expected = args.messages + (args.signals if role == "callee" else 0)
+            received = 0
+            partner_left = False
+
+            async def reader():
+                nonlocal received, partner_left
+                while received < expected or (role == "callee" and not partner_left):
+                    reply = json.loads(await ws.recv())
+                    if reply["type"] == "chat_message":
+                        sent_at = float(reply["data"]["message"].split(":")[1])
+                        metrics.chat_relay_ms.append((time.perf_counter() - sent_at) * 1000)
+                        received += 1
+                    elif reply["type"] == "webrtc_signal":
+                        sent_at = reply["data"]["bench_sent_at"]
+                        metrics.signal_relay_ms.append((time.perf_counter() - sent_at) * 1000)
+                        received += 1
+                    elif reply["type"] == "partner_left_chat":
+                        partner_left = True
+                        return
+                    elif reply["type"] == "error":
+                        metrics.errors[f"server:{reply['description']}"] += 1
+
+            read_task = asyncio.create_task(reader())
+
+            if role == "caller":
+                for i in range(args.signals):
+                    await ws.send(frame("webrtc_signal", {
+                        "candidate": "x" * args.signal_size,
+                        "bench_sent_at": time.perf_counter(),
+                    }))
+            for i in range(args.messages):
+                await ws.send(frame("chat_message", {"message": f"bench:{time.perf_counter()}"}))
+                await asyncio.sleep(args.message_interval)
+
+            try:
+                await asyncio.wait_for(read_task, args.timeout)
+            except asyncio.TimeoutError:
+                metrics.errors["relay:timeout"] += 1
+            metrics.messages_relayed += received
+
+            if role == "caller":
+                await ws.send(frame("end_chat"))
+                await asyncio.wait_for(ws.recv(), args.timeout)
+            metrics.sessions += 1
+    except websockets.ConnectionClosed as e:
+        metrics.errors[f"closed:{e.rcvd.code if e.rcvd else 'none'}"] += 1
+    except asyncio.TimeoutError:
+        metrics.errors["timeout"] += 1
+
+
+async def serve_in_process(args):
+    """Starts the ASGI app with uvicorn on a free local port and returns (server, url)."""
+    from benchmarks.django_env import setup_django
+
+    setup_django(args.redis)
+
+    import uvicorn
+    from chatterbox_django_app.asgi import application
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    config = uvicorn.Config(
+        application, host="127.0.0.1", port=port, ws="websockets",
+        log_level="warning", lifespan="off",
+    )
+    server = uvicorn.Server(config)
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, f"ws://127.0.0.1:{port}/ws/textchat"
+
+
+async def main(args):
+    server = None
+    url = args.url
+    if args.serve:
+        server, url = await serve_in_process(args)
+
+    pick = interest_picker(args.topics, args.zipf, args.per_client)
+    metrics = Metrics()
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(args.clients):
+        tasks.append(asyncio.create_task(run_client(args, url, pick(), metrics)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.clients)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    if server is not None:
+        server.should_exit = True
+
+    return {
+        "config": {k: v for k, v in vars(args).items()},
+        "elapsed_s": round(elapsed, 3),
+        "connect_ms": summarize(metrics.connect_ms),
+        "time_to_match_ms": summarize(metrics.match_ms),
+        "chat_relay_ms": summarize(metrics.chat_relay_ms),
+        "signal_relay_ms": summarize(metrics.signal_relay_ms),
+        "throughput": {
+            "sessions_per_s": round(metrics.sessions / elapsed, 3),
+            "messages_relayed_per_s": round(metrics.messages_relayed / elapsed, 3),
+        },
+        "sessions": metrics.sessions,
+        "unmatched": metrics.unmatched,
+        "errors": dict(metrics.errors),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="WebSocket URL of a running server, e.g. ws://localhost:8000/ws/textchat")
+    target.add_argument("--serve", action="store_true", help="Boot the ASGI app in-process")
+    parser.add_argument("--redis", choices=["local", "fake"], default="local", help="Redis used with --serve")
+    parser.add_argument("--clients", type=int, default=100, help="Number of simulated clients")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which clients are started")
+    parser.add_argument("--topics", type=int, default=10, help="Number of distinct interests")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent of topic popularity (0 = uniform)")
+    parser.add_argument("--per-client", type=int, default=2, help="Interests submitted per client")
+    parser.add_argument("--messages", type=int, default=3, help="Chat messages sent by each client")
+    parser.add_argument("--message-interval", type=float, default=0.2, help="Seconds between chat messages")
+    parser.add_argument("--signals", type=int, default=10, help="WebRTC signals sent by the caller")
+    parser.add_argument("--signal-size", type=int, default=200, help="Bytes of padding per WebRTC signal")
+    parser.add_argument("--retry-interval", type=float, default=0.0, help="Resend start_matching every N seconds (0 = never)")
+    parser.add_argument("--match-timeout", type=float, default=30.0, help="Give up matching after N seconds")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Timeout for individual protocol steps")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
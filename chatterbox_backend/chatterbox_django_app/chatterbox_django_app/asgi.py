@@ -9,17 +9,23 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
-from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
-from text_chat_app.routing import websocket_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatterbox_django_app.settings')
 
+# Set up Django before the app modules are imported, they read settings at import time
+django_asgi_app = get_asgi_application()
+
+from text_chat_app.lifespan import lifespan_app  # noqa: E402
+from text_chat_app.routing import websocket_urlpatterns  # noqa: E402
+
 application = ProtocolTypeRouter(
     {
-        "http": get_asgi_application(),
-        "websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
+        "http": django_asgi_app,
+        # No auth or session middleware: consumers never read scope["user"] or the session,
+        # and the stack would parse cookies and build a lazy user on every handshake
+        "websocket": URLRouter(websocket_urlpatterns),
+        "lifespan": lifespan_app,
     }
 )
\ No newline at end of file
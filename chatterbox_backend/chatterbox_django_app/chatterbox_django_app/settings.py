@@ -28,6 +28,11 @@ DEBUG = bool(os.environ.get("DEBUG", default=0))
 
 ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS").split(",")
 
+# Chat-only nodes (CHAT_ONLY=1) run without admin, auth, sessions, messages and DRF.
+# The WebSocket consumers and the metrics endpoint use none of them, and without them
+# workers boot faster and handle less per request.
+CHAT_ONLY = bool(int(os.getenv("CHAT_ONLY", 0)))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -52,6 +57,17 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if CHAT_ONLY:
+    INSTALLED_APPS = [
+        'core',
+        'text_chat_app',
+    ]
+
+    MIDDLEWARE = [
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+    ]
+
 ROOT_URLCONF = 'chatterbox_django_app.urls'
 
 TEMPLATES = [
@@ -83,9 +99,10 @@ DATABASES = {
 }
 
 # Django channels Redis configuration
+# LocalFastPathChannelLayer delivers messages between consumers of the same worker in memory
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "core.channel_layers.LocalFastPathChannelLayer",
         "CONFIG": {
             "hosts": [("redis", 6379)],  # service name in docker-compose
         },
@@ -93,9 +110,85 @@ CHANNEL_LAYERS = {
 }
 
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = 6379
-REDIS_POOL_SIZE = 20 
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", 20))  # connections per worker, shared by all of its sockets
 REDIS_POOL_TIMEOUT = 30
+REDIS_POOL_WAIT_TIMEOUT = float(os.getenv("REDIS_POOL_WAIT_TIMEOUT", 2))  # seconds to wait for a free connection before failing
+REDIS_AUTO_PIPELINE = bool(int(os.getenv("REDIS_AUTO_PIPELINE", 1)))  # batch concurrent commands into one round trip
+# Redis Cluster: REDIS_HOST/REDIS_PORT point at any node of the cluster, needs MATCH_QUEUE_MODE = "sharded"
+REDIS_CLUSTER = bool(int(os.getenv("REDIS_CLUSTER", 0)))
+# Install the Lua scripts as Redis 7 function libraries (FCALL), which survive restarts and flushes.
+# Falls back to EVALSHA on an older Redis.
+REDIS_FUNCTIONS = bool(int(os.getenv("REDIS_FUNCTIONS", 0)))
+# Libraries of other deploys not loaded for this long are deleted. A deploy that runs longer
+# loads its own again on the first "Function not found".
+REDIS_FUNCTIONS_RETENTION = int(os.getenv("REDIS_FUNCTIONS_RETENTION", 86400))  # seconds
+
+# Control plane (rate limit buckets) on its own pool, optionally its own Redis. Calls fail open past the timeout.
+REDIS_INFRA_HOST = os.getenv("REDIS_INFRA_HOST")  # unset: same Redis as matching (db 2)
+REDIS_INFRA_PORT = int(os.getenv("REDIS_INFRA_PORT", REDIS_PORT))
+REDIS_INFRA_POOL_SIZE = int(os.getenv("REDIS_INFRA_POOL_SIZE", 15))
+REDIS_INFRA_TIMEOUT = float(os.getenv("REDIS_INFRA_TIMEOUT", 0.25))  # seconds, connect/read/pool wait
+# Background work on the matching data (presence, sweeps, batched cleanup, metrics sampling)
+REDIS_HOUSEKEEPING_POOL_SIZE = int(os.getenv("REDIS_HOUSEKEEPING_POOL_SIZE", 4))
+REDIS_HOUSEKEEPING_TIMEOUT = float(os.getenv("REDIS_HOUSEKEEPING_TIMEOUT", 5))  # seconds, connect/read/pool wait
+
+# Circuit breakers around request-path Redis calls (one per pool and worker)
+REDIS_CALL_DEADLINE = float(os.getenv("REDIS_CALL_DEADLINE", 1))  # seconds a handler waits for a script
+REDIS_BREAKER_FAILURES = int(os.getenv("REDIS_BREAKER_FAILURES", 5))  # consecutive failures that open the circuit
+REDIS_BREAKER_RESET = float(os.getenv("REDIS_BREAKER_RESET", 5))  # seconds of failing fast before a probe call
+
+# Admission control at connect, decided before any Redis work
+WS_MAX_CONNECTIONS_PER_WORKER = int(os.getenv("WS_MAX_CONNECTIONS_PER_WORKER", 5000))
+WS_GLOBAL_MAX_CONNECTIONS = int(os.getenv("WS_GLOBAL_MAX_CONNECTIONS", 0))  # users online across all workers, 0 for no limit
+
+# Metrics endpoint: Redis-backed gauges are refreshed at most every METRICS_SAMPLE_INTERVAL seconds
+# and only METRICS_QUEUE_SAMPLE random interest queues are measured per refresh
+METRICS_SAMPLE_INTERVAL = float(os.getenv("METRICS_SAMPLE_INTERVAL", 10))
+METRICS_QUEUE_SAMPLE = int(os.getenv("METRICS_QUEUE_SAMPLE", 50))
+METRICS_QUEUE_TOP = int(os.getenv("METRICS_QUEUE_TOP", 20))  # only the largest sampled queues get a series
+
+# Rate limiting: buckets are kept in process memory and synced to Redis at most this often (seconds)
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", 5))
+
+# Interest catalog: submitted interests are normalized, capped and interned to integer IDs (see interests.py)
+INTEREST_MAX_PER_USER = int(os.getenv("INTEREST_MAX_PER_USER", 5))  # further interests are dropped
+INTEREST_MAX_LENGTH = int(os.getenv("INTEREST_MAX_LENGTH", 32))  # characters, longer interests are dropped
+INTEREST_CATALOG_SIZE = int(os.getenv("INTEREST_CATALOG_SIZE", 50000))  # distinct interests, new ones are dropped once full
+
+# Interest queue mode
+# "random": interest:{topic} sets, a random waiter is picked (SPOP)
+# "fifo": interest_q:{topic} sorted sets scored by enqueue time, the oldest waiter is picked
+# "overlap": interest:{topic} sets, the sampled waiter sharing the most interests is picked
+# "sharded": interest_q:{topic} queues matched with single-slot scripts, required with REDIS_CLUSTER
+MATCH_QUEUE_MODE = os.getenv("MATCH_QUEUE_MODE", "random")
+
+# Overlap mode tuning
+MATCH_OVERLAP_CANDIDATES = int(os.getenv("MATCH_OVERLAP_CANDIDATES", 32))  # max waiters scored per attempt
+MATCH_OVERLAP_MIN = int(os.getenv("MATCH_OVERLAP_MIN", 2))  # shared interests required at first
+MATCH_OVERLAP_FALLBACK = int(os.getenv("MATCH_OVERLAP_FALLBACK", 20))  # seconds before 1 shared interest is enough
+
+# Background matchmaker (one per worker), pairs queued users in batches every tick
+MATCHMAKER_ENABLED = bool(int(os.getenv("MATCHMAKER_ENABLED", 1)))
+MATCHMAKER_TICK = float(os.getenv("MATCHMAKER_TICK", 0.5))  # seconds between batches
+MATCHMAKER_BATCH_SIZE = int(os.getenv("MATCHMAKER_BATCH_SIZE", 100))  # max pairs per batch
+MATCHMAKER_SCAN_LIMIT = int(os.getenv("MATCHMAKER_SCAN_LIMIT", 200))  # max topics inspected per batch
+
+# Long-poll HTTP matching (GET /textchat/match/), a request waits at most this long for a match (seconds)
+MATCH_LONG_POLL_TIMEOUT = float(os.getenv("MATCH_LONG_POLL_TIMEOUT", 120))
+
+# Presence leases, users whose worker died stop being matched once their lease lapses
+PRESENCE_LEASE = float(os.getenv("PRESENCE_LEASE", 30))  # seconds a lease lasts without renewal
+PRESENCE_HEARTBEAT = float(os.getenv("PRESENCE_HEARTBEAT", 10))  # seconds between renewals and sweeps
+PRESENCE_SWEEP_BATCH = int(os.getenv("PRESENCE_SWEEP_BATCH", 100))  # max lapsed users cleaned up per sweep
+
+# Disconnect cleanup, coalesced per worker so restarts and reconnect storms cost a few batched calls
+CLEANUP_COALESCE_WINDOW = float(os.getenv("CLEANUP_COALESCE_WINDOW", 0.1))  # seconds disconnects are collected, 0 cleans up inline
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", 500))  # max users per clean_up_batch call
+
+# Graceful drain on SIGTERM / lifespan shutdown (the container stop timeout must be longer than the grace period)
+DRAIN_GRACE_PERIOD = float(os.getenv("DRAIN_GRACE_PERIOD", 30))  # seconds active chats may continue
+DRAIN_RECONNECT_SPREAD = float(os.getenv("DRAIN_RECONNECT_SPREAD", 30))  # seconds the reconnect hints are spread over
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -14,14 +14,21 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    # path('textchat/', include('text_chat_app.urls')),
+    path('textchat/', include('text_chat_app.urls')),
 ]
 
+# Not installed on chat-only nodes (CHAT_ONLY=1)
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
+
 # End points
 # wss://api.joshuanoahdlima.info/ws/textchat?id=<sha256_hashed_device_id>  -> WebSocket endpoint for text-chat
-# https://api.joshuanoahdlima.info/admin/  -> Admin panel (useless for now)
\ No newline at end of file
+# https://api.joshuanoahdlima.info/admin/  -> Admin panel (useless for now)
+# https://api.joshuanoahdlima.info/textchat/match/?id=<sha256_hashed_device_id>&interests=<interest>  -> Long-poll matching over plain HTTP
+# https://api.joshuanoahdlima.info/textchat/metrics/  -> Prometheus metrics of the worker serving the request
\ No newline at end of file
@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import logging
+import time
+
+from channels.exceptions import ChannelFull
+from channels_redis.core import RedisChannelLayer
+
+logger = logging.getLogger(__name__)
+
+# group_send's delivery script without the group: drop expired messages, then push the
+# message to every channel key under capacity
+SEND_MANY_LUA = """
+local current_time = ARGV[#ARGV - 1]
+local expiry = ARGV[#ARGV]
+local over_capacity = 0
+for i = 1, #KEYS do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], 0, current_time - expiry)
+    if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+        redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+        redis.call('EXPIRE', KEYS[i], expiry)
+    else
+        over_capacity = over_capacity + 1
+    end
+end
+return over_capacity
+"""
+
+class LocalFastPathChannelLayer(RedisChannelLayer):
+    """
+    RedisChannelLayer with a same-process fast path.
+
+    With several uvicorn workers, a good share of matched partners live in the same
+    process. Messages to a process-local channel that is still open are appended to an
+    in-memory buffer the consumer reads from, so they cost zero Redis operations.
+    Everything else goes through Redis as usual.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Channels created by this process whose consumer hasn't disconnected yet
+        self.local_channels = set()
+        self.local_buffers = collections.defaultdict(collections.deque)
+        self.local_events = collections.defaultdict(asyncio.Event)
+        # Redis receives kept alive across calls, so a local message never cancels one mid-read
+        self.redis_receives = {}
+
+    async def new_channel(self, prefix="specific"):
+        channel = await super().new_channel(prefix)
+        self.local_channels.add(channel)
+        return channel
+
+    def discard_local_channel(self, channel):
+        """Called by a consumer on disconnect, later messages go through Redis and expire there."""
+        self.local_channels.discard(channel)
+        self.local_buffers.pop(channel, None)
+        self.local_events.pop(channel, None)
+
+    async def send(self, channel, message):
+        if channel in self.local_channels:
+            assert isinstance(message, dict), "message is not a dict"
+            buffer = self.local_buffers[channel]
+            # Same semantics as the Redis path: reject instead of silently dropping when full
+            if len(buffer) >= self.get_capacity(channel):
+                raise ChannelFull()
+            buffer.append(dict(message))
+            self.local_events[channel].set()
+            return
+
+        await super().send(channel, message)
+
+    async def send_many(self, channels, message):
+        """
+        Sends the same message to many channels, with one Redis call per Redis host instead
+        of one send() each. Full channels are skipped (and logged) rather than raising.
+        """
+        remote = []
+        for channel in channels:
+            if channel not in self.local_channels:
+                remote.append(channel)
+                continue
+            try:
+                await self.send(channel, message)
+            except ChannelFull:
+                logger.info("Channel %s over capacity in send_many", channel)
+
+        if not remote:
+            return
+
+        (
+            connection_to_channel_keys,
+            channel_keys_to_message,
+            channel_keys_to_capacity,
+        ) = self._map_channel_keys_to_connection(remote, message)
+
+        for connection_index, channel_redis_keys in connection_to_channel_keys.items():
+            args = [channel_keys_to_message[key] for key in channel_redis_keys]
+            args += [channel_keys_to_capacity[key] for key in channel_redis_keys]
+            args += [time.time(), self.expiry]
+
+            connection = self.connection(connection_index)
+            over_capacity = await connection.eval(
+                SEND_MANY_LUA, len(channel_redis_keys), *channel_redis_keys, *args
+            )
+            if over_capacity > 0:
+                logger.info("%s of %s channels over capacity in send_many", over_capacity, len(remote))
+
+    async def receive(self, channel):
+        if channel not in self.local_channels:
+            redis_task = self.redis_receives.pop(channel, None)
+            if redis_task is not None:
+                return await redis_task
+            return await super().receive(channel)
+
+        buffer = self.local_buffers[channel]
+        event = self.local_events[channel]
+
+        while not buffer:
+            event.clear()
+
+            redis_task = self.redis_receives.get(channel)
+            if redis_task is None:
+                redis_task = asyncio.ensure_future(super().receive(channel))
+                self.redis_receives[channel] = redis_task
+            local_task = asyncio.ensure_future(event.wait())
+
+            try:
+                await asyncio.wait(
+                    [redis_task, local_task], return_when=asyncio.FIRST_COMPLETED
+                )
+            except asyncio.CancelledError:
+                local_task.cancel()
+                redis_task.cancel()
+                self.redis_receives.pop(channel, None)
+                raise
+
+            local_task.cancel()
+            if redis_task.done():
+                del self.redis_receives[channel]
+                return redis_task.result()
+
+        return buffer.popleft()
@@ -1,4 +1,5 @@
 import functools
+from core.metrics import RATE_LIMIT_REJECTIONS
 from core.services.rate_limit import RateLimit
 
 def websocket_rate_limit(limit: int, period: int):
@@ -7,19 +8,26 @@ def websocket_rate_limit(limit: int, period: int):
     Sends an error JSON back to the client if the limit is exceeded.
     """
     def decorator(func):
+        # One limiter per decorated handler, it keeps the per-user buckets in process memory.
+        # Built on first use: the decorator runs while consumers.py is imported, which can be
+        # before the settings are configured.
+        limiter = None
+
         @functools.wraps(func)
         async def wrapper(self, *args, **kwargs):
+            nonlocal limiter
+            if limiter is None:
+                limiter = RateLimit(limit=limit, period=period, scope=func.__name__)
+
             # 'self' is the AsyncWebsocketConsumer instance.
             # For anonymous Omegle-style routing, channel_name is a great unique ID.
             identifier = self.user_id 
             
-            # Initialize our rate limiter
-            limiter = RateLimit(limit=limit, period=period)
-            
             # Check if the action is allowed
             is_allowed = await limiter.check_rate_limit(identifier)
             
             if not is_allowed:
+                RATE_LIMIT_REJECTIONS.inc(func.__name__)
                 # If blocked, notify the client and halt execution
                 await self.send_response("error", "Rate limit exceeded")
                 return  # Crucial: Drop the request, do not execute the function
@@ -0,0 +1,257 @@
+import bisect
+import functools
+import os
+import time
+
+# Latency buckets in seconds, from sub-millisecond Redis calls up to slow matches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value) -> str:
+    # Label values are written between double quotes, see the Prometheus text format
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter. Series for known label values are pre-allocated so inc() is a dict lookup."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), labelvalues=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        for labels in labelvalues:
+            self.values[labels if isinstance(labels, tuple) else (labels,)] = 0.0
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = float(value)
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def clear(self):
+        self.values.clear()
+
+
+class Histogram:
+    """Fixed-bucket histogram, observe() is a bisect and two additions."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), labelvalues=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.series = {}
+        for labels in labelvalues:
+            self._new_series(labels if isinstance(labels, tuple) else (labels,))
+
+    def _new_series(self, labels):
+        series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        return series
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels) or self._new_series(labels)
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def set_series(self, labels, bucket_counts, total):
+        """Replaces a series with externally collected data (e.g. a histogram kept in Redis)."""
+        self.series[labels] = [list(bucket_counts), total]
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for le, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le_label = f'le="{le}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le_label)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        lines.append(f'chatterbox_worker_info{{pid="{os.getpid()}"}} 1')
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "chatterbox_handler_seconds",
+    "Time spent in ChatConsumer handlers.",
+    labelnames=("handler",),
+    labelvalues=("receive", "find_match", "end_chat", "disconnect"),
+))
+EVALSHA_SECONDS = REGISTRY.register(Histogram(
+    "chatterbox_evalsha_seconds",
+    "Time spent running Lua scripts through EVALSHA.",
+    labelnames=("script",),
+))
+RATE_LIMIT_REJECTIONS = REGISTRY.register(Counter(
+    "chatterbox_rate_limit_rejections_total",
+    "WebSocket actions rejected by the rate limiter.",
+    labelnames=("handler",),
+    labelvalues=("find_match", "handle_chat_message"),
+))
+OPEN_SOCKETS = REGISTRY.register(Gauge(
+    "chatterbox_open_sockets",
+    "WebSocket connections currently open on this worker.",
+    labelvalues=((),),
+))
+INTEREST_QUEUE_USERS = REGISTRY.register(Gauge(
+    "chatterbox_interest_queue_users",
+    "Users waiting per interest queue (sampled).",
+    labelnames=("interest",),
+))
+ACTIVE_MATCHES = REGISTRY.register(Gauge(
+    "chatterbox_active_matches",
+    "Matched sockets on this worker (two per chat when summed across workers).",
+    labelvalues=((),),
+))
+REDIS_POOL_IN_USE = REGISTRY.register(Gauge(
+    "chatterbox_redis_pool_in_use_connections",
+    "Redis connections currently checked out of each pool on this worker.",
+    labelnames=("pool",),
+))
+PRESENCE_ENDED_CHATS = REGISTRY.register(Counter(
+    "chatterbox_presence_ended_chats_total",
+    "Chats ended by the presence sweeper because one side's lease lapsed.",
+    labelvalues=((),),
+))
+DRAINING = REGISTRY.register(Gauge(
+    "chatterbox_draining",
+    "1 while this worker is draining before shutdown, deploy tooling waits for chatterbox_open_sockets to reach 0.",
+    labelvalues=((),),
+))
+CLEANUP_BATCH_USERS = REGISTRY.register(Histogram(
+    "chatterbox_cleanup_batch_users",
+    "Disconnected users cleaned up per clean_up_batch call.",
+    buckets=(1, 10, 50, 100, 250, 500, 1000),
+))
+REDIS_POOL_WAITERS = REGISTRY.register(Gauge(
+    "chatterbox_redis_pool_waiters",
+    "Callers currently waiting for a connection from each pool on this worker.",
+    labelnames=("pool",),
+    labelvalues=("common", "infra", "housekeeping"),
+))
+REDIS_POOL_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "chatterbox_redis_pool_wait_seconds",
+    "Time spent waiting to check a connection out of each pool.",
+    labelnames=("pool",),
+    labelvalues=("common", "infra", "housekeeping"),
+))
+REDIS_POOL_TIMEOUTS = REGISTRY.register(Counter(
+    "chatterbox_redis_pool_timeouts_total",
+    "Checkouts that gave up after REDIS_POOL_WAIT_TIMEOUT because every connection stayed busy.",
+    labelnames=("pool",),
+    labelvalues=("common", "infra", "housekeeping"),
+))
+REDIS_AUTOPIPELINE_COMMANDS = REGISTRY.register(Histogram(
+    "chatterbox_redis_autopipeline_commands",
+    "Commands sent per automatic pipeline flush of the shared client.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250),
+))
+MATCH_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "chatterbox_match_wait_seconds",
+    "Time matched users waited in FIFO mode (cluster-wide, from the match_wait_seconds hash).",
+    buckets=(1, 5, 15, 30, 60, 120, 300),
+))
+
+CIRCUIT_BREAKER_STATE = REGISTRY.register(Gauge(
+    "chatterbox_circuit_breaker_state",
+    "Redis circuit breaker state on this worker: 0 closed, 1 half-open (probing), 2 open (failing fast).",
+    labelnames=("breaker",),
+    labelvalues=("common", "infra"),
+))
+CIRCUIT_BREAKER_TRIPS = REGISTRY.register(Counter(
+    "chatterbox_circuit_breaker_trips_total",
+    "Times each Redis circuit breaker opened.",
+    labelnames=("breaker",),
+    labelvalues=("common", "infra"),
+))
+CIRCUIT_BREAKER_REJECTIONS = REGISTRY.register(Counter(
+    "chatterbox_circuit_breaker_rejections_total",
+    "Calls failed fast because the circuit was open.",
+    labelnames=("breaker",),
+    labelvalues=("common", "infra"),
+))
+
+CONNECTIONS_REJECTED = REGISTRY.register(Counter(
+    "chatterbox_connections_rejected_total",
+    "WebSocket connections turned away at connect, by reason.",
+    labelnames=("reason",),
+    labelvalues=("draining", "degraded", "worker_full", "global_full"),
+))
+LONG_POLL_WAITERS = REGISTRY.register(Gauge(
+    "chatterbox_long_poll_waiters",
+    "HTTP match requests currently parked on this worker, waiting for a partner.",
+    labelvalues=((),),
+))
+
+
+def timed(histogram: Histogram, label: str):
+    """Decorator recording how long an async function takes into histogram[label]."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(label):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,62 +1,247 @@
 import redis.asyncio as redis
+from redis.asyncio.cluster import RedisCluster
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from core.metrics import (
+    REDIS_AUTOPIPELINE_COMMANDS,
+    REDIS_POOL_TIMEOUTS,
+    REDIS_POOL_WAIT_SECONDS,
+    REDIS_POOL_WAITERS,
+)
 import logging
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 
+# Commands that block or change the connection's state, they never share a pipeline
+UNPIPELINED_COMMANDS = {
+    "BLPOP", "BRPOP", "BLMOVE", "BRPOPLPUSH", "BLMPOP", "BZPOPMIN", "BZPOPMAX", "BZMPOP",
+    "XREAD", "XREADGROUP", "WAIT", "WATCH", "UNWATCH", "MULTI", "EXEC", "DISCARD", "SELECT",
+}
+
+
+class MeteredBlockingConnectionPool(redis.BlockingConnectionPool):
+    """
+    BlockingConnectionPool that reports its queue: callers waiting for a connection,
+    how long they waited, and how many gave up after the pool's timeout.
+    """
+
+    def __init__(self, *args, pool_name: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_name = pool_name
+
+    async def get_connection(self, *args, **kwargs):
+        REDIS_POOL_WAITERS.inc(self.pool_name)
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            if isinstance(e.__cause__, asyncio.TimeoutError):
+                REDIS_POOL_TIMEOUTS.inc(self.pool_name)
+            raise
+        finally:
+            REDIS_POOL_WAITERS.dec(self.pool_name)
+            REDIS_POOL_WAIT_SECONDS.observe(time.perf_counter() - start, self.pool_name)
+
+
+class AutoPipelineRedis(redis.Redis):
+    """
+    Redis client that sends the commands issued in one event loop iteration as one pipeline.
+
+    Every socket of a worker shares this client. Instead of each command checking out a
+    connection for its own round trip, commands are queued and flushed together on the
+    next iteration: one connection and one round trip per batch. Errors are delivered to
+    the command that caused them, as if it had run alone.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queued = [] # (args, options, future) waiting for the next flush
+        self._flushes = set() # Strong references to the running flush tasks, the loop only keeps weak ones
+
+    async def execute_command(self, *args, **options):
+        if self.connection is not None or args[0] in UNPIPELINED_COMMANDS:
+            return await super().execute_command(*args, **options)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queued.append((args, options, future))
+        if len(self._queued) == 1:
+            loop.call_soon(self._start_flush, loop)
+        return await future
+
+    def _start_flush(self, loop):
+        task = loop.create_task(self._flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self):
+        batch, self._queued = self._queued, []
+        REDIS_AUTOPIPELINE_COMMANDS.observe(len(batch))
+
+        if len(batch) == 1:
+            args, options, future = batch[0]
+            try:
+                result = await super().execute_command(*args, **options)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        pipe = self.pipeline(transaction=False)
+        for args, options, _ in batch:
+            pipe.execute_command(*args, **options)
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            # The whole round trip failed (connection lost, pool timeout)
+            results = [e] * len(batch)
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done(): # the caller was cancelled
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
 # Initialize pools as None at the module level
-_common_pool = None
-_infra_pool = None
+_common_pool = None # Hot path: matching, chat and room state
+_infra_pool = None # Control plane with its own data: rate limit buckets, optionally on another host
+_housekeeping_pool = None # Background work on the matching data: presence, sweeps, batched cleanup, metrics
+_common_client = None # Shared by every socket of the worker, never closed per socket
+_infra_client = None
+_housekeeping_client = None
+_cluster_client = None # REDIS_CLUSTER: one client per worker, it keeps a pool per node
 _init_lock = asyncio.Lock() # Lock to prevent thundering herd on initialization
 
 async def _initialize_pools():
     """Initializes the connection pools if they haven't been already."""
-    global _common_pool, _infra_pool
+    global _common_pool, _infra_pool, _housekeeping_pool
+    global _common_client, _infra_client, _housekeeping_client
 
     if _common_pool is None:
         async with _init_lock:
             if _common_pool is None:
                 try:
                     logger.info("Initializing Redis connection pools...")
-                    _common_pool = redis.ConnectionPool(
+                    # Blocking: a burst beyond REDIS_POOL_SIZE waits for a free connection
+                    # (up to REDIS_POOL_WAIT_TIMEOUT) instead of failing with "Too many connections"
+                    common_pool = MeteredBlockingConnectionPool(
+                        pool_name="common",
                         host=settings.REDIS_HOST,
                         port=settings.REDIS_PORT,
                         db=1,
                         max_connections=settings.REDIS_POOL_SIZE,
+                        timeout=settings.REDIS_POOL_WAIT_TIMEOUT,
                         socket_connect_timeout=settings.REDIS_POOL_TIMEOUT,
                         decode_responses=True
                     )
-                    _infra_pool = redis.ConnectionPool(
+                    # Short timeouts everywhere (connect, read, pool wait): callers fail open
+                    # instead of letting a slow control plane delay a user's request
+                    infra_pool = MeteredBlockingConnectionPool(
+                        pool_name="infra",
+                        host=settings.REDIS_INFRA_HOST or settings.REDIS_HOST,
+                        port=settings.REDIS_INFRA_PORT,
+                        db=2,
+                        max_connections=settings.REDIS_INFRA_POOL_SIZE,
+                        timeout=settings.REDIS_INFRA_TIMEOUT,
+                        socket_connect_timeout=settings.REDIS_INFRA_TIMEOUT,
+                        socket_timeout=settings.REDIS_INFRA_TIMEOUT,
+                        decode_responses=True
+                    )
+                    # Same Redis and db as common (the Lua scripts read presence there),
+                    # separate connections so background bursts never queue behind users
+                    housekeeping_pool = MeteredBlockingConnectionPool(
+                        pool_name="housekeeping",
                         host=settings.REDIS_HOST,
                         port=settings.REDIS_PORT,
-                        db=2,
-                        max_connections=15,
-                        socket_connect_timeout=2,
+                        db=1,
+                        max_connections=settings.REDIS_HOUSEKEEPING_POOL_SIZE,
+                        timeout=settings.REDIS_HOUSEKEEPING_TIMEOUT,
+                        socket_connect_timeout=settings.REDIS_HOUSEKEEPING_TIMEOUT,
+                        socket_timeout=settings.REDIS_HOUSEKEEPING_TIMEOUT,
                         decode_responses=True
                     )
-                    logger.info("Redis connection pools initialized successfully.")
                 except Exception as e:
                     logger.exception(f"Failed to initialize Redis pools: {e}")
-                    _common_pool = None
-                    _infra_pool = None
                     raise
 
+                client_class = AutoPipelineRedis if settings.REDIS_AUTO_PIPELINE else redis.Redis
+                _common_client = client_class(connection_pool=common_pool)
+                _infra_client = redis.Redis(connection_pool=infra_pool)
+                _housekeeping_client = redis.Redis(connection_pool=housekeeping_pool)
+                _infra_pool = infra_pool
+                _housekeeping_pool = housekeeping_pool
+                _common_pool = common_pool # last, it marks the pools as initialized
+                logger.info("Redis connection pools initialized successfully.")
+
+async def _initialize_cluster():
+    """Connects to the cluster (discovering every node) if it hasn't been already."""
+    global _cluster_client
+
+    if _cluster_client is None:
+        async with _init_lock:
+            if _cluster_client is None:
+                # The other modes run multi-user scripts that touch keys in several slots
+                if settings.MATCH_QUEUE_MODE != "sharded":
+                    raise ImproperlyConfigured('REDIS_CLUSTER requires MATCH_QUEUE_MODE = "sharded"')
+
+                logger.info("Connecting to Redis Cluster...")
+                client = RedisCluster(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    max_connections=settings.REDIS_POOL_SIZE,
+                    socket_connect_timeout=settings.REDIS_POOL_TIMEOUT,
+                    decode_responses=True
+                )
+                await client.initialize()
+                _cluster_client = client
+                logger.info("Redis Cluster client initialized successfully.")
+
 # This function must now be async to use the async lock
 async def get_redis_client(pool_name: str = "common") -> redis.Redis:
     """
-    Lazily initializes and returns a Redis client from the specified pool.
+    Lazily initializes and returns the worker's shared Redis client for the specified pool:
+    "common" (matching and chat), "infra" (rate limiting) or "housekeeping" (background work).
+    Callers must not close it. With REDIS_CLUSTER every pool name returns the shared cluster
+    client (a cluster has no db numbers), except "infra" when REDIS_INFRA_HOST names its own Redis.
     """
-    if _common_pool is None or _infra_pool is None:
+    if pool_name not in ("common", "infra", "housekeeping"):
+        raise ValueError(f"Unknown Redis pool name: {pool_name}")
+
+    if settings.REDIS_CLUSTER and not (pool_name == "infra" and settings.REDIS_INFRA_HOST):
+        if _cluster_client is None:
+            await _initialize_cluster()
+        return _cluster_client
+
+    if _common_pool is None:
         await _initialize_pools()
 
-    if pool_name == "common":
-        if _common_pool is None:
-            raise ConnectionError("Common Redis pool is not available.")
-        return redis.Redis(connection_pool=_common_pool)
-    elif pool_name == "infra":
-        if _infra_pool is None:
-            raise ConnectionError("Infra Redis pool is not available.")
-        return redis.Redis(connection_pool=_infra_pool)
-    else:
-        raise ValueError(f"Unknown Redis pool name: {pool_name}")
\ No newline at end of file
+    return {
+        "common": _common_client,
+        "infra": _infra_client,
+        "housekeeping": _housekeeping_client,
+    }[pool_name]
+
+def pool_in_use_connections() -> dict:
+    """Number of connections currently checked out of each initialized pool (for metrics)."""
+    in_use = {}
+    if _cluster_client is not None:
+        in_use.update({
+            node.name: len(node._connections) - len(node._free)
+            for node in _cluster_client.get_nodes()
+        })
+
+    pools = {"common": _common_pool, "infra": _infra_pool, "housekeeping": _housekeeping_pool}
+    in_use.update({
+        name: len(pool._in_use_connections)
+        for name, pool in pools.items()
+        if pool is not None
+    })
+    return in_use
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+
+import redis
+from django.conf import settings
+from core.metrics import CIRCUIT_BREAKER_REJECTIONS, CIRCUIT_BREAKER_STATE, CIRCUIT_BREAKER_TRIPS
+
+logger = logging.getLogger(__name__)
+
+# Values of chatterbox_circuit_breaker_state
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+# Errors that mean Redis is unhealthy. Script errors (ResponseError) mean it answered.
+FAILURES = (
+    asyncio.TimeoutError,
+    redis.exceptions.ConnectionError,
+    redis.exceptions.TimeoutError,
+    redis.exceptions.ClusterDownError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Redis while the circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a call takes longer than the breaker's deadline.
+
+    The command was sent and may still run on Redis, `late` is the task that
+    completes with its result.
+    """
+
+    def __init__(self, name: str, deadline: float, late: asyncio.Task):
+        super().__init__(f"Call through {name} exceeded its {deadline}s deadline")
+        self.late = late
+
+
+class CircuitBreaker:
+    """
+    Per-call deadline plus circuit breaker for Redis calls made on the request path.
+
+    REDIS_BREAKER_FAILURES consecutive failures (timeouts, connection errors) open the
+    circuit: calls fail immediately with CircuitOpenError instead of queueing behind a
+    slow Redis. After REDIS_BREAKER_RESET seconds one probe call is let through
+    (half-open), its success closes the circuit and its failure opens it again.
+
+    One breaker per pool and worker, see get().
+    """
+
+    _breakers = {}
+
+    def __init__(self, name: str, deadline: float):
+        self.name = name
+        self.deadline = deadline
+        self.failure_threshold = settings.REDIS_BREAKER_FAILURES
+        self.reset_timeout = settings.REDIS_BREAKER_RESET
+        self.state = CLOSED
+        self.failures = 0 # consecutive
+        self.opened_at = 0.0
+        CIRCUIT_BREAKER_STATE.set(CLOSED, name)
+
+    @classmethod
+    def get(cls, name: str) -> "CircuitBreaker":
+        """The worker's breaker for a Redis pool ("common" or "infra")."""
+        breaker = cls._breakers.get(name)
+        if breaker is None:
+            # The infra pool's own timeouts already bound each command
+            deadline = settings.REDIS_INFRA_TIMEOUT if name == "infra" else settings.REDIS_CALL_DEADLINE
+            breaker = cls._breakers[name] = cls(name, deadline)
+        return breaker
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are being rejected (open, or half-open with the probe in flight)."""
+        if self.state == OPEN:
+            return self.retry_after() > 0
+        return self.state == HALF_OPEN
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe is allowed, 0 when calls go through."""
+        if self.state == CLOSED:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    async def call(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) within the deadline, or fails fast while the circuit is open."""
+        probe = self.state != CLOSED
+        if probe:
+            if self.is_open:
+                CIRCUIT_BREAKER_REJECTIONS.inc(self.name)
+                # A probe in flight has no reset time left, retry once it has reported
+                raise CircuitOpenError(self.name, self.retry_after() or self.deadline)
+            # This call is the probe
+            self._set_state(HALF_OPEN)
+
+        # Shielded: a command that was sent keeps running, the caller just stops waiting
+        task = asyncio.ensure_future(func(*args, **kwargs))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.deadline)
+        except asyncio.TimeoutError:
+            self._record_failure()
+            # Nobody may await it, retrieve its outcome so it isn't logged as lost
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            raise DeadlineExceeded(self.name, self.deadline, task) from None
+        except FAILURES:
+            self._record_failure()
+            raise
+        except asyncio.CancelledError:
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            if probe and self.state == HALF_OPEN:
+                # The probe's caller went away (socket closed, client hung up) before it
+                # reported. Fail fast again until the next probe instead of staying half-open.
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+            raise
+        except Exception:
+            self._record_success()
+            raise
+
+        self._record_success()
+        return result
+
+    def _record_success(self):
+        self.failures = 0
+        if self.state != CLOSED:
+            logger.warning(f"Circuit {self.name} closed, Redis is answering again.")
+            self._set_state(CLOSED)
+
+    def _record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(
+                    f"Circuit {self.name} opened after {self.failures} failures, "
+                    f"failing fast for {self.reset_timeout}s."
+                )
+                CIRCUIT_BREAKER_TRIPS.inc(self.name)
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state: int):
+        self.state = state
+        CIRCUIT_BREAKER_STATE.set(state, self.name)
@@ -1,61 +1,125 @@
 import asyncio
+import logging
 import time
 
-import redis
+from django.conf import settings
 from core.redis_client import get_redis_client
-from core.utils.lua_script_loader import LuaScriptLoader as lscr
+from core.services.circuit_breaker import CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from core.services.script_registry import ScriptRegistry
+
+logger = logging.getLogger(__name__)
 
 class RateLimit:
-    # Class-level cache for the SHA hash
-    _SCRIPT_SHA = None
-    _script_lock = asyncio.Lock() # For the thundering herd problem
+    """
+    Tiered token bucket rate limiter.
+
+    Each user_id is bound to a single socket on a single worker, so the bucket lives in
+    process memory and every check is decided locally. The bucket is reconciled with
+    ratelimit:ws:[{scope}:]{user_id} in Redis the first time a user is seen (so reconnects keep their
+    state), whenever the limit is exceeded, and at most every RATE_LIMIT_SYNC_INTERVAL seconds.
+    A user seen for the first time starts from a full local bucket, and adopts the tokens left
+    in Redis once that first reconcile is back.
+
+    Redis is reached through the "infra" pool and its circuit breaker, and the limiter fails
+    open: reconciles run in the background, and while the circuit is open every check is
+    decided locally, so a slow or unreachable control plane never delays the handler.
+    """
 
-    def __init__(self, limit: int, period: int):
+    def __init__(self, limit: int, period: int, scope: str = None):
         self.redis_client = None
+        self.key_prefix = f"ratelimit:ws:{scope}:" if scope else "ratelimit:ws:"
         self.limit = limit
         self.period = period
-        self.script_name = "rate_limit"
-
-    async def _load_script(self):
-            """Safely loads the script, immune to the Thundering Herd."""
-            # If it's already loaded, don't even bother with the lock.
-            if RateLimit._SCRIPT_SHA is not None:
-                return
-
-            # The Herd stops here. Only one task enters this block at a time.
-            async with RateLimit._script_lock:
-                
-                # Double-Checked Locking
-                # Check AGAIN, because another task might have loaded it 
-                # while this task was waiting for the lock.
-                if RateLimit._SCRIPT_SHA is None:
-                    lua_code = lscr.load("core", self.script_name)
-                    RateLimit._SCRIPT_SHA = await self.redis_client.script_load(lua_code)
+        self.refill_rate = limit / period
+        self.sync_interval = settings.RATE_LIMIT_SYNC_INTERVAL
 
-    async def check_rate_limit(self, user_id: str) -> bool:
+        # user_id -> [tokens, last_refill, last_sync, consumed_since_sync]
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+        self.breaker = CircuitBreaker.get("infra")
+        self._reconciles = set() # Strong references to the background reconcile tasks
+
+    async def _sync(self, user_id: str, consumed: int):
+        """Pushes locally consumed tokens to Redis and returns (allowed, tokens left in Redis)."""
         if self.redis_client is None:
-            self.redis_client = await get_redis_client()
-        await self._load_script()
-        
-        refill_rate = self.limit / self.period
+            self.redis_client = await get_redis_client("infra")
+
+        allowed, tokens = await ScriptRegistry.call(
+            self.redis_client,
+            "rate_limit",
+            1, # numkeys
+            f"{self.key_prefix}{user_id}", # KEYS[1]
+            self.limit,                # ARGV[1]
+            self.refill_rate,          # ARGV[2]
+            consumed                   # ARGV[3]
+        )
+        return allowed == 1, float(tokens)
+
+    def _sweep(self, now: float):
+        """Drops buckets that have refilled completely, they hold no state worth keeping."""
+        self._last_sweep = now
+        for user_id, (tokens, last_refill, _, consumed) in list(self._buckets.items()):
+            if consumed == 0 and tokens + (now - last_refill) * self.refill_rate >= self.limit:
+                del self._buckets[user_id]
+
+    async def check_rate_limit(self, user_id: str) -> bool:
+        now = time.monotonic()
+
+        if now - self._last_sweep >= self.period:
+            self._sweep(now)
 
+        bucket = self._buckets.get(user_id)
+
+        if bucket is None:
+            # First time this worker sees the user. The bucket is due for a sync right away,
+            # so a reconnecting user gets the tokens they had on their previous socket back.
+            bucket = [float(self.limit), now, now - self.sync_interval, 0]
+            self._buckets[user_id] = bucket
+
+        # Refill locally with sub-second precision
+        tokens, last_refill, last_sync, consumed = bucket
+        tokens = min(self.limit, tokens + (now - last_refill) * self.refill_rate)
+        bucket[1] = now
+
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            bucket[3] = consumed + 1
+
+            if now - last_sync >= self.sync_interval:
+                self._reconcile_later(user_id, bucket, now)
+            return True
+
+        # Limit exceeded, make sure Redis reflects it.
+        # Only the first rejection after a sync costs a round-trip, floods are dropped locally.
+        bucket[0] = tokens
+        if consumed:
+            self._reconcile_later(user_id, bucket, now)
+        return False
+
+    def _reconcile_later(self, user_id: str, bucket: list, now: float):
+        # The local bucket already made the decision, the caller never waits for the sync
+        if self.breaker.is_open:
+            return # The consumption stays pending until the circuit closes
+
+        consumed = bucket[3]
+        bucket[2] = now
+        bucket[3] = 0
+        task = asyncio.get_running_loop().create_task(self._reconcile(user_id, bucket, consumed))
+        self._reconciles.add(task)
+        task.add_done_callback(self._reconciles.discard)
+
+    async def _reconcile(self, user_id: str, bucket: list, consumed: int):
         try:
-            is_allowed = await self.redis_client.evalsha(
-                RateLimit._SCRIPT_SHA,
-                1, # numkeys
-                f"ratelimit:ws:{user_id}", # KEYS[1]
-                self.limit,                # ARGV[1]
-                refill_rate                # ARGV[2]
-            )
-        except redis.exceptions.NoScriptError:
-            RateLimit._SCRIPT_SHA = None
-            await self._load_script()
-            is_allowed = await self.redis_client.evalsha(
-                RateLimit._SCRIPT_SHA,
-                1, 
-                f"ratelimit:ws:{user_id}", 
-                self.limit, 
-                refill_rate
-            )
-
-        return is_allowed == 1
\ No newline at end of file
+            _, tokens = await self.breaker.call(self._sync, user_id, consumed)
+        except DeadlineExceeded:
+            return # Redis may still apply it, don't count it twice
+        except Exception as e:
+            # Keep the consumption for the next sync
+            if not isinstance(e, CircuitOpenError):
+                logger.warning(f"Rate limit sync failed for {user_id}: {e}")
+            bucket[3] += consumed
+            return
+
+        # Adopt Redis' view, minus anything consumed locally while we were waiting
+        bucket[0] = max(0.0, tokens - bucket[3])
+        bucket[1] = time.monotonic()
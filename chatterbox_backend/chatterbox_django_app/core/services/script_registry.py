@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import logging
+import time
+from pathlib import Path
+
+import redis
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from core.metrics import EVALSHA_SECONDS
+from core.utils.lua_script_loader import LuaScriptLoader as lscr
+
+logger = logging.getLogger(__name__)
+
+# Every function library of the registry is named with this prefix
+FUNCTION_PREFIX = "chatterbox_"
+
+# Sorted set of the registry's libraries, scored by when a worker last loaded them (ms)
+LIBRARIES_KEY = "script_registry:libraries"
+
+
+class ScriptRegistry:
+    """
+    Every Lua script of the project, loaded once per worker and Redis client.
+
+    Scripts are discovered in the lua/ directory of every installed app and called by
+    file name, like EVALSHA: ScriptRegistry.call(redis_client, "find_match", 0, *args).
+    SHAs are computed locally, so a call goes straight to EVALSHA. When Redis lost its
+    script cache (restart, failover, SCRIPT FLUSH), the first NOSCRIPT reloads every
+    script once, and the callers that failed meanwhile wait for that reload and retry.
+
+    With REDIS_FUNCTIONS, each script is installed as a Redis 7 function library instead
+    (FUNCTION LOAD) and called with FCALL. Libraries are persisted and replicated with
+    the data, so a restart or FLUSHALL doesn't lose them. A library and its function are
+    named after the script and its hash (chatterbox_find_match_1a2b3c4d5e6f), so workers
+    of two deploys running side by side never replace each other's version. Libraries
+    no worker loaded for REDIS_FUNCTIONS_RETENTION seconds are deleted. A Redis without
+    functions falls back to EVALSHA.
+    """
+
+    _scripts = None # script name -> (source, sha), discovered on first use
+    _loads = {} # redis client -> number of times the scripts were loaded through it
+    _locks = {} # redis client -> lock held while loading, for the thundering herd problem
+    _functions = {} # redis client -> whether the scripts are installed as functions
+
+    @classmethod
+    def scripts(cls) -> dict:
+        """Returns {script name: (source, sha)} of the lua/*.lua files of all installed apps."""
+        if cls._scripts is None:
+            scripts = {}
+            for app_config in apps.get_app_configs():
+                for path in sorted(Path(app_config.path, "lua").glob("*.lua")):
+                    if path.stem in scripts:
+                        raise ImproperlyConfigured(f"Lua script '{path.stem}' exists in more than one app")
+                    source = lscr.load(app_config.label, path.stem)
+                    scripts[path.stem] = (source, hashlib.sha1(source.encode("utf-8")).hexdigest())
+            cls._scripts = scripts
+        return cls._scripts
+
+    @staticmethod
+    def function_name(script_name: str, sha: str) -> str:
+        return f"{FUNCTION_PREFIX}{script_name}_{sha[:12]}"
+
+    @classmethod
+    async def preload(cls, redis_client):
+        """Loads every script through redis_client unless that already happened (worker startup)."""
+        await cls._load(redis_client, 0)
+
+    @classmethod
+    async def call(cls, redis_client, script_name: str, numkeys: int, *keys_and_args):
+        """Runs a script with EVALSHA (or FCALL), reloading the scripts if Redis lost them."""
+        loads = cls._loads.get(redis_client, 0)
+        if not loads:
+            await cls._load(redis_client, 0)
+            loads = cls._loads[redis_client]
+
+        with EVALSHA_SECONDS.time(script_name):
+            try:
+                return await cls._call(redis_client, script_name, numkeys, *keys_and_args)
+            except redis.exceptions.ResponseError as e:
+                # NOSCRIPT after a flush or failover, "Function not found" after a FUNCTION FLUSH
+                if not isinstance(e, redis.exceptions.NoScriptError) and "Function not found" not in str(e):
+                    raise
+                await cls._load(redis_client, loads)
+                return await cls._call(redis_client, script_name, numkeys, *keys_and_args)
+
+    @classmethod
+    async def _call(cls, redis_client, script_name, numkeys, *keys_and_args):
+        _, sha = cls.scripts()[script_name]
+        if cls._functions.get(redis_client):
+            return await redis_client.fcall(cls.function_name(script_name, sha), numkeys, *keys_and_args)
+        return await redis_client.evalsha(sha, numkeys, *keys_and_args)
+
+    @classmethod
+    async def _load(cls, redis_client, seen: int):
+        # seen: the load count the caller's failed call ran with. If it moved on meanwhile,
+        # another task reloaded the scripts while this one waited for the lock.
+        lock = cls._locks.setdefault(redis_client, asyncio.Lock())
+        async with lock:
+            if cls._loads.get(redis_client, 0) != seen:
+                return
+
+            if settings.REDIS_FUNCTIONS and cls._functions.get(redis_client) is not False:
+                cls._functions[redis_client] = await cls._load_functions(redis_client)
+
+            if not cls._functions.get(redis_client):
+                for source, _ in cls.scripts().values():
+                    await redis_client.script_load(source)
+
+            cls._loads[redis_client] = seen + 1
+            logger.info(f"{len(cls.scripts())} Lua scripts loaded into Redis.")
+
+    @classmethod
+    async def _load_functions(cls, redis_client) -> bool:
+        """Installs one function library per script. Returns False if Redis has no functions (< 7)."""
+        names = []
+        try:
+            for script_name, (source, sha) in cls.scripts().items():
+                name = cls.function_name(script_name, sha)
+                # The script body runs unchanged, KEYS and ARGV become the function's arguments
+                await redis_client.function_load(
+                    f"#!lua name={name}\n"
+                    f"redis.register_function('{name}', function(KEYS, ARGV)\n{source}\nend)",
+                    replace=True,
+                )
+                names.append(name)
+        except redis.exceptions.ResponseError as e:
+            logger.warning(f"Redis functions unavailable, falling back to EVALSHA: {e}")
+            return False
+
+        await cls._delete_stale_functions(redis_client, names)
+        return True
+
+    @classmethod
+    async def _delete_stale_functions(cls, redis_client, names):
+        """Records the libraries just loaded, and deletes the ones no worker loaded within the retention."""
+        now_ms = int(time.time() * 1000)
+        await redis_client.zadd(LIBRARIES_KEY, {name: now_ms for name in names})
+
+        cutoff = now_ms - settings.REDIS_FUNCTIONS_RETENTION * 1000
+        for name in await redis_client.zrangebyscore(LIBRARIES_KEY, "-inf", f"({cutoff}"):
+            try:
+                await redis_client.function_delete(name)
+            except redis.exceptions.ResponseError:
+                pass # Already deleted, by another worker or by hand
+            await redis_client.zrem(LIBRARIES_KEY, name)
+            logger.info(f"Deleted Redis function library {name}, unused for {settings.REDIS_FUNCTIONS_RETENTION}s.")
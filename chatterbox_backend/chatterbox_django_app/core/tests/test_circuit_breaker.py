@@ -0,0 +1,105 @@
+import asyncio
+
+import redis
+from django.test import SimpleTestCase
+from core.services.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+)
+
+
+async def fail():
+    raise redis.exceptions.ConnectionError("Redis is down")
+
+
+async def succeed():
+    return "ok"
+
+
+async def hang(event):
+    await event.wait()
+    return "late"
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("test", deadline=0.05)
+        self.breaker.failure_threshold = 2
+        self.breaker.reset_timeout = 0.05
+
+    async def trip(self):
+        for _ in range(self.breaker.failure_threshold):
+            with self.assertRaises(redis.exceptions.ConnectionError):
+                await self.breaker.call(fail)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    async def test_opens_after_consecutive_failures(self):
+        await self.trip()
+        with self.assertRaises(CircuitOpenError):
+            await self.breaker.call(succeed)
+
+    async def test_script_errors_dont_count_as_failures(self):
+        async def script_error():
+            raise redis.exceptions.ResponseError("ERR user script")
+
+        for _ in range(3):
+            with self.assertRaises(redis.exceptions.ResponseError):
+                await self.breaker.call(script_error)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_successful_probe_closes(self):
+        await self.trip()
+        await asyncio.sleep(self.breaker.reset_timeout)
+        self.assertEqual(await self.breaker.call(succeed), "ok")
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertFalse(self.breaker.is_open)
+
+    async def test_failed_probe_opens_again(self):
+        await self.trip()
+        await asyncio.sleep(self.breaker.reset_timeout)
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            await self.breaker.call(fail)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(self.breaker.is_open)
+
+    async def test_calls_are_rejected_while_probe_is_in_flight(self):
+        await self.trip()
+        await asyncio.sleep(self.breaker.reset_timeout)
+        event = asyncio.Event()
+        probe = asyncio.ensure_future(self.breaker.call(hang, event))
+        await asyncio.sleep(0)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            await self.breaker.call(succeed)
+        event.set()
+        self.assertEqual(await probe, "late")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_cancelled_probe_does_not_stay_half_open(self):
+        await self.trip()
+        await asyncio.sleep(self.breaker.reset_timeout)
+        event = asyncio.Event()
+        probe = asyncio.ensure_future(self.breaker.call(hang, event))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+        event.set()
+
+        self.assertEqual(self.breaker.state, OPEN)
+        await asyncio.sleep(self.breaker.reset_timeout)
+        self.assertFalse(self.breaker.is_open)
+        self.assertEqual(await self.breaker.call(succeed), "ok")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_deadline_exceeded_hands_over_the_late_result(self):
+        event = asyncio.Event()
+        with self.assertRaises(DeadlineExceeded) as cm:
+            await self.breaker.call(hang, event)
+        self.assertEqual(self.breaker.failures, 1)
+        event.set()
+        self.assertEqual(await cm.exception.late, "late")
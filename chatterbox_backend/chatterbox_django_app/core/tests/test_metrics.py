@@ -0,0 +1,27 @@
+from django.test import SimpleTestCase
+from core.metrics import Counter, Gauge, Histogram, Registry
+
+
+class ExpositionTests(SimpleTestCase):
+    def render(self, metric):
+        registry = Registry()
+        registry.register(metric)
+        return registry.render().splitlines()
+
+    def test_label_values_are_escaped(self):
+        gauge = Gauge("queue_users", "Users per queue.", labelnames=("interest",))
+        gauge.set(3, 'foo" } 1\nevil_metric 9 #\\')
+        self.assertEqual(
+            self.render(gauge)[2],
+            'queue_users{interest="foo\\" } 1\\nevil_metric 9 #\\\\"} 3.0',
+        )
+
+    def test_one_line_per_series(self):
+        counter = Counter("rejected_total", "Rejections.", labelnames=("reason",), labelvalues=("a\nb",))
+        counter.inc("a\nb")
+        self.assertEqual(self.render(counter)[2], 'rejected_total{reason="a\\nb"} 1.0')
+
+    def test_histogram_labels_are_escaped(self):
+        histogram = Histogram("seconds", "Latency.", labelnames=("handler",), buckets=(1.0,))
+        histogram.observe(0.5, 'a"b')
+        self.assertIn('seconds_bucket{handler="a\\"b",le="1.0"} 1', self.render(histogram))
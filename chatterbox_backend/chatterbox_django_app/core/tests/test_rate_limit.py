@@ -0,0 +1,102 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from core.services.circuit_breaker import CLOSED, OPEN, CircuitBreaker
+from core.services.rate_limit import RateLimit
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class Clock:
+    """Stands in for the limiter's time module, the event loop keeps the real clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@unittest.skipIf(fakeredis is None, 'needs pip install "fakeredis[lua]"')
+@override_settings(RATE_LIMIT_SYNC_INTERVAL=5)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        CircuitBreaker._breakers.clear()
+        self.addCleanup(CircuitBreaker._breakers.clear)
+        self.clock = Clock()
+        patcher = mock.patch("core.services.rate_limit.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def limiter(self, limit=3, period=3):
+        limiter = RateLimit(limit=limit, period=period)
+        limiter.redis_client = self.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        return limiter
+
+    async def checks(self, limiter, count):
+        return [await limiter.check_rate_limit("user") for _ in range(count)]
+
+    async def settle(self, limiter):
+        await asyncio.gather(*limiter._reconciles)
+
+    async def redis_tokens(self):
+        return float(await self.redis_client.hget("ratelimit:ws:user", "tokens"))
+
+    async def test_bucket_refills_locally(self):
+        limiter = self.limiter()
+        self.assertEqual(await self.checks(limiter, 4), [True, True, True, False])
+        self.clock.now += 1 # One token back
+        self.assertEqual(await self.checks(limiter, 2), [True, False])
+
+    async def test_first_check_does_not_wait_for_redis(self):
+        limiter = self.limiter()
+        redis_answered = asyncio.Event()
+
+        async def slow_sync(user_id, consumed):
+            await redis_answered.wait()
+            return True, 2.0
+
+        with mock.patch.object(limiter, "_sync", slow_sync):
+            self.assertTrue(await asyncio.wait_for(limiter.check_rate_limit("user"), 0.01))
+            redis_answered.set()
+            await self.settle(limiter)
+
+    async def test_reconnect_adopts_the_tokens_left_in_redis(self):
+        limiter = self.limiter()
+        await self.redis_client.hset("ratelimit:ws:user", mapping={"tokens": 0, "last_updated": time.time()})
+
+        self.assertTrue(await limiter.check_rate_limit("user"))
+        await self.settle(limiter)
+        self.assertFalse(await limiter.check_rate_limit("user"))
+
+    async def test_flood_costs_one_sync(self):
+        limiter = self.limiter()
+        with mock.patch.object(limiter, "_sync", wraps=limiter._sync) as sync:
+            await self.checks(limiter, 3)
+            await self.settle(limiter)
+            self.assertEqual(await self.checks(limiter, 50), [False] * 50)
+            await self.settle(limiter)
+
+        # The first check's sync and the first rejection's, which pushes the other two
+        self.assertEqual([c.args[1] for c in sync.await_args_list], [1, 2])
+        self.assertAlmostEqual(await self.redis_tokens(), 0, delta=0.1)
+
+    async def test_consumption_is_reconciled_once_the_circuit_closes(self):
+        limiter = self.limiter(limit=10, period=10)
+        limiter.breaker.state, limiter.breaker.opened_at = OPEN, time.monotonic()
+
+        # Decided locally while Redis is unreachable
+        self.assertEqual(await self.checks(limiter, 4), [True] * 4)
+        self.assertEqual(limiter._reconciles, set())
+        self.assertFalse(await self.redis_client.exists("ratelimit:ws:user"))
+
+        limiter.breaker.state = CLOSED
+        self.assertTrue(await limiter.check_rate_limit("user"))
+        await self.settle(limiter)
+        self.assertAlmostEqual(await self.redis_tokens(), 5, delta=0.1)
@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import redis.asyncio as redis
+from django.test import SimpleTestCase
+from core.redis_client import AutoPipelineRedis
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipIf(fakeredis is None, 'needs pip install "fakeredis[lua]"')
+class AutoPipelineRedisTests(SimpleTestCase):
+    def setUp(self):
+        pool = redis.ConnectionPool(
+            connection_class=fakeredis.aioredis.FakeConnection,
+            server=fakeredis.FakeServer(),
+            decode_responses=True,
+        )
+        self.redis_client = AutoPipelineRedis(connection_pool=pool)
+
+    async def test_concurrent_commands_share_one_pipeline(self):
+        await self.redis_client.set("text", "not a number")
+
+        with mock.patch.object(self.redis_client, "pipeline", wraps=self.redis_client.pipeline) as pipeline:
+            results = await asyncio.gather(
+                self.redis_client.set("a", "1"),
+                self.redis_client.incr("counter"),
+                self.redis_client.incr("text"),
+                self.redis_client.get("text"),
+                return_exceptions=True,
+            )
+
+        pipeline.assert_called_once()
+        self.assertEqual(results[:2], [True, 1])
+        self.assertIsInstance(results[2], redis.ResponseError)
+        self.assertEqual(results[3], "not a number")
+        self.assertEqual(self.redis_client._flushes, set())
+
+    async def test_flush_task_is_referenced_until_done(self):
+        command = asyncio.ensure_future(self.redis_client.get("a"))
+        await asyncio.sleep(0) # The command queues itself and schedules the flush
+        await asyncio.sleep(0) # The flush task is created
+        self.assertEqual(len(self.redis_client._flushes), 1)
+        self.assertIsNone(await command)
+        self.assertEqual(self.redis_client._flushes, set())
+
+    async def test_lone_command_runs_without_a_pipeline(self):
+        with mock.patch.object(self.redis_client, "pipeline") as pipeline:
+            self.assertEqual(await self.redis_client.incr("counter"), 1)
+        pipeline.assert_not_called()
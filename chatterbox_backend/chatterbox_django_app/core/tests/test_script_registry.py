@@ -0,0 +1,104 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import redis
+from django.test import SimpleTestCase, override_settings
+from core.services.script_registry import LIBRARIES_KEY, ScriptRegistry
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+# fakeredis runs the scripts but has no Redis functions, like a Redis older than 7
+@unittest.skipIf(fakeredis is None, 'needs pip install "fakeredis[lua]"')
+class ScriptRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        for state in (ScriptRegistry._loads, ScriptRegistry._locks, ScriptRegistry._functions):
+            self.addCleanup(state.pop, self.redis_client, None)
+
+    async def set_profile(self, user_id):
+        await ScriptRegistry.call(
+            self.redis_client, "set_profile", 1, f"user_meta:{{{user_id}}}", f"chan.{user_id}", "1"
+        )
+        return await self.redis_client.hget(f"user_meta:{{{user_id}}}", "status")
+
+    async def test_scripts_are_reloaded_once_after_a_flush(self):
+        self.assertEqual(await self.set_profile("a"), "searching")
+        await self.redis_client.script_flush()
+
+        with mock.patch.object(self.redis_client, "script_load", wraps=self.redis_client.script_load) as script_load:
+            statuses = await asyncio.gather(*(self.set_profile(f"user{i}") for i in range(5)))
+
+        self.assertEqual(statuses, ["searching"] * 5)
+        self.assertEqual(script_load.call_count, len(ScriptRegistry.scripts()))
+        self.assertEqual(ScriptRegistry._loads[self.redis_client], 2)
+
+    async def test_other_errors_are_not_retried(self):
+        await self.redis_client.set("user_meta:{a}", "not a hash")
+        with self.assertRaises(redis.exceptions.ResponseError):
+            await self.set_profile("a")
+        self.assertEqual(ScriptRegistry._loads[self.redis_client], 1)
+
+    @override_settings(REDIS_FUNCTIONS=True)
+    async def test_redis_without_functions_falls_back_to_evalsha(self):
+        with self.assertLogs("core.services.script_registry", "WARNING"):
+            self.assertEqual(await self.set_profile("a"), "searching")
+        self.assertIs(ScriptRegistry._functions[self.redis_client], False)
+
+        # Not retried on every reload
+        await self.redis_client.script_flush()
+        with mock.patch.object(self.redis_client, "function_load") as function_load:
+            self.assertEqual(await self.set_profile("b"), "searching")
+        function_load.assert_not_called()
+
+
+# A Redis 7 stand-in: fakeredis for the library bookkeeping, mocks for the function commands
+@unittest.skipIf(fakeredis is None, 'needs pip install "fakeredis[lua]"')
+@override_settings(REDIS_FUNCTIONS=True, REDIS_FUNCTIONS_RETENTION=3600)
+class ScriptRegistryFunctionTests(SimpleTestCase):
+    def setUp(self):
+        self.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        for command, result in (("function_load", None), ("function_delete", "OK"), ("fcall", "ok"), ("evalsha", None)):
+            patcher = mock.patch.object(self.redis_client, command, mock.AsyncMock(return_value=result))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for state in (ScriptRegistry._loads, ScriptRegistry._locks, ScriptRegistry._functions):
+            self.addCleanup(state.pop, self.redis_client, None)
+        _, sha = ScriptRegistry.scripts()["end_chat"]
+        self.function = ScriptRegistry.function_name("end_chat", sha)
+
+    async def test_scripts_are_called_as_functions(self):
+        self.assertEqual(await ScriptRegistry.call(self.redis_client, "end_chat", 0, "a"), "ok")
+        self.assertEqual(self.redis_client.function_load.await_count, len(ScriptRegistry.scripts()))
+        self.redis_client.fcall.assert_awaited_once_with(self.function, 0, "a")
+        self.redis_client.evalsha.assert_not_called()
+
+    async def test_functions_are_reloaded_after_a_function_flush(self):
+        await ScriptRegistry.preload(self.redis_client)
+        self.redis_client.fcall.side_effect = [redis.exceptions.ResponseError("ERR Function not found"), "ok"]
+
+        self.assertEqual(await ScriptRegistry.call(self.redis_client, "end_chat", 0, "a"), "ok")
+        self.assertEqual(self.redis_client.function_load.await_count, 2 * len(ScriptRegistry.scripts()))
+        self.assertEqual(self.redis_client.fcall.await_count, 2)
+
+    async def test_libraries_unused_past_the_retention_are_deleted(self):
+        now_ms = int(time.time() * 1000)
+        await self.redis_client.zadd(LIBRARIES_KEY, {
+            "chatterbox_end_chat_000000000000": now_ms - 3601 * 1000, # an old deploy
+            "chatterbox_end_chat_111111111111": now_ms - 60 * 1000, # a deploy still running
+        })
+        self.redis_client.function_delete.side_effect = [redis.exceptions.ResponseError("ERR Library not found")]
+
+        await ScriptRegistry.preload(self.redis_client)
+
+        self.redis_client.function_delete.assert_awaited_once_with("chatterbox_end_chat_000000000000")
+        libraries = await self.redis_client.zrange(LIBRARIES_KEY, 0, -1)
+        self.assertNotIn("chatterbox_end_chat_000000000000", libraries)
+        self.assertIn("chatterbox_end_chat_111111111111", libraries)
+        self.assertIn(self.function, libraries)
+        self.assertEqual(len(libraries), len(ScriptRegistry.scripts()) + 1)
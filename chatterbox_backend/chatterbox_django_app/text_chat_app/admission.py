@@ -0,0 +1,69 @@
+import logging
+
+from django.conf import settings
+from core.metrics import CONNECTIONS_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Close codes, the client can tell why it was turned away
+REPLACED_CLOSE_CODE = 4002 # the same id connected again, the newer socket wins
+WORKER_FULL_CLOSE_CODE = 4003 # this worker holds WS_MAX_CONNECTIONS_PER_WORKER sockets, retry (another worker)
+GLOBAL_FULL_CLOSE_CODE = 4004 # WS_GLOBAL_MAX_CONNECTIONS users are online, retry later
+
+
+class Admission:
+    """
+    Connection admission control, decided from process memory before a socket touches Redis.
+
+    * Each worker accepts at most WS_MAX_CONNECTIONS_PER_WORKER sockets.
+    * Each user_id holds one socket: a reconnect replaces the old socket instead of
+      running a second session next to it.
+    * WS_GLOBAL_MAX_CONNECTIONS caps users online across all workers. The count is the
+      number of live presence leases, refreshed by the presence heartbeat (see refresh()),
+      plus the sockets this worker admitted since.
+    """
+
+    # Class-level state: one registry per worker process
+    sockets = {} # user_id -> channel of the user's admitted socket on this worker
+    global_count = 0 # live presence leases at the last refresh
+    admitted_since_refresh = 0
+
+    @classmethod
+    def check(cls, user_id):
+        """Returns the close code to reject a new socket with, or None to admit it."""
+        if user_id in cls.sockets:
+            # Replacing a socket doesn't add one
+            return None
+
+        if len(cls.sockets) >= settings.WS_MAX_CONNECTIONS_PER_WORKER:
+            CONNECTIONS_REJECTED.inc("worker_full")
+            return WORKER_FULL_CLOSE_CODE
+
+        if (
+            settings.WS_GLOBAL_MAX_CONNECTIONS
+            and cls.global_count + cls.admitted_since_refresh >= settings.WS_GLOBAL_MAX_CONNECTIONS
+        ):
+            CONNECTIONS_REJECTED.inc("global_full")
+            return GLOBAL_FULL_CLOSE_CODE
+
+        return None
+
+    @classmethod
+    def admit(cls, user_id, channel):
+        """Registers the socket. Returns the channel of the socket it replaces on this worker, if any."""
+        previous = cls.sockets.get(user_id)
+        cls.sockets[user_id] = channel
+        if previous is None:
+            cls.admitted_since_refresh += 1
+        return previous
+
+    @classmethod
+    def release(cls, user_id, channel):
+        # A replaced socket closing must not release its replacement
+        if cls.sockets.get(user_id) == channel:
+            del cls.sockets[user_id]
+
+    @classmethod
+    def refresh(cls, live_users: int):
+        cls.global_count = live_users
+        cls.admitted_since_refresh = 0
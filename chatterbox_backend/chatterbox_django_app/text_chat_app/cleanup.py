@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from core.metrics import CLEANUP_BATCH_USERS
+from core.redis_client import get_redis_client
+from core.services.script_registry import ScriptRegistry
+from .presence import Presence
+from .sharded_matching import PRESENCE_KEY, ShardedMatching, user_key
+
+logger = logging.getLogger(__name__)
+
+
+class CleanupCoalescer:
+    """
+    Per-worker background task that cleans up disconnected users in batches.
+
+    A restarting worker closes thousands of sockets at once, and one clean_up call plus
+    one partner notification per socket lands on Redis right when the other workers are
+    taking the reconnects. Disconnects only queue (user_id, channel) here. Every
+    CLEANUP_COALESCE_WINDOW seconds, the queued users are cleaned up with one
+    clean_up_batch call per CLEANUP_BATCH_SIZE users and their partners are notified
+    with one send_many. Users queued when the worker dies are swept by Presence.
+    """
+
+    # Class-level state: one coalescer task per worker process
+    _task = None
+    _pending = {} # user_id -> channel the user disconnected from
+    _wakeup = asyncio.Event()
+
+    def __init__(self):
+        self.redis_client = None
+        self.channel_layer = get_channel_layer()
+
+    @classmethod
+    def submit(cls, user_id, channel):
+        """Queues a disconnected user for the next batch."""
+        cls._pending[user_id] = channel
+        cls._wakeup.set()
+
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.get_running_loop().create_task(cls()._run())
+            logger.info("Cleanup coalescer started.")
+
+    async def _run(self):
+        while True:
+            await CleanupCoalescer._wakeup.wait()
+            # Let the rest of a disconnect burst queue up behind the first one
+            await asyncio.sleep(settings.CLEANUP_COALESCE_WINDOW)
+            CleanupCoalescer._wakeup.clear()
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Error during batched cleanup: {e}")
+
+    async def flush(self) -> int:
+        """Cleans up everyone queued so far and notifies their partners. Returns the number of users."""
+        if self.redis_client is None:
+            self.redis_client = await get_redis_client("housekeeping")
+
+        cleaned = 0
+        while CleanupCoalescer._pending:
+            batch = []
+            while CleanupCoalescer._pending and len(batch) < settings.CLEANUP_BATCH_SIZE:
+                batch.append(CleanupCoalescer._pending.popitem())
+
+            if settings.MATCH_QUEUE_MODE == "sharded":
+                result = await self._clean_up_sharded(batch)
+            else:
+                result = await self._clean_up_batch(batch)
+
+            partner_channels = [channel for channel in result[1::2] if channel]
+            await self.notify(partner_channels)
+
+            # A user whose new socket on this worker replaced the old one before the batch
+            # ran lost the new socket's lease with the old session, take it again
+            reconnected = [user_id for user_id, _ in batch if user_id in Presence.local_users]
+            if reconnected:
+                expiry = Presence.lease_expiry()
+                await self.redis_client.zadd(PRESENCE_KEY, {user_id: expiry for user_id in reconnected})
+
+            CLEANUP_BATCH_USERS.observe(len(batch))
+            cleaned += len(batch)
+
+        return cleaned
+
+    async def notify(self, partner_channels):
+        message = {"type": "handle_partner_ended_chat"}
+        if hasattr(self.channel_layer, "send_many"):
+            await self.channel_layer.send_many(partner_channels, message)
+            return
+
+        for channel in partner_channels:
+            await self.channel_layer.send(channel, message)
+
+    async def _clean_up_batch(self, batch):
+        args = [value for pair in batch for value in pair]
+        return await ScriptRegistry.call(self.redis_client, "clean_up_batch", 0, *args)
+
+    async def _clean_up_sharded(self, batch):
+        # Users live in different slots, so there is no single batch script. The channel
+        # check isn't atomic with the cleanup, it only narrows the reconnect window.
+        sharded = ShardedMatching(self.redis_client)
+        partners = []
+        for user_id, channel in batch:
+            current, status, partner_id = await self.redis_client.hmget(
+                user_key(user_id), "channel", "status", "partner"
+            )
+            if current is None or current == channel:
+                partner = await sharded.clean_up(user_id)
+            elif partner_id and status != "chatting":
+                partner = await sharded.end_stale_chat(user_id, partner_id)
+            else:
+                partner = None
+
+            if partner:
+                partners += partner
+        return partners
@@ -2,19 +2,45 @@ from urllib.parse import parse_qs
 from uvicorn.protocols.utils import ClientDisconnected
 from channels.generic.websocket import AsyncWebsocketConsumer
 from websockets import ConnectionClosedError, ConnectionClosedOK
+from redis.exceptions import RedisError
 from core.decorators import websocket_rate_limit
-from core.utils import lua_script_loader as lscr
-import redis.asyncio as redis
+from core.metrics import ACTIVE_MATCHES, CONNECTIONS_REJECTED, HANDLER_SECONDS, OPEN_SOCKETS, timed
 from datetime import datetime
+from django.conf import settings
 from core.redis_client import get_redis_client
+from core.services.circuit_breaker import CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from core.services.script_registry import ScriptRegistry
+from .admission import REPLACED_CLOSE_CODE, Admission
+from .cleanup import CleanupCoalescer
+from .drain import DRAIN_CLOSE_CODE, WorkerDrain
+from .interests import InterestCatalog
+from .matchmaker import Matchmaker
+from .presence import Presence
+from .sharded_matching import ShardedMatching, user_key
+from . import messages, wire
 import asyncio
 import logging
 import json
+import msgspec
 import uuid
 import re
 
 logger = logging.getLogger(__name__)
 
+# find_match script to use for each MATCH_QUEUE_MODE
+MATCH_SCRIPTS = {
+    "random": "find_match",
+    "fifo": "find_match_fifo",
+    "overlap": "find_match_overlap",
+    "sharded": "find_match", # ShardedMatching.find_match, see _run_script
+}
+
+# 1013 "Try Again Later": Redis is failing and the circuit breaker is open
+DEGRADED_CLOSE_CODE = 1013
+
+# Arbitrary max length of a chat message to prevent abuse, in characters
+MAX_CHAT_LENGTH = 2000
+
 """
 Demo requests:
 
@@ -63,15 +89,39 @@ Demo requests:
     "timestamp": "2025-10-01T12:00:00"
 }
 
+Binary mode (connect with ?protocol=msgpack or the "chatterbox.msgpack" subprotocol):
+every frame is a type-code byte followed by the MessagePack-encoded "data" object,
+e.g. b"\x01" + packb({"interests": ["general"]}) to submit interests. See wire.py.
+
 """
 
 
+def find_match_args(user_id) -> list:
+    """ARGV of the MATCH_QUEUE_MODE's find_match script for user_id."""
+    args = [user_id]
+    if settings.MATCH_QUEUE_MODE == "overlap":
+        args += [
+            settings.MATCH_OVERLAP_CANDIDATES,
+            settings.MATCH_OVERLAP_MIN,
+            settings.MATCH_OVERLAP_FALLBACK,
+        ]
+    return args
+
+
+async def run_script(redis_client, script_name, *args):
+    """Runs a per-user script (find_match, stop_matching, end_chat, clean_up) through the common circuit breaker."""
+    # Sharded mode splits the multi-user scripts into single-slot steps (Redis Cluster)
+    if settings.MATCH_QUEUE_MODE == "sharded":
+        return await CircuitBreaker.get("common").call(
+            getattr(ShardedMatching(redis_client), script_name), *args
+        )
+    return await CircuitBreaker.get("common").call(
+        ScriptRegistry.call, redis_client, script_name, 0, *args
+    )
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
-    # Class-level SHAs: Load once, use for all instances
-    _SCRIPT_SHAS = {}
-    _LOAD_LOCK = (
-        asyncio.Lock()
-    )  # Prevent multiple concurrent lua script loads (Thundering herd)
+    _late_results = set() # Handlers of scripts that finished after their deadline
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -79,38 +129,41 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.redis_client = None
         self.user_id = None # used for rate limiting and identifying the user
         self.room_name = None
-
-    async def _load_scripts_globally(self):
-        async with ChatConsumer._LOAD_LOCK:
-            if not ChatConsumer._SCRIPT_SHAS:  # second check
-                # Helper to load scripts into Redis and store SHAs for all consumers to share.
-                scripts = [
-                    "find_match",
-                    "set_profile",
-                    "stop_matching",
-                    "end_chat",
-                    "clean_up",
-                ]
-                for s in scripts:
-                    content = lscr.LuaScriptLoader.load("text_chat_app", s)
-                    ChatConsumer._SCRIPT_SHAS[s] = await self.redis_client.script_load(
-                        content
-                    )
-                logger.info("Lua scripts loaded into Redis successfully.")
+        self.partner_channel = None # cached at match time for direct 1:1 delivery
+        self.binary = False # MessagePack frames instead of JSON, negotiated at connect
+        self.replaced = False # closed because the same user connected again
 
     async def _safe_evalsha(self, script_name, numkeys, *args):
-        # Helper to handle the NoScriptError globally so we don't repeat try/except blocks
-        try:
-            return await self.redis_client.evalsha(
-                self._SCRIPT_SHAS[script_name], numkeys, *args
-            )
-        except redis.exceptions.NoScriptError:
-            # If Redis was flushed, reload everything
-            await self._load_scripts_globally()
-            return await self.redis_client.evalsha(
-                self._SCRIPT_SHAS[script_name], numkeys, *args
-            )
-            
+        # Bounded by the deadline, fails fast while the circuit is open (see circuit_breaker.py)
+        return await CircuitBreaker.get("common").call(
+            ScriptRegistry.call, self.redis_client, script_name, numkeys, *args
+        )
+
+    async def _run_script(self, script_name, *args):
+        return await run_script(self.redis_client, script_name, *args)
+
+    def _apply_late_result(self, error: DeadlineExceeded, handler):
+        # The script still ran on Redis after the handler gave up on it. A result that
+        # carries something (a match, a partner to notify) is applied when it arrives.
+        async def apply():
+            try:
+                result = await error.late
+            except Exception:
+                return
+            if result:
+                await handler(result)
+
+        task = asyncio.get_running_loop().create_task(apply())
+        ChatConsumer._late_results.add(task)
+        task.add_done_callback(ChatConsumer._late_results.discard)
+
+    async def send_degraded(self, error: CircuitOpenError):
+        await self.send_response(
+            "service_degraded",
+            "Service is degraded, retry after the given delay",
+            {"retry_after_ms": int(error.retry_after * 1000)},
+        )
+
     async def is_valid_device_hash(self, val: str) -> bool:
         """
         Validates that the string is exactly a 64-character hex string (SHA-256).
@@ -128,190 +181,360 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close(code=4000) 
             return
             
+        if WorkerDrain.draining:
+            # This worker is shutting down, the client retries and lands on another one
+            CONNECTIONS_REJECTED.inc("draining")
+            await self.close(code=DRAIN_CLOSE_CODE)
+            return
+
+        if CircuitBreaker.get("common").is_open:
+            # Redis is failing, the client retries later instead of waiting on it now
+            CONNECTIONS_REJECTED.inc("degraded")
+            await self.close(code=DEGRADED_CLOSE_CODE)
+            return
+
         if not await self.is_valid_device_hash(id_list[0]):
             await self.close(code=4001) # 4001 for invalid id format
             return
-        else:
-            self.user_id = id_list[0]
+
+        # Admission control, from process memory only: overloaded workers reject before
+        # checking out a Redis connection or loading scripts
+        close_code = Admission.check(id_list[0])
+        if close_code is not None:
+            await self.close(code=close_code)
+            return
+
+        self.user_id = id_list[0]
+        replaced = Admission.admit(self.user_id, self.channel_name)
         
+        # Negotiate the wire protocol, JSON unless the client asks for MessagePack
+        subprotocols = self.scope.get("subprotocols") or []
+        self.binary = (
+            wire.SUBPROTOCOL in subprotocols
+            or parsed_qs.get("protocol", [""])[0] == "msgpack"
+        )
+
         # Accept the connection
-        self.redis_client = await get_redis_client()  # Get a Redis client instance from the common pool
+        try:
+            self.redis_client = await get_redis_client()  # The worker's shared client for the common pool
+            breaker = CircuitBreaker.get("common")
+
+            # One socket per user: close the user's previous socket, on this worker or another one
+            stored = await breaker.call(self.redis_client.hget, user_key(self.user_id), "channel")
+            for channel in {replaced, stored} - {None, self.channel_name}:
+                await self.inter_consumer_communication(channel, {"type": "handle_replaced"})
+
+            # Start this worker's background matchmaker on first use
+            Matchmaker.ensure_started()
+
+            # Take a presence lease, the worker's heartbeat renews it while the socket is open
+            await breaker.call(Presence.join, self.redis_client, self.user_id, self.channel_name)
+            Presence.ensure_started()
+
+            # A chat the user was just matched to over HTTP continues on this socket
+            handover = await breaker.call(
+                ScriptRegistry.call,
+                self.redis_client,
+                "claim_handover",
+                1,
+                user_key(self.user_id),
+                self.channel_name,
+            )
 
-        if not ChatConsumer._SCRIPT_SHAS:
-            await self._load_scripts_globally()
+            # Drain on SIGTERM instead of dropping every socket at once (already done if the server ran the lifespan startup)
+            WorkerDrain.install()
+
+            await self.accept(
+                subprotocol=wire.SUBPROTOCOL if wire.SUBPROTOCOL in subprotocols else None
+            )
+        except BaseException as e:
+            # Channels doesn't call disconnect when connect fails, give the admission back here
+            Admission.release(self.user_id, self.channel_name)
+            Presence.leave(self.user_id, self.channel_name)
+            self.redis_client = None
+            if not isinstance(e, (CircuitOpenError, DeadlineExceeded, RedisError)):
+                raise
+            # Redis is failing, the client retries later (the breaker opens if it keeps failing)
+            CONNECTIONS_REJECTED.inc("degraded")
+            await self.close(code=DEGRADED_CLOSE_CODE)
+            return
+        OPEN_SOCKETS.inc()
+        WorkerDrain.register(self.channel_name)
+        if WorkerDrain.draining:
+            # Accepted while the drain's broadcast went out, close like the others
+            await self.close_for_drain()
+            return
 
-        await self.accept()
         await self.send_response(
             "connection_established",
             "Connected",
         )
 
+        if handover:
+            await self.resume_chat(*handover)
+
+    async def resume_chat(self, partner_id, room_name, role):
+        """Takes over a chat matched over HTTP (see long_poll.py), as if this socket had been matched."""
+        try:
+            partner, partner_channel = await CircuitBreaker.get("common").call(
+                self.redis_client.hmget, user_key(partner_id), "partner", "channel"
+            )
+        except Exception as e:
+            # Redis is failing, end the chat for both instead of leaving it half handed over
+            logger.warning(f"Could not resume the chat of {self.user_id}: {e}")
+            await self.end_chat()
+            return
+
+        if partner != self.user_id:
+            # The partner left during the handover, their cleanup already unlinked this user
+            await self.handle_partner_ended_chat({})
+            return
+
+        # The partner's socket still sends to the HTTP request's channel, redirect it before
+        # the client hears it is in a chat
+        await self.inter_consumer_communication(
+            partner_channel,
+            {"type": "handle_partner_moved", "partner_channel": self.channel_name},
+        )
+        await self.handle_match_found({"partner_channel": partner_channel})
+        await self.handle_room_assignment({"room_name": room_name, "role": role or None})
+
+    @timed(HANDLER_SECONDS, "disconnect")
     async def disconnect(self, close_code):
+        # Stop in-memory delivery to this channel (same-process fast path)
+        if hasattr(self.channel_layer, "discard_local_channel"):
+            self.channel_layer.discard_local_channel(self.channel_name)
+
+        Admission.release(self.user_id, self.channel_name)
+
         if not self.redis_client:
             return
 
-        try:
-            partner_id = await self._safe_evalsha("clean_up", 0, self.user_id)
-
-            if partner_id:
-                partner_channel = await self.redis_client.hget(
-                    f"user_meta:{partner_id}", "channel"
-                )
+        OPEN_SOCKETS.dec()
+        self._leave_room()
+        Presence.leave(self.user_id, self.channel_name)
+        WorkerDrain.unregister(self.channel_name)
 
-                # Notify partner
-                await self.inter_consumer_communication(
-                    partner_channel,
-                    {"type": "handle_partner_ended_chat"},
-                )
+        if settings.CLEANUP_COALESCE_WINDOW > 0 or self.replaced:
+            # Cleaned up together with the other disconnects of this window, see cleanup.py.
+            # Its channel check keeps a replaced socket from cleaning up its replacement.
+            CleanupCoalescer.submit(self.user_id, self.channel_name)
+            return
 
-            # Leave room group if in a room
-            if self.room_name:
-                await self.channel_layer.group_discard(
-                    self.room_name, self.channel_name
-                )
-                
+        try:
+            result = await self._run_script("clean_up", self.user_id)
+            await self.notify_partner_ended_chat(result)
+        except DeadlineExceeded as e:
+            self._apply_late_result(e, self.notify_partner_ended_chat)
+        except CircuitOpenError:
+            # The lease is no longer renewed, the presence sweep cleans the user up
+            logger.warning(f"Cleanup of {self.user_id} left to the presence sweep, circuit open")
         except Exception as e:
             logger.exception(f"Error during cleanup: {e}")
-        finally:
-            await self.redis_client.aclose()
+
+    async def notify_partner_ended_chat(self, result):
+        if result:
+            partner_id, partner_channel = result
+
+            # Notify partner
+            await self.inter_consumer_communication(
+                partner_channel,
+                {"type": "handle_partner_ended_chat"},
+            )
 
     # Receive message from WebSocket and handle it based on its type
-    async def receive(self, text_data):
+    @timed(HANDLER_SECONDS, "receive")
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            await self.receive_binary(bytes_data)
+            return
+
+        # Chat and signalling frames are relayed with their data as the client wrote it. Only
+        # the envelope is read here, the partner gets the data under an envelope the server writes.
         try:
-            text_data_json = json.loads(text_data)
-            message_type = text_data_json.get("type")
-
-            if message_type == "submit_interests":
-                await self.set_profile(text_data_json["data"].get("interests", []))
-            elif message_type == "start_matching":
-                await self.find_match()
-            elif message_type == "end_matching":
-                await self.stop_matching()
-            elif message_type == "chat_message":
-                await self.handle_chat_message(
-                    text_data_json["data"].get("message", "")
-                )
-            elif message_type == "end_chat":
-                await self.end_chat()
-            elif message_type == "webrtc_signal":
-                await self.webrtc_signal(text_data_json.get("data", {}))
-            else:
-                await self.send_response(
-                    "error", f"Invalid message type: {message_type}"
-                )
-        except json.JSONDecodeError:
+            envelope = messages.decode_envelope(text_data)
+        except messages.InvalidMessage:
+            envelope = None
+        if envelope is not None and messages.MESSAGES.get(envelope.type) in messages.RELAYED:
+            await self._dispatch(messages.MESSAGES[envelope.type], None, data=bytes(envelope.data))
+            return
+
+        # Everything else is decoded and validated in one pass, bad frames never reach a handler
+        try:
+            message = messages.decode_json(text_data)
+        except messages.SchemaMismatch as e:
+            await self.send_response("error", f"Invalid message: {e}")
+            return
+        except messages.InvalidMessage:
             await self.send_response("error", "Invalid JSON format")
+            return
+
+        if type(message) in messages.RELAYED:
+            # The envelope named another type: the frame has more than one "type" key
+            await self.send_response("error", "Invalid message: duplicate \"type\" key")
+            return
+
+        await self._dispatch(type(message), message)
+
+    async def receive_binary(self, frame):
+        message_type, body = wire.decode_frame(frame)
+        message_class = messages.MESSAGES.get(message_type)
+
+        if message_class is None:
+            await self.send_response(
+                "error", f"Invalid message type: {frame[0] if frame else None}"
+            )
+            return
+
+        if message_class in messages.RELAYED:
+            # Relayed as-is, a chat body is only validated by its handler
+            await self._dispatch(message_class, None, frame=frame)
+            return
+
+        try:
+            message = messages.decode_body(message_class, body)
+        except messages.SchemaMismatch as e:
+            await self.send_response("error", f"Invalid message: {e}")
+            return
+        except messages.InvalidMessage:
+            await self.send_response("error", "Invalid MessagePack format")
+            return
+
+        await self._dispatch(message_class, message, frame=frame)
+
+    async def _dispatch(self, message_class, message, data=None, frame=None):
+        try:
+            await HANDLERS[message_class](self, message, data, frame)
         except Exception as e:
             logger.error(f"Error processing message: {e}")
             await self.send_response("error", "An unexpected error occurred.")
 
+    # Message handlers, see HANDLERS. message is the decoded struct, None for relayed
+    # frames, which get the raw JSON of their "data" (JSON) or the frame as received (binary).
+
+    async def on_submit_interests(self, message, data, frame):
+        await self.set_profile(message.data.interests)
+
+    async def on_start_matching(self, message, data, frame):
+        await self.find_match()
+
+    async def on_end_matching(self, message, data, frame):
+        await self.stop_matching()
+
+    async def on_chat_message(self, message, data, frame):
+        await self.handle_chat_message(
+            message.data.message if message else None, data=data, frame=frame
+        )
+
+    async def on_end_chat(self, message, data, frame):
+        await self.end_chat()
+
+    async def on_webrtc_signal(self, message, data, frame):
+        await self.webrtc_signal(data=data, frame=frame)
+
     async def set_profile(self, interests):
         if not self.redis_client:
             await self.send_response("error", "Redis unavailable")
             return
 
         try:
+            interest_ids = await InterestCatalog.resolve(self.redis_client, interests)
+            if not interest_ids:
+                await self.send_response("error", "No valid interests, please submit at least one.")
+                return
+
             await self._safe_evalsha(
                 "set_profile",
-                0,  # number of keys (we use ARGV only)
-                self.user_id,
+                1,
+                user_key(self.user_id),
                 self.channel_name,
-                json.dumps(interests),
+                ",".join(interest_ids),
             )
             await self.send_response(
                 "success", "Interests received, you can start matching."
             )
+        except CircuitOpenError as e:
+            await self.send_degraded(e)
         except Exception as e:
             logger.exception(f"Error during matching: {e}")
             await self.send_response("error", "Matching failed, please try again")
 
+    @timed(HANDLER_SECONDS, "find_match")
     @websocket_rate_limit(limit=3, period=4) # 3skips in 4sec
     async def find_match(self):
         if not self.redis_client:
             await self.send_response("error", "Redis unavailable")
             return None
 
-        # Call Lua script atomically
+        # Call Lua script atomically (interests and partner channel are resolved server-side)
         try:
-            user_interests = await self.redis_client.hget(
-                f"user_meta:{self.user_id}", "interests"
+            result = await self._run_script(
+                MATCH_SCRIPTS[settings.MATCH_QUEUE_MODE],
+                *find_match_args(self.user_id),
             )
+            await self.apply_match_result(result)
+
+        except CircuitOpenError as e:
+            # New matching is suspended until Redis recovers
+            await self.send_degraded(e)
+        except DeadlineExceeded as e:
+            self._apply_late_result(e, self.apply_match_result)
+            await self.send_response("no_match", "No match found, still searching")
+        except Exception as e:
+            logger.exception(f"Error during matching: {e}")
+            await self.send_response("error", "Matching failed, please try again")
 
-            if not user_interests:
-                await self.send_response(
-                    "error", "No interests found. Please set profile first."
-                )
-                return
-
-            keys = [f"interest:{topic}" for topic in user_interests.split(",")]
-
-            result = await self._safe_evalsha(
-                "find_match",
-                len(keys),
-                *keys,
-                self.user_id,
-                self.channel_name,
+    async def apply_match_result(self, result):
+        if result is None:
+            await self.send_response(
+                "error", "No interests found. Please set profile first."
             )
+            return
 
-            if result:
-                partner_user_id = result
-
-                if not partner_user_id:
-                    await self.send_response(
-                        "no_match", "No match found, still searching"
-                    )
-                    return
+        if result:
+            partner_user_id, partner_channel = result
 
-                partner_channel = await self.redis_client.hget(
-                    f"user_meta:{partner_user_id}", "channel"
-                )
-                # Create room and notify both users
-                self.room_name = f"room_{uuid.uuid4().hex[:8]}"
-
-                # Add both users to the same room group
-                await self.channel_layer.group_add(self.room_name, self.channel_name)
-                await self.channel_layer.group_add(self.room_name, partner_channel)
-
-                # Notify self
-                await self.handle_match_found(
-                    {
-                        "partner_user_id": partner_user_id,
-                        "partner_channel": partner_channel,
-                    }
-                )
+            # Create room and notify both users.
+            # Rooms only ever hold 2 users, so messages go straight to the partner's
+            # channel instead of through a channel layer group.
+            room_name = f"room_{uuid.uuid4().hex[:8]}"
 
-                # Notify partner
-                await self.inter_consumer_communication(
-                    partner_channel,
-                    {
-                        "type": "handle_match_found",
-                        "partner_user_id": self.user_id,
-                        "partner_channel": self.channel_name,
-                    },
-                )
+            # Notify self
+            await self.handle_match_found(
+                {
+                    "partner_user_id": partner_user_id,
+                    "partner_channel": partner_channel,
+                }
+            )
 
-                # Share room name with both
-                await self.handle_room_assignment(
-                    {
-                        "room_name": self.room_name,
-                        "role": "caller",  # for webRTC communication
-                    }
-                )
+            # Notify partner
+            await self.inter_consumer_communication(
+                partner_channel,
+                {
+                    "type": "handle_match_found",
+                    "partner_user_id": self.user_id,
+                    "partner_channel": self.channel_name,
+                },
+            )
 
-                await self.inter_consumer_communication(
-                    partner_channel,
-                    {
-                        "type": "handle_room_assignment",
-                        "room_name": self.room_name,
-                        "role": "callee",  # for webRTC communication
-                    },
-                )
-            else:
-                await self.send_response("no_match", "No match found, still searching")
+            # Share room name with both
+            await self.handle_room_assignment(
+                {
+                    "room_name": room_name,
+                    "role": "caller",  # for webRTC communication
+                }
+            )
 
-        except Exception as e:
-            logger.exception(f"Error during matching: {e}")
-            await self.send_response("error", "Matching failed, please try again")
+            await self.inter_consumer_communication(
+                partner_channel,
+                {
+                    "type": "handle_room_assignment",
+                    "room_name": room_name,
+                    "role": "callee",  # for webRTC communication
+                },
+            )
+        else:
+            await self.send_response("no_match", "No match found, still searching")
 
     async def stop_matching(self):
         if not self.redis_client:
@@ -319,73 +542,82 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
 
         try:
-            user_interests = await self.redis_client.hget(
-                f"user_meta:{self.user_id}", "interests"
-            )
-            keys = [f"interest:{topic}" for topic in user_interests.split(",")]
+            was_queued = await self._run_script("stop_matching", self.user_id)
 
-            if not user_interests:
+            if not was_queued:
                 await self.send_response(
                     "success", "You weren't in any matching queues."
                 )
                 return
 
-            await self._safe_evalsha("stop_matching", len(keys), *keys, self.user_id)
-
             await self.send_response("success", "You have stopped looking for a match.")
 
+        except CircuitOpenError as e:
+            await self.send_degraded(e)
         except Exception as e:
             logger.exception(f"Error during matching: {e}")
             await self.send_response("error", "Operation failed, please try again")
 
     @websocket_rate_limit(limit=5, period=10) # 5msgs in 10sec
-    async def handle_chat_message(self, message):
+    async def handle_chat_message(self, message=None, data=None, frame=None):
         if not self.room_name:
             await self.send_response("error", "You are not in a chat room")
             return
-        
-        if len(message) > 2000: # Arbitrary max length to prevent abuse
-            await self.send_response("error", "Message too long. (max 2000 characters)")
+
+        # The data is relayed as the client sent it, so it is checked against the schema
+        # first. Both protocols are checked on the decoded message, whatever the partner speaks.
+        if message is None:
+            try:
+                if frame is not None:
+                    message = messages.decode_body(messages.ChatMessage, frame[1:]).data.message
+                else:
+                    message = messages.decode_data(messages.ChatMessage, data).message
+            except messages.InvalidMessage as e:
+                await self.send_response("error", f"Invalid message: {e}")
+                return
+
+        if len(message) > MAX_CHAT_LENGTH:
+            await self.send_response("error", f"Message too long. (max {MAX_CHAT_LENGTH} characters)")
             return
-        await self.channel_layer.group_send(
-            self.room_name,
-            {"type": "chat_message", "message": message, "sender_id": self.user_id},
+        await self.inter_consumer_communication(
+            self.partner_channel,
+            self.relay_event("chat_message", data, frame),
         )
 
+    @timed(HANDLER_SECONDS, "end_chat")
     async def end_chat(self):
         if not self.redis_client:
             await self.send_response("error", "Redis unavailable")
             return
 
         try:
-            partner_id = await self._safe_evalsha("end_chat", 0, self.user_id)
-
-            if partner_id:
-                partner_channel = await self.redis_client.hget(
-                    f"user_meta:{partner_id}", "channel"
-                )
-
-                # Notify partner
-                await self.inter_consumer_communication(
-                    partner_channel,
-                    {"type": "handle_partner_ended_chat"},
-                )
-
-            self.room_name = None
+            result = await self._run_script("end_chat", self.user_id)
+            await self.notify_partner_ended_chat(result)
+            self._leave_room()
 
             await self.send_response(
                 "success",
                 "You have ended the chat",
             )
 
+            if WorkerDrain.draining:
+                await self.close_for_drain()
+
         except (ClientDisconnected, ConnectionClosedError, ConnectionClosedOK) as e:
             pass
+        except CircuitOpenError as e:
+            await self.send_degraded(e)
+        except DeadlineExceeded as e:
+            # The partner hears about it once Redis has ended the chat
+            self._apply_late_result(e, self.notify_partner_ended_chat)
+            self._leave_room()
+            await self.send_response("success", "You have ended the chat")
         except Exception as e:
             logger.exception(f"Error during ending chat: {e}")
             await self.send_response("error", "Operation failed, please try again")
 
     async def handle_partner_ended_chat(self, event):
-        self.room_name = None
+        self._leave_room()
 
         # Notify the partner's frontend that the chat is over
         await self.send_response(
@@ -393,63 +625,141 @@ class ChatConsumer(AsyncWebsocketConsumer):
             "Your partner has ended the chat",
         )
 
+        if WorkerDrain.draining:
+            await self.close_for_drain()
+
+    async def handle_drain(self, event):
+        # Chats keep going until they end or the drain's grace period is over
+        if (self.room_name or self.partner_channel) and not event["force"]:
+            return
+        await self.close_for_drain()
+
+    async def handle_replaced(self, event):
+        # The user connected again, the new socket takes over (its old session is cleaned up on disconnect)
+        self.replaced = True
+        await self.send_response(
+            "session_replaced",
+            "You connected again from another socket, this one is closed",
+        )
+        await self.close(code=REPLACED_CLOSE_CODE)
+
+    async def close_for_drain(self):
+        await self.send_response(
+            "server_draining",
+            "Server is restarting, reconnect after the given delay",
+            {"reconnect_after_ms": WorkerDrain.reconnect_after_ms()},
+        )
+        await self.close(code=DRAIN_CLOSE_CODE)
+
     async def inter_consumer_communication(self, partner_channel, message):
         if partner_channel:
             await self.channel_layer.send(partner_channel, message)
 
     async def handle_room_assignment(self, event):
+        if not self.room_name:
+            ACTIVE_MATCHES.inc()
         self.room_name = event["room_name"]
         role = event.get("role")
         await self.send_response(
             "success_matched", "You have saved current room name", {"role": role}
         )
 
+    def _leave_room(self):
+        if self.room_name:
+            ACTIVE_MATCHES.dec()
+        self.room_name = None
+        self.partner_channel = None
+
+    async def handle_partner_moved(self, event):
+        # The partner's chat moved from an HTTP match to a socket (see resume_chat)
+        if self.partner_channel:
+            self.partner_channel = event["partner_channel"]
+
     async def handle_match_found(self, event):
-        role = event.get("role")
+        self.partner_channel = event["partner_channel"]
         await self.send_response(
             "success",
             "Match found and partner details saved",
         )
 
-    async def webrtc_signal(self, signal_data):
+    async def webrtc_signal(self, data=None, frame=None):
         if not self.room_name:
             await self.send_response("error", "You are not in a chat room")
             return
 
-        await self.channel_layer.group_send(
-            self.room_name,
-            {"type": "signal_relay", "sender_id": self.user_id, "payload": signal_data},
+        await self.inter_consumer_communication(
+            self.partner_channel,
+            self.relay_event("signal_relay", data, frame),
         )
 
-    # Receive a webRTC signal relay message from room group -> Send to Individual user members (other than sender)
-    async def signal_relay(self, event):
-        # Do not send the signal back to the person who originated it
-        if event["sender_id"] == self.user_id:
+    @staticmethod
+    def relay_event(event_type, data, frame):
+        # The client's data travels to the partner undecoded, whichever protocol it used.
+        # A binary frame's type is its code byte, so it can go as is.
+        if frame is not None:
+            return {"type": event_type, "frame": frame}
+        return {"type": event_type, "data": data}
+
+    async def forward_frame(self, event, response_type, description):
+        # Same protocol on both ends: the partner's data goes out untouched
+        if "data" in event and not self.binary:
+            # Under an envelope written here, a client can't pick the type its partner sees
+            response = {
+                "type": response_type,
+                "description": description,
+                "timestamp": datetime.now().isoformat(),
+                "data": msgspec.Raw(event["data"]),
+            }
+            await self.send_frame(text_data=msgspec.json.encode(response).decode())
+            return
+        if "frame" in event and self.binary:
+            await self.send_frame(bytes_data=event["frame"])
+            return
+
+        # Mixed JSON / binary pair: convert the data object once
+        try:
+            if "data" in event:
+                data = msgspec.json.decode(event["data"])
+            else:
+                data = wire.unpack(event["frame"][1:])
+                # The partner speaks JSON, MessagePack bin values and NaN have no JSON form
+                text_data = self.json_response(response_type, description, data)
+        except (ValueError, TypeError, AttributeError):
+            # Relayed frames are not validated by the sender's consumer, drop malformed ones
+            logger.warning(f"Dropping malformed {response_type} relay")
+            await self.send_response("error", f"Dropped a malformed {response_type} from your partner")
             return
 
+        if self.binary:
+            # Relayed binary frames carry the bare data object, like the sender's
+            await self.send_frame(bytes_data=wire.encode_frame(response_type, data))
+        else:
+            await self.send_frame(text_data=text_data)
+
+    # Receive a webRTC signal relay message from the partner -> Send to the user
+    async def signal_relay(self, event):
         # Send the WebRTC data to the Flutter app
-        await self.send_response(
-            "webrtc_signal", "Incoming WebRTC signaling data", event["payload"]
-        )
+        await self.forward_frame(event, "webrtc_signal", "Incoming WebRTC signaling data")
 
-    # Receive a chat message from room group -> Send to Individual user members (other than sender)
+    # Receive a chat message from the partner -> Send to the user
     async def chat_message(self, event):
-        message = event["message"]
-        sender_id = event["sender_id"]
+        await self.forward_frame(event, "chat_message", "Message sent successfully")
 
-        # Skip if this is our own message
-        if sender_id == self.user_id:
+    async def send_response(self, response_type, description, data=None):
+        if self.binary:
+            # No timestamp in binary mode, clients stamp frames on arrival
+            body = {"description": description}
+            if data is not None:
+                body["data"] = data
+            await self.send_frame(bytes_data=wire.encode_frame(response_type, body))
             return
 
-        # Send message to WebSocket
-        await self.send_response(
-            "chat_message",
-            "Message sent successfully",
-            {"message": message},
-        )
+        await self.send_frame(text_data=self.json_response(response_type, description, data))
 
-    async def send_response(self, response_type, description, data=None):
-        # Utility method to send structured responses
+    @staticmethod
+    def json_response(response_type, description, data=None) -> str:
+        # Utility method to build structured responses, raises TypeError or ValueError
+        # when the data has no JSON form
         response = {
             "type": response_type,
             "description": description,
@@ -457,15 +767,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }
         if data is not None: 
             response["data"] = data
-            
+
+        return json.dumps(response, allow_nan=False)
+
+    async def send_frame(self, text_data=None, bytes_data=None):
         try:
-            await self.send(text_data=json.dumps(response))
+            await self.send(text_data=text_data, bytes_data=bytes_data)
         except (ClientDisconnected, ConnectionClosedError, ConnectionClosedOK):
             pass
         except RuntimeError as e:
             if "websocket.send" in str(e) and "websocket.close" in str(e):
                 pass  # socket already closed, silenced
             else:
-                logger.exception(f"Unexpected RuntimeError in send_response: {e}")
+                logger.exception(f"Unexpected RuntimeError in send_frame: {e}")
         except Exception as e:
-            logger.exception(f"Error sending response: {e}")
\ No newline at end of file
+            logger.exception(f"Error sending response: {e}")
+
+
+# Message type -> handler(consumer, message, data, frame), built once. A message type
+# without an on_<type> handler fails at import instead of at the first frame.
+HANDLERS = {
+    message_class: getattr(ChatConsumer, f"on_{message_type}")
+    for message_type, message_class in messages.MESSAGES.items()
+}
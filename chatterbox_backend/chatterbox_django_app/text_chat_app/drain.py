@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import random
+import signal
+import threading
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from core.metrics import DRAINING
+from .cleanup import CleanupCoalescer
+
+logger = logging.getLogger(__name__)
+
+# 1012 "Service Restart": the server is going away, the client should reconnect
+DRAIN_CLOSE_CODE = 1012
+
+# Seconds between the "sockets left" reports while draining
+DRAIN_REPORT_INTERVAL = 1.0
+
+
+class WorkerDrain:
+    """
+    Graceful drain of one worker, started by SIGTERM or the ASGI lifespan shutdown.
+
+    uvicorn closes every socket as soon as it handles SIGTERM, so all clients reconnect
+    at the same instant. Instead, the drain runs first:
+
+    1. new connections are rejected,
+    2. idle and searching sockets get a randomized reconnect_after_ms hint and are closed,
+    3. sockets in a chat close as soon as the chat ends, or once DRAIN_GRACE_PERIOD is over,
+    4. queued disconnect cleanups are flushed, then SIGTERM is handed back to uvicorn.
+
+    The number of sockets left is logged every second and exported as chatterbox_open_sockets.
+    """
+
+    # Class-level state: one drain per worker process
+    draining = False
+    sockets = set() # channel names of the open sockets on this worker
+    _task = None
+    _previous_handler = None
+
+    @classmethod
+    def install(cls):
+        """Hooks SIGTERM so the worker drains before the server's own handler runs. Safe to call repeatedly."""
+        if cls._previous_handler is not None:
+            return
+        # Signal handlers can only be set from the main thread
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        loop = asyncio.get_running_loop()
+        cls._previous_handler = signal.getsignal(signal.SIGTERM)
+        signal.signal(
+            signal.SIGTERM,
+            lambda sig, frame: loop.call_soon_threadsafe(cls._on_sigterm),
+        )
+
+    @classmethod
+    def _on_sigterm(cls):
+        if cls._task is not None:
+            # A second SIGTERM skips the rest of the drain
+            cls._forward_sigterm()
+            return
+
+        task = cls.start()
+        task.add_done_callback(lambda _: cls._forward_sigterm())
+
+    @classmethod
+    def _forward_sigterm(cls):
+        previous = cls._previous_handler
+        if callable(previous):
+            previous(signal.SIGTERM, None)
+        else:
+            signal.signal(signal.SIGTERM, previous or signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    @classmethod
+    def start(cls):
+        if cls._task is None:
+            cls._task = asyncio.get_running_loop().create_task(cls()._drain())
+        return cls._task
+
+    @classmethod
+    async def drain(cls):
+        """Drains the worker, or waits for the drain SIGTERM already started."""
+        await asyncio.shield(cls.start())
+        # Sockets the server closed itself after the drain are queued for cleanup too
+        await CleanupCoalescer().flush()
+
+    @staticmethod
+    def reconnect_after_ms() -> int:
+        # Spread the reconnects of this worker's clients over the whole window
+        return random.randint(1000, max(1000, int(settings.DRAIN_RECONNECT_SPREAD * 1000)))
+
+    @classmethod
+    def register(cls, channel):
+        cls.sockets.add(channel)
+
+    @classmethod
+    def unregister(cls, channel):
+        cls.sockets.discard(channel)
+
+    async def _drain(self):
+        WorkerDrain.draining = True
+        DRAINING.set(1)
+        loop = asyncio.get_running_loop()
+        channel_layer = get_channel_layer()
+        logger.warning(f"Draining worker {os.getpid()}: {len(WorkerDrain.sockets)} sockets open.")
+
+        try:
+            # Idle and searching sockets close now, chats get the grace period
+            await self._broadcast(channel_layer, force=False)
+
+            deadline = loop.time() + settings.DRAIN_GRACE_PERIOD
+            while WorkerDrain.sockets and loop.time() < deadline:
+                await asyncio.sleep(DRAIN_REPORT_INTERVAL)
+                logger.info(f"Draining worker {os.getpid()}: {len(WorkerDrain.sockets)} sockets left.")
+
+            if WorkerDrain.sockets:
+                await self._broadcast(channel_layer, force=True)
+                # Give the consumers a moment to send their close frames
+                await asyncio.sleep(DRAIN_REPORT_INTERVAL)
+
+            # Disconnects queued for batched cleanup would be lost with the process
+            await CleanupCoalescer().flush()
+        except Exception as e:
+            logger.exception(f"Error during drain: {e}")
+
+        logger.warning(f"Drained worker {os.getpid()}: {len(WorkerDrain.sockets)} sockets left.")
+
+    async def _broadcast(self, channel_layer, force):
+        message = {"type": "handle_drain", "force": force}
+        # Copy first, sockets close while the sends are awaited
+        for channel in list(WorkerDrain.sockets):
+            try:
+                await channel_layer.send(channel, message)
+            except Exception as e:
+                logger.warning(f"Could not tell {channel} to drain: {e}")
+
@@ -0,0 +1,120 @@
+import logging
+import unicodedata
+
+from django.conf import settings
+from core.services.circuit_breaker import CircuitBreaker
+from core.services.script_registry import ScriptRegistry
+
+logger = logging.getLogger(__name__)
+
+# Hash of every known interest: "n:{name}" -> ID and "i:{ID}" -> name (see intern_interests.lua)
+CATALOG_KEY = "interest_catalog"
+
+# Normalized spelling -> the interest it means
+ALIASES = {
+    "movie": "movies",
+    "film": "movies",
+    "films": "movies",
+    "cinema": "movies",
+    "tv": "tv shows",
+    "series": "tv shows",
+    "song": "music",
+    "songs": "music",
+    "game": "gaming",
+    "games": "gaming",
+    "video games": "gaming",
+    "videogames": "gaming",
+    "programming": "coding",
+    "code": "coding",
+    "book": "books",
+    "reading": "books",
+    "sport": "sports",
+    "anime and manga": "anime",
+    "manga": "anime",
+}
+
+
+def normalize(interest: str) -> str:
+    """Canonical spelling of an interest: "  Video  GAMES" -> "gaming". Empty if it can't be used."""
+    name = " ".join(unicodedata.normalize("NFKC", interest).casefold().split())
+    name = name.lstrip("#").replace("&", "and")
+    if len(name) > settings.INTEREST_MAX_LENGTH:
+        return ""
+    return ALIASES.get(name, name)
+
+
+class InterestCatalog:
+    """
+    Maps submitted interests to compact integer IDs shared by all workers.
+
+    Interests are free text. Without a catalog, "Music", "music " and "MUSIC" would be three
+    queues that never match each other, and every new string would be new Redis keys.
+    Interests are normalized (case, width, whitespace, aliases), deduplicated and capped at
+    INTEREST_MAX_PER_USER, then interned: the interest:{ID} / interest_q:{ID} queues and the
+    user_meta interests field use the IDs. The catalog holds at most INTEREST_CATALOG_SIZE
+    interests; once it is full, unknown interests are dropped.
+
+    IDs never change once assigned, so each worker caches them and only interests it hasn't
+    seen yet cost a round trip. If Redis loses the catalog, the new one gets a new epoch
+    and the workers drop their cached IDs (see check()).
+    """
+
+    # Class-level state: one cache per worker process
+    ids = {} # name -> ID
+    epoch = None # catalog the cached IDs came from
+
+    @staticmethod
+    def normalize_all(interests) -> list:
+        """Normalized, deduplicated interests in submission order, at most INTEREST_MAX_PER_USER."""
+        names = []
+        for interest in interests:
+            name = normalize(interest)
+            if name and name not in names:
+                names.append(name)
+                if len(names) == settings.INTEREST_MAX_PER_USER:
+                    break
+        return names
+
+    @classmethod
+    async def resolve(cls, redis_client, interests) -> list:
+        """Returns the IDs of the submitted interests, interning the ones the catalog doesn't know."""
+        names = cls.normalize_all(interests)
+
+        missing = [name for name in names if name not in cls.ids]
+        if missing:
+            epoch, *ids = await cls._intern(redis_client, missing)
+            if epoch != cls.epoch:
+                # A new catalog, the IDs cached from the previous one mean other interests now
+                cls.ids.clear()
+                cls.epoch = epoch
+                if len(missing) < len(names):
+                    missing = names
+                    epoch, *ids = await cls._intern(redis_client, names)
+
+            for name, interest_id in zip(missing, ids):
+                if interest_id is None:
+                    logger.warning(f"Interest catalog is full, dropped interest: {name}")
+                    continue
+                cls.ids[name] = interest_id
+
+        return [cls.ids[name] for name in names if name in cls.ids]
+
+    @classmethod
+    async def check(cls, redis_client):
+        """Drops the cached IDs if the catalog they came from is gone. Run by the presence heartbeat."""
+        if cls.ids and await redis_client.hget(CATALOG_KEY, "epoch") != cls.epoch:
+            logger.warning("Interest catalog was lost, dropping the cached interest IDs.")
+            cls.ids.clear()
+            cls.epoch = None
+
+    @staticmethod
+    async def _intern(redis_client, names):
+        return await CircuitBreaker.get("common").call(
+            ScriptRegistry.call,
+            redis_client,
+            "intern_interests",
+            1,
+            CATALOG_KEY,
+            settings.INTEREST_CATALOG_SIZE,
+            *names,
+        )
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+from core.redis_client import get_redis_client
+from core.services.script_registry import ScriptRegistry
+from .drain import WorkerDrain
+from .matchmaker import Matchmaker
+from .presence import Presence
+
+logger = logging.getLogger(__name__)
+
+# Seconds the startup waits for Redis, past that the worker serves anyway and warms up on first use
+WARM_UP_TIMEOUT = 5.0
+
+
+async def warm_up():
+    """
+    Opens the Redis pools, loads the Lua scripts and starts the background tasks, so the
+    first connect of a fresh worker costs no more than any other. Without it (no lifespan
+    support, Redis down at startup) all of this still happens lazily on first use.
+    """
+    for pool_name in ("common", "infra", "housekeeping"):
+        await ScriptRegistry.preload(await get_redis_client(pool_name))
+
+    Matchmaker.ensure_started()
+    Presence.ensure_started()
+
+
+async def lifespan_app(scope, receive, send):
+    """ASGI lifespan handler: hooks SIGTERM and warms the worker up at startup, drains it at shutdown."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            WorkerDrain.install()
+            try:
+                await asyncio.wait_for(warm_up(), WARM_UP_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Worker warm-up failed, continuing without it: {e}")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await WorkerDrain.drain()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from core.metrics import LONG_POLL_WAITERS
+from core.redis_client import get_redis_client
+from core.services.circuit_breaker import CircuitBreaker, DeadlineExceeded
+from core.services.script_registry import ScriptRegistry
+from .admission import Admission
+from .cleanup import CleanupCoalescer
+from .consumers import MATCH_SCRIPTS, find_match_args, run_script
+from .drain import WorkerDrain
+from .interests import InterestCatalog
+from .matchmaker import Matchmaker
+from .presence import Presence
+from .sharded_matching import PRESENCE_KEY, user_key
+
+logger = logging.getLogger(__name__)
+
+class Replaced(Exception):
+    """The user connected again (socket or request) while this request was waiting."""
+
+
+class Drained(Exception):
+    """The worker started draining while this request was waiting."""
+
+
+class LongPollMatch:
+    """
+    One parked HTTP match request, for clients that can't keep a WebSocket open.
+
+    The request stands in for a socket: it gets its own channel from the channel layer,
+    stores it as the user's channel with set_profile and takes a presence lease, then runs
+    the same find_match script a socket would. An immediate match is announced like the
+    matchmaker's. Otherwise the request waits on its channel until a partner's find_match
+    or the matchmaker sends the match to it.
+
+    The channel layer reads every channel of a worker with one blocking Redis pop (or
+    from memory, see LocalFastPathChannelLayer), so a parked request costs a coroutine,
+    not a thread or a Redis connection. Parked requests count as sockets for admission
+    control and are released when the worker drains.
+
+    The chat itself needs a socket. A match is offered to the user's next socket, which
+    takes it over when it connects with the same id (see ChatConsumer.resume_chat).
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.redis_client = None
+        self.channel_layer = get_channel_layer()
+        self.channel = None
+
+    async def run(self, interests, timeout):
+        """
+        Returns {"partner_user_id", "room_name", "role"} once matched, None if nobody matched
+        within timeout seconds. Raises ValueError, Replaced, Drained, CircuitOpenError or
+        DeadlineExceeded.
+        Admission.check() comes first, like at connect.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        self.redis_client = await get_redis_client()
+        interest_ids = await InterestCatalog.resolve(self.redis_client, interests)
+        if not interest_ids:
+            raise ValueError("No valid interests, please submit at least one.")
+
+        self.channel = await self.channel_layer.new_channel()
+        replaced = Admission.admit(self.user_id, self.channel)
+        WorkerDrain.register(self.channel)
+        LONG_POLL_WAITERS.inc()
+        joined = matched = False
+        breaker = CircuitBreaker.get("common")
+
+        try:
+            # One session per user, like a reconnecting socket
+            stored = await breaker.call(self.redis_client.hget, user_key(self.user_id), "channel")
+            for channel in {replaced, stored} - {None, self.channel}:
+                await self.channel_layer.send(channel, {"type": "handle_replaced"})
+
+            await breaker.call(Presence.join, self.redis_client, self.user_id, self.channel)
+            joined = True
+            Presence.ensure_started()
+            Matchmaker.ensure_started()
+
+            await breaker.call(
+                ScriptRegistry.call,
+                self.redis_client,
+                "set_profile",
+                1,
+                user_key(self.user_id),
+                self.channel,
+                ",".join(interest_ids),
+            )
+            try:
+                result = await run_script(
+                    self.redis_client,
+                    MATCH_SCRIPTS[settings.MATCH_QUEUE_MODE],
+                    *find_match_args(self.user_id),
+                )
+            except DeadlineExceeded as e:
+                # The script still runs on Redis, a match it makes has to be announced.
+                # Shielded, past the request's budget the cleanup below ends such a match.
+                result = await asyncio.wait_for(asyncio.shield(e.late), max(0, deadline - loop.time()))
+            if result:
+                # Matched right away, the announcement reaches this request's channel too
+                partner_user_id, partner_channel = result
+                await Matchmaker().announce_match(
+                    self.user_id, self.channel, partner_user_id, partner_channel
+                )
+
+            match = await asyncio.wait_for(self.wait_for_match(), max(0, deadline - loop.time()))
+            matched = True
+            await self.offer_handover(match)
+            return match
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            # Synchronous only, this also runs when the client hung up and the view was cancelled
+            LONG_POLL_WAITERS.dec()
+            WorkerDrain.unregister(self.channel)
+            Admission.release(self.user_id, self.channel)
+            if hasattr(self.channel_layer, "discard_local_channel"):
+                self.channel_layer.discard_local_channel(self.channel)
+            # Unconditional, a join that ran past its deadline may still register the user
+            Presence.leave(self.user_id, self.channel)
+            if joined and not matched:
+                # A match waits for the user's socket, see offer_handover(). Otherwise the user
+                # is dequeued like a closed socket: a match that raced the timeout is ended and
+                # the partner told, and the channel check keeps the session of a replacement.
+                CleanupCoalescer.submit(self.user_id, self.channel)
+
+    async def offer_handover(self, match):
+        """
+        Leaves the chat to the user's next socket (see claim_handover.lua). The lease is renewed
+        once here and not after, so the socket has PRESENCE_LEASE seconds to connect before the
+        presence sweep ends the chat and tells the partner.
+        """
+        breaker = CircuitBreaker.get("common")
+        try:
+            await breaker.call(
+                self.redis_client.hset,
+                user_key(self.user_id),
+                mapping={"room": match["room_name"], "role": match["role"] or ""},
+            )
+            await breaker.call(
+                self.redis_client.zadd, PRESENCE_KEY, {self.user_id: Presence.lease_expiry()}
+            )
+        except Exception as e:
+            # The chat can't be handed over, it ends once the lease lapses
+            logger.warning(f"Could not offer the chat of {self.user_id} to a socket: {e}")
+
+    async def wait_for_match(self):
+        match = {}
+        while True:
+            event = await self.channel_layer.receive(self.channel)
+            if event["type"] == "handle_match_found":
+                match["partner_user_id"] = event["partner_user_id"]
+            elif event["type"] == "handle_room_assignment":
+                match["room_name"] = event["room_name"]
+                match["role"] = event.get("role")
+            elif event["type"] == "handle_replaced":
+                raise Replaced()
+            elif event["type"] == "handle_drain":
+                raise Drained()
+
+            if len(match) == 3:
+                return match
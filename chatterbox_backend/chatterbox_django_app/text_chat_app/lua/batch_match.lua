@@ -0,0 +1,90 @@
+-- ARGV[1] : Maximum number of pairs to create in this batch
+-- ARGV[2] : Maximum number of queued topics to inspect in this batch
+-- Returns   : Flat list {user_a, channel_a, user_b, channel_b, ...} of the pairs created
+
+local max_pairs = tonumber(ARGV[1])
+local scan_limit = tonumber(ARGV[2])
+local matched = {}
+local pair_count = 0
+
+-- Stale entries dropped per call at most, so a set full of ghosts can't block Redis for
+-- long. The rest is dropped by later calls and by the presence sweep.
+local MAX_DROPPED = 100
+local dropped = 0
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- Waiters whose presence lease lapsed (their worker died before clean_up ran) are ghosts
+local function is_live(user)
+    local lease = redis.call('ZSCORE', 'presence', user)
+    return lease and tonumber(lease) >= now_ms
+end
+
+-- Pops one waiter from an interest set that is still searching and still connected (live lease)
+local function pop_waiter(interest_set)
+    while dropped < MAX_DROPPED do
+        local user = redis.call('SPOP', interest_set)
+        if not user then
+            return nil
+        end
+
+        local meta = redis.call('HMGET', 'user_meta:{' .. user .. '}', 'interests', 'channel', 'status')
+        if meta[2] and meta[3] == 'searching' and is_live(user) then
+            -- Scrub the user from every other set they were waiting in
+            if meta[1] then
+                for topic in string.gmatch(meta[1], '([^,]+)') do
+                    redis.call('SREM', 'interest:{' .. topic .. '}', user)
+                end
+            end
+            return user, meta[2]
+        end
+        -- Stale entry (no metadata, no longer searching or a ghost), drop it and keep looking
+        dropped = dropped + 1
+    end
+    return nil
+end
+
+local topics = redis.call('SRANDMEMBER', 'queued_interests', scan_limit)
+
+for i, topic in ipairs(topics) do
+    if pair_count >= max_pairs then
+        break
+    end
+
+    local interest_set = 'interest:{' .. topic .. '}'
+
+    while pair_count < max_pairs and redis.call('SCARD', interest_set) >= 2 do
+        local user_a, channel_a = pop_waiter(interest_set)
+        local user_b, channel_b = pop_waiter(interest_set)
+
+        if not user_a or not user_b then
+            -- Only one valid waiter left, put them back in all of their queues
+            local leftover = user_a or user_b
+            if leftover then
+                local interests_raw = redis.call('HGET', 'user_meta:{' .. leftover .. '}', 'interests')
+                for t in string.gmatch(interests_raw or topic, '([^,]+)') do
+                    redis.call('SADD', 'interest:{' .. t .. '}', leftover)
+                end
+            end
+            break
+        end
+
+        -- CREATE THE MATCH
+        redis.call('HSET', 'user_meta:{' .. user_a .. '}', 'partner', user_b, 'status', 'chatting')
+        redis.call('HSET', 'user_meta:{' .. user_b .. '}', 'partner', user_a, 'status', 'chatting')
+
+        table.insert(matched, user_a)
+        table.insert(matched, channel_a)
+        table.insert(matched, user_b)
+        table.insert(matched, channel_b)
+        pair_count = pair_count + 1
+    end
+
+    -- Drop topics nobody is waiting on from the index
+    if redis.call('SCARD', interest_set) == 0 then
+        redis.call('SREM', 'queued_interests', topic)
+    end
+end
+
+return matched
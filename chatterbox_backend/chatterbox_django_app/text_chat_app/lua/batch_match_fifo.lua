@@ -0,0 +1,112 @@
+-- FIFO variant of batch_match.lua, used when MATCH_QUEUE_MODE = "fifo"
+-- Pairs the oldest waiters of each queued topic first.
+--
+-- ARGV[1] : Maximum number of pairs to create in this batch
+-- ARGV[2] : Maximum number of queued topics to inspect in this batch
+-- Returns   : Flat list {user_a, channel_a, user_b, channel_b, ...} of the pairs created
+
+local max_pairs = tonumber(ARGV[1])
+local scan_limit = tonumber(ARGV[2])
+local matched = {}
+local pair_count = 0
+
+-- Stale entries dropped per call at most, so a queue full of ghosts can't block Redis for
+-- long. The rest is dropped by later calls and by the presence sweep.
+local MAX_DROPPED = 100
+local dropped = 0
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- Records how long a matched user waited into the match_wait_seconds histogram
+local function record_wait(enqueued_ms)
+    local waited = math.max(0, now_ms - enqueued_ms) / 1000
+    local buckets = {1, 5, 15, 30, 60, 120, 300}
+    local bucket = '+Inf'
+    for i, le in ipairs(buckets) do
+        if waited <= le then
+            bucket = tostring(le)
+            break
+        end
+    end
+    redis.call('HINCRBY', 'match_wait_seconds', 'le_' .. bucket, 1)
+    redis.call('HINCRBY', 'match_wait_seconds', 'count', 1)
+    redis.call('HINCRBYFLOAT', 'match_wait_seconds', 'sum', waited)
+end
+
+-- Waiters whose presence lease lapsed (their worker died before clean_up ran) are ghosts
+local function is_live(user)
+    local lease = redis.call('ZSCORE', 'presence', user)
+    return lease and tonumber(lease) >= now_ms
+end
+
+-- Pops the oldest waiter of a queue that is still searching and still connected (live lease)
+local function pop_waiter(queue)
+    while dropped < MAX_DROPPED do
+        local head = redis.call('ZPOPMIN', queue)
+        if #head == 0 then
+            return nil
+        end
+
+        local user = head[1]
+        local meta = redis.call('HMGET', 'user_meta:{' .. user .. '}', 'interests', 'channel', 'status')
+        if meta[2] and meta[3] == 'searching' and is_live(user) then
+            -- Scrub the user from every other queue they were waiting in
+            if meta[1] then
+                for topic in string.gmatch(meta[1], '([^,]+)') do
+                    redis.call('ZREM', 'interest_q:{' .. topic .. '}', user)
+                end
+            end
+            return user, meta[2], tonumber(head[2])
+        end
+        -- Stale entry (no metadata, no longer searching or a ghost), drop it and keep looking
+        dropped = dropped + 1
+    end
+    return nil
+end
+
+local topics = redis.call('SRANDMEMBER', 'queued_interests', scan_limit)
+
+for i, topic in ipairs(topics) do
+    if pair_count >= max_pairs then
+        break
+    end
+
+    local queue = 'interest_q:{' .. topic .. '}'
+
+    while pair_count < max_pairs and redis.call('ZCARD', queue) >= 2 do
+        local user_a, channel_a, enqueued_a = pop_waiter(queue)
+        local user_b, channel_b, enqueued_b = pop_waiter(queue)
+
+        if not user_a or not user_b then
+            -- Only one valid waiter left, put them back with their original enqueue time
+            if user_a then
+                local interests_raw = redis.call('HGET', 'user_meta:{' .. user_a .. '}', 'interests')
+                for t in string.gmatch(interests_raw or topic, '([^,]+)') do
+                    redis.call('ZADD', 'interest_q:{' .. t .. '}', enqueued_a, user_a)
+                end
+            end
+            break
+        end
+
+        -- CREATE THE MATCH
+        redis.call('HSET', 'user_meta:{' .. user_a .. '}', 'partner', user_b, 'status', 'chatting')
+        redis.call('HSET', 'user_meta:{' .. user_b .. '}', 'partner', user_a, 'status', 'chatting')
+
+        record_wait(enqueued_a)
+        record_wait(enqueued_b)
+
+        table.insert(matched, user_a)
+        table.insert(matched, channel_a)
+        table.insert(matched, user_b)
+        table.insert(matched, channel_b)
+        pair_count = pair_count + 1
+    end
+
+    -- Drop topics nobody is waiting on from the index
+    if redis.call('ZCARD', queue) == 0 then
+        redis.call('SREM', 'queued_interests', topic)
+    end
+end
+
+return matched
@@ -0,0 +1,131 @@
+-- Overlap-scored variant of batch_match.lua, used when MATCH_QUEUE_MODE = "overlap"
+-- For each sampled topic, a bounded sample of waiters is paired greedily so that every
+-- waiter gets the candidate sharing the most interests with them.
+--
+-- ARGV[1] : Maximum number of pairs to create in this batch
+-- ARGV[2] : Maximum number of queued topics to inspect in this batch
+-- ARGV[3] : Maximum number of waiters sampled per topic (bounds script time)
+-- ARGV[4] : Minimum shared interests required before the fallback kicks in
+-- ARGV[5] : Seconds a user waits before accepting a single shared interest (fallback)
+-- Returns   : Flat list {user_a, channel_a, user_b, channel_b, ...} of the pairs created
+
+local max_pairs = tonumber(ARGV[1])
+local scan_limit = tonumber(ARGV[2])
+local max_candidates = tonumber(ARGV[3])
+local min_overlap = tonumber(ARGV[4])
+local fallback_ms = tonumber(ARGV[5]) * 1000
+local matched = {}
+local pair_count = 0
+
+-- Stale entries dropped per call at most. Sampling already bounds the work, this keeps
+-- the writes bounded too.
+local MAX_DROPPED = 100
+local dropped = 0
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local function required_overlap(topic_count, searching_since)
+    if searching_since and now_ms - tonumber(searching_since) >= fallback_ms then
+        return 1
+    end
+    return math.max(1, math.min(min_overlap, topic_count))
+end
+
+-- Waiters whose presence lease lapsed (their worker died before clean_up ran) are ghosts
+local function is_live(user)
+    local lease = redis.call('ZSCORE', 'presence', user)
+    return lease and tonumber(lease) >= now_ms
+end
+
+local topics = redis.call('SRANDMEMBER', 'queued_interests', scan_limit)
+
+for i, topic in ipairs(topics) do
+    if pair_count >= max_pairs then
+        break
+    end
+
+    local interest_set = 'interest:{' .. topic .. '}'
+
+    -- Load the sampled waiters once, dropping stale entries
+    local waiters = {}
+    for j, user in ipairs(redis.call('SRANDMEMBER', interest_set, max_candidates)) do
+        local meta = redis.call('HMGET', 'user_meta:{' .. user .. '}', 'interests', 'channel', 'status', 'searching_since')
+        if meta[1] and meta[2] and meta[3] == 'searching' and is_live(user) then
+            local own_topics = {}
+            local count = 0
+            for t in string.gmatch(meta[1], '([^,]+)') do
+                own_topics[t] = true
+                count = count + 1
+            end
+            table.insert(waiters, {
+                id = user,
+                channel = meta[2],
+                interests = meta[1],
+                topics = own_topics,
+                required = required_overlap(count, meta[4]),
+            })
+        elseif dropped < MAX_DROPPED then
+            -- Stale entry (no metadata, no longer searching or a ghost), drop it
+            redis.call('SREM', interest_set, user)
+            dropped = dropped + 1
+        end
+    end
+
+    -- Greedy pairing on overlap score, bounded by the sample size
+    local taken = {}
+    for a = 1, #waiters do
+        if pair_count >= max_pairs then
+            break
+        end
+
+        if not taken[a] then
+            local best, best_score = nil, 0
+            for b = a + 1, #waiters do
+                if not taken[b] then
+                    local score = 0
+                    for t in pairs(waiters[b].topics) do
+                        if waiters[a].topics[t] then
+                            score = score + 1
+                        end
+                    end
+                    if score > best_score and score >= waiters[a].required and score >= waiters[b].required then
+                        best, best_score = b, score
+                    end
+                end
+            end
+
+            if best then
+                taken[a] = true
+                taken[best] = true
+                local user_a, user_b = waiters[a], waiters[best]
+
+                for t in string.gmatch(user_a.interests, '([^,]+)') do
+                    redis.call('SREM', 'interest:{' .. t .. '}', user_a.id)
+                end
+                for t in string.gmatch(user_b.interests, '([^,]+)') do
+                    redis.call('SREM', 'interest:{' .. t .. '}', user_b.id)
+                end
+
+                -- CREATE THE MATCH
+                redis.call('HSET', 'user_meta:{' .. user_a.id .. '}', 'partner', user_b.id, 'status', 'chatting')
+                redis.call('HSET', 'user_meta:{' .. user_b.id .. '}', 'partner', user_a.id, 'status', 'chatting')
+                redis.call('HDEL', 'user_meta:{' .. user_a.id .. '}', 'searching_since')
+                redis.call('HDEL', 'user_meta:{' .. user_b.id .. '}', 'searching_since')
+
+                table.insert(matched, user_a.id)
+                table.insert(matched, user_a.channel)
+                table.insert(matched, user_b.id)
+                table.insert(matched, user_b.channel)
+                pair_count = pair_count + 1
+            end
+        end
+    end
+
+    -- Drop topics nobody is waiting on from the index
+    if redis.call('SCARD', interest_set) == 0 then
+        redis.call('SREM', 'queued_interests', topic)
+    end
+end
+
+return matched
@@ -0,0 +1,21 @@
+-- Hands a chat matched over HTTP (long_poll.py) to the user's new socket
+-- KEYS[1] : The user's metadata hash (e.g., "user_meta:{user123}")
+-- ARGV[1] : Channel of the new socket
+-- Returns   : {partner_id, room_name, role} if the user was matched over HTTP and is still chatting, nil otherwise
+
+local user_key = KEYS[1]
+local meta = redis.call('HMGET', user_key, 'room', 'role', 'status', 'partner')
+if not meta[1] then
+    return nil
+end
+
+-- Only one socket takes the chat over, a stale offer (the chat already ended) is dropped too
+redis.call('HDEL', user_key, 'room', 'role')
+if meta[3] ~= 'chatting' or not meta[4] then
+    return nil
+end
+
+-- From now on the partner's notifications (end_chat, clean_up, sweeps) reach the socket
+redis.call('HSET', user_key, 'channel', ARGV[1])
+
+return {meta[4], meta[1], meta[2] or ''}
@@ -1,25 +1,39 @@
 -- ARGV[1] : user_id
+-- Returns   : {partner_id, partner_channel} if the user was chatting, nil otherwise
 
 local user_id = ARGV[1]
+local user_key = 'user_meta:{' .. user_id .. '}'
 
--- 1. Check if they were in a match
-local partner_id = redis.call('HGET', 'active_matches', user_id)
+local meta = redis.call('HMGET', user_key, 'partner', 'interests')
+local partner_id = meta[1]
+local interests_raw = meta[2]
+
+-- 1. Check if they were in a match, and unlink the partner if they still point back
+local partner_channel = nil
 if partner_id then
-    redis.call('HDEL', 'active_matches', user_id)
-    redis.call('HDEL', 'active_matches', partner_id)
-    -- We'll return partner_id so Python can notify them
+    local partner_key = 'user_meta:{' .. partner_id .. '}'
+    local partner_meta = redis.call('HMGET', partner_key, 'partner', 'channel')
+    if partner_meta[1] == user_id then
+        redis.call('HDEL', partner_key, 'partner')
+        redis.call('HSET', partner_key, 'status', 'idle')
+        -- Resolve the partner's channel here so Python can notify them without another round-trip
+        partner_channel = partner_meta[2]
+    end
 end
 
 -- 2. Clean up Interest Sets
-local interests_raw = redis.call('HGET', 'user_meta:' .. user_id, 'interests')
 if interests_raw then
-    -- (Reuse your split function here)
     for topic in string.gmatch(interests_raw, '([^,]+)') do
-        redis.call('SREM', 'interest:' .. topic, user_id)
+        redis.call('SREM', 'interest:{' .. topic .. '}', user_id)
+        redis.call('ZREM', 'interest_q:{' .. topic .. '}', user_id) -- FIFO mode queues
     end
 end
 
--- 3. Wipe the metadata
-redis.call('DEL', 'user_meta:' .. user_id)
+-- 3. Wipe the metadata and the presence lease
+redis.call('DEL', user_key)
+redis.call('ZREM', 'presence', user_id)
 
-return partner_id -- nil if they weren't chatting
\ No newline at end of file
+if partner_id then
+    return {partner_id, partner_channel or ''}
+end
+return nil -- nil if they weren't chatting
@@ -0,0 +1,51 @@
+-- Cleans up a batch of disconnected users in one call (see cleanup.py), same cleanup as
+-- clean_up.lua. A user whose metadata already names another channel reconnected before
+-- the batch ran: their new session is kept, only the old session's chat is ended.
+--
+-- ARGV : user_id_1, channel_1, user_id_2, channel_2, ... (the channel each one disconnected from)
+-- Returns   : Flat list {partner_id, partner_channel, ...} of partners left in an ended chat
+
+local partners = {}
+
+-- Unlinks the partner if they still point back, and queues them for notification
+local function unlink_partner(user_id, partner_id)
+    local partner_key = 'user_meta:{' .. partner_id .. '}'
+    local partner_meta = redis.call('HMGET', partner_key, 'partner', 'channel')
+    if partner_meta[1] == user_id then
+        redis.call('HDEL', partner_key, 'partner')
+        redis.call('HSET', partner_key, 'status', 'idle')
+        table.insert(partners, partner_id)
+        table.insert(partners, partner_meta[2] or '')
+    end
+end
+
+for i = 1, #ARGV, 2 do
+    local user_id = ARGV[i]
+    local user_key = 'user_meta:{' .. user_id .. '}'
+    local meta = redis.call('HMGET', user_key, 'partner', 'interests', 'channel', 'status')
+
+    if not meta[3] or meta[3] == ARGV[i + 1] then
+        -- 1. End their chat
+        if meta[1] then
+            unlink_partner(user_id, meta[1])
+        end
+
+        -- 2. Clean up Interest Sets
+        if meta[2] then
+            for topic in string.gmatch(meta[2], '([^,]+)') do
+                redis.call('SREM', 'interest:{' .. topic .. '}', user_id)
+                redis.call('ZREM', 'interest_q:{' .. topic .. '}', user_id)
+            end
+        end
+
+        -- 3. Wipe the metadata and the presence lease
+        redis.call('DEL', user_key)
+        redis.call('ZREM', 'presence', user_id)
+    elseif meta[1] and meta[4] ~= 'chatting' then
+        -- Reconnected and not matched again yet, the partner is left over from the old session
+        redis.call('HDEL', user_key, 'partner')
+        unlink_partner(user_id, meta[1])
+    end
+end
+
+return partners
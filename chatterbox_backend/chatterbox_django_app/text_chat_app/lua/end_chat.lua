@@ -1,22 +1,29 @@
 -- ARGV[1] : The ID of the user who ended the chat (e.g., "user_A")
+-- Returns   : {partner_id, partner_channel} if the user was chatting, nil otherwise
 
 local user_id = ARGV[1]
+local user_key = 'user_meta:{' .. user_id .. '}'
 
--- Find who this user was talking to
-local partner_id = redis.call('HGET', 'active_matches', user_id)
+-- Find who this user was talking to (each user holds a pointer to their partner)
+local partner_id = redis.call('HGET', user_key, 'partner')
 
 if partner_id then
-    -- Remove the mapping for BOTH users
-    redis.call('HDEL', 'active_matches', user_id)
-    redis.call('HDEL', 'active_matches', partner_id)
-
-    -- Update both users' status back to 'idle'
+    -- Remove the pointer for BOTH users and set their status back to 'idle'
     -- This ensures they don't accidentally stay in 'chatting' state
-    redis.call('HSET', 'user_meta:' .. user_id, 'status', 'idle')
-    redis.call('HSET', 'user_meta:' .. partner_id, 'status', 'idle')
+    redis.call('HDEL', user_key, 'partner')
+    redis.call('HSET', user_key, 'status', 'idle')
+
+    -- Only touch the partner if they still point back at this user
+    local partner_key = 'user_meta:{' .. partner_id .. '}'
+    local partner_meta = redis.call('HMGET', partner_key, 'partner', 'channel')
+    if partner_meta[1] ~= user_id then
+        return {partner_id, ''}
+    end
+    redis.call('HDEL', partner_key, 'partner')
+    redis.call('HSET', partner_key, 'status', 'idle')
 
-    -- Return the partner_id so Django knows who to notify
-    return partner_id
+    -- Return the partner_id and their channel so Django knows who to notify
+    return {partner_id, partner_meta[2] or ''}
 end
 
-return nil
\ No newline at end of file
+return nil
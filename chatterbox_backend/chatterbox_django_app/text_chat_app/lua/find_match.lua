@@ -1,50 +1,108 @@
--- KEYS[1...N] : The interest set keys (e.g., "interest:rock", "interest:coding")
--- ARGV[1]     : Current User ID (e.g., "user_A")
+-- ARGV[1] : Current User ID (e.g., "user_A")
+-- Returns   : nil if the user has no interests saved (set_profile not called yet)
+--             {} if no partner was found and the user was queued, or the user is already
+--             in a chat (a retry that arrives after the matchmaker paired them)
+--             {partner_id, partner_channel} if a match was made
 
 local current_user = ARGV[1]
 
+-- Stale entries dropped per call at most, so a set full of ghosts can't block Redis for
+-- long. The rest is dropped by later calls and by the presence sweep.
+local MAX_DROPPED = 100
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- Waiters whose presence lease lapsed (their worker died before clean_up ran) are ghosts
+local function is_live(user)
+    local lease = redis.call('ZSCORE', 'presence', user)
+    return lease and tonumber(lease) >= now_ms
+end
+
+-- Read the caller's interests server-side so matching costs a single round-trip
+local meta = redis.call('HMGET', 'user_meta:{' .. current_user .. '}', 'interests', 'status')
+local interests_raw = meta[1]
+if not interests_raw then
+    return nil
+end
+
+-- Already matched, the match notification is on its way
+if meta[2] ~= 'idle' and meta[2] ~= 'searching' then
+    return {}
+end
+
+local interest_sets = {}
+for topic in string.gmatch(interests_raw, '([^,]+)') do
+    table.insert(interest_sets, 'interest:{' .. topic .. '}')
+end
+
 -- SEARCH PHASE: Try to find an existing user in any of the requested interests
-for i, interest_set in ipairs(KEYS) do
+local dropped = 0
+for i, interest_set in ipairs(interest_sets) do
     -- SPOP gets a random user and removes them from the set atomically
-    local partner = redis.call('SPOP', interest_set)
-    
+    -- The caller themselves is popped too if they were already queued, the queue phase
+    -- adds them back if nobody else is found
+    local partner, partner_meta = nil, nil
+    while dropped < MAX_DROPPED do
+        local candidate = redis.call('SPOP', interest_set)
+        if not candidate then
+            break
+        end
+
+        if candidate ~= current_user then
+            local candidate_meta = redis.call('HMGET', 'user_meta:{' .. candidate .. '}', 'interests', 'channel', 'status')
+            if candidate_meta[2] and candidate_meta[3] == 'searching' and is_live(candidate) then
+                partner, partner_meta = candidate, candidate_meta
+                break
+            end
+            -- Stale entry (no metadata, no longer searching or a ghost), drop it and keep looking
+            dropped = dropped + 1
+        end
+    end
+
     if partner then
         -- We found a partner! 
         -- To prevent User B (partner) from being matched again via another interest set,
         -- we must ensure they are scrubbed from all other sets they might be in.
         
-        -- CLEANUP PHASE: Get partner's other interests to remove them from those sets
-        local partner_interests_raw = redis.call('HGET', 'user_meta:' .. partner, 'interests')
+        -- CLEANUP PHASE: Remove the partner from every other set they were waiting in
+        local partner_interests_raw = partner_meta[1]
+        local partner_channel = partner_meta[2]
         
         if partner_interests_raw then
             for topic in string.gmatch(partner_interests_raw, '([^,]+)') do
                 -- Remove partner from every set they were waiting in
-                redis.call('SREM', 'interest:' .. topic, partner)
+                redis.call('SREM', 'interest:{' .. topic .. '}', partner)
             end
         end
 
-        -- CREATE THE MATCH
-        -- Store the relationship both ways so either side can find their partner
-        redis.call('HSET', 'active_matches', current_user, partner)
-        redis.call('HSET', 'active_matches', partner, current_user)
-        redis.call('HSET', 'user_meta:' .. current_user, 'partner', partner)
+        -- The caller may have been queued by an earlier attempt, take them out as well
+        for j, caller_set in ipairs(interest_sets) do
+            redis.call('SREM', caller_set, current_user)
+        end
 
-        -- Update statuses
-        redis.call('HSET', 'user_meta:' .. current_user, 'status', 'chatting')
-        redis.call('HSET', 'user_meta:' .. partner, 'status', 'chatting')
+        -- CREATE THE MATCH
+        -- Store the relationship both ways (a partner pointer per user) so either side can find their partner
+        redis.call('HSET', 'user_meta:{' .. current_user .. '}', 'partner', partner, 'status', 'chatting')
+        redis.call('HSET', 'user_meta:{' .. partner .. '}', 'partner', current_user, 'status', 'chatting')
 
-        -- Return the partner ID to Django
-        return partner
+        -- Return the partner ID and channel to Django
+        return {partner, partner_channel or ''}
     end
 end
 
 -- QUEUE PHASE: No partner found in any interest set
 -- Add current user to all their interest sets so the NEXT person can find them
-for i, interest_set in ipairs(KEYS) do
+for i, interest_set in ipairs(interest_sets) do
     redis.call('SADD', interest_set, current_user)
 end
 
+-- Index the topics that have waiters so the background matchmaker knows where to look
+for topic in string.gmatch(interests_raw, '([^,]+)') do
+    redis.call('SADD', 'queued_interests', topic)
+end
+
 -- Update status to searching
-redis.call('HSET', 'user_meta:' .. current_user, 'status', 'searching')
+redis.call('HSET', 'user_meta:{' .. current_user .. '}', 'status', 'searching')
 
-return nil -- Signals to Django: "No match yet, keep waiting"
\ No newline at end of file
+return {} -- Signals to Django: "No match yet, keep waiting"
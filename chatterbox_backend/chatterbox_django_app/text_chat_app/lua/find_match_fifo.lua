@@ -0,0 +1,135 @@
+-- FIFO variant of find_match.lua, used when MATCH_QUEUE_MODE = "fifo"
+-- Interest queues are sorted sets (interest_q:{topic}) scored by enqueue time in ms,
+-- so the longest waiting compatible user is always matched first.
+--
+-- ARGV[1] : Current User ID (e.g., "user_A")
+-- Returns   : nil if the user has no interests saved (set_profile not called yet)
+--             {} if no partner was found and the user was queued, or the user is already
+--             in a chat (a retry that arrives after the matchmaker paired them)
+--             {partner_id, partner_channel} if a match was made
+
+local current_user = ARGV[1]
+
+-- Stale entries dropped per call at most, so a queue full of ghosts can't block Redis for
+-- long. The rest is dropped by later calls and by the presence sweep.
+local MAX_DROPPED = 100
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- Records how long a matched user waited into the match_wait_seconds histogram
+local function record_wait(enqueued_ms)
+    local waited = math.max(0, now_ms - enqueued_ms) / 1000
+    local buckets = {1, 5, 15, 30, 60, 120, 300}
+    local bucket = '+Inf'
+    for i, le in ipairs(buckets) do
+        if waited <= le then
+            bucket = tostring(le)
+            break
+        end
+    end
+    redis.call('HINCRBY', 'match_wait_seconds', 'le_' .. bucket, 1)
+    redis.call('HINCRBY', 'match_wait_seconds', 'count', 1)
+    redis.call('HINCRBYFLOAT', 'match_wait_seconds', 'sum', waited)
+end
+
+-- Waiters whose presence lease lapsed (their worker died before clean_up ran) are ghosts
+local function is_live(user)
+    local lease = redis.call('ZSCORE', 'presence', user)
+    return lease and tonumber(lease) >= now_ms
+end
+
+local meta = redis.call('HMGET', 'user_meta:{' .. current_user .. '}', 'interests', 'status')
+local interests_raw = meta[1]
+if not interests_raw then
+    return nil
+end
+
+-- Already matched, the match notification is on its way
+if meta[2] ~= 'idle' and meta[2] ~= 'searching' then
+    return {}
+end
+
+local queues = {}
+for topic in string.gmatch(interests_raw, '([^,]+)') do
+    table.insert(queues, 'interest_q:{' .. topic .. '}')
+end
+
+-- SEARCH PHASE: Find the oldest waiter across all of the requested interests
+local partner = nil
+local partner_enqueued = nil
+local partner_meta = nil
+local dropped = 0
+for i, queue in ipairs(queues) do
+    -- Look at the two oldest entries in case the first one is the caller themselves
+    local head = redis.call('ZRANGE', queue, 0, 1, 'WITHSCORES')
+    local j = 1
+    while j <= #head do
+        local candidate = head[j]
+        local enqueued = tonumber(head[j + 1])
+        if candidate == current_user then
+            j = j + 2
+        else
+            local cmeta = redis.call('HMGET', 'user_meta:{' .. candidate .. '}', 'interests', 'channel', 'status')
+            if cmeta[2] and cmeta[3] == 'searching' and is_live(candidate) then
+                if partner_enqueued == nil or enqueued < partner_enqueued then
+                    partner = candidate
+                    partner_enqueued = enqueued
+                    partner_meta = cmeta
+                end
+                break
+            end
+            if dropped >= MAX_DROPPED then
+                break
+            end
+            -- Stale entry (no metadata, no longer searching or a ghost) dropped, look at
+            -- the new head of the queue
+            redis.call('ZREM', queue, candidate)
+            dropped = dropped + 1
+            head = redis.call('ZRANGE', queue, 0, 1, 'WITHSCORES')
+            j = 1
+        end
+    end
+end
+
+if partner then
+    -- CLEANUP PHASE: Scrub the partner (and the caller, if they were queued) from every queue
+    if partner_meta[1] then
+        for topic in string.gmatch(partner_meta[1], '([^,]+)') do
+            redis.call('ZREM', 'interest_q:{' .. topic .. '}', partner)
+        end
+    end
+
+    local own_enqueued = nil
+    for i, queue in ipairs(queues) do
+        local score = redis.call('ZSCORE', queue, current_user)
+        if score then
+            own_enqueued = math.min(own_enqueued or tonumber(score), tonumber(score))
+            redis.call('ZREM', queue, current_user)
+        end
+    end
+
+    -- CREATE THE MATCH
+    redis.call('HSET', 'user_meta:{' .. current_user .. '}', 'partner', partner, 'status', 'chatting')
+    redis.call('HSET', 'user_meta:{' .. partner .. '}', 'partner', current_user, 'status', 'chatting')
+
+    record_wait(partner_enqueued)
+    record_wait(own_enqueued or now_ms)
+
+    return {partner, partner_meta[2] or ''}
+end
+
+-- QUEUE PHASE: No partner found, join every interest queue.
+-- NX keeps the original enqueue time if the user retries, so their place in line is kept.
+for i, queue in ipairs(queues) do
+    redis.call('ZADD', queue, 'NX', now_ms, current_user)
+end
+
+-- Index the topics that have waiters so the background matchmaker knows where to look
+for topic in string.gmatch(interests_raw, '([^,]+)') do
+    redis.call('SADD', 'queued_interests', topic)
+end
+
+redis.call('HSET', 'user_meta:{' .. current_user .. '}', 'status', 'searching')
+
+return {}
@@ -0,0 +1,146 @@
+-- Overlap-scored variant of find_match.lua, used when MATCH_QUEUE_MODE = "overlap"
+-- Samples a bounded number of waiters from the caller's interest:{topic} sets and
+-- matches the one sharing the most interests with the caller.
+--
+-- ARGV[1] : Current User ID (e.g., "user_A")
+-- ARGV[2] : Maximum number of candidates to inspect (bounds script time)
+-- ARGV[3] : Minimum shared interests required before the fallback kicks in
+-- ARGV[4] : Seconds a user waits before accepting a single shared interest (fallback)
+-- Returns   : nil if the user has no interests saved (set_profile not called yet)
+--             {} if no partner was found and the user was queued, or the user is already
+--             in a chat (a retry that arrives after the matchmaker paired them)
+--             {partner_id, partner_channel} if a match was made
+
+local current_user = ARGV[1]
+local max_candidates = tonumber(ARGV[2])
+local min_overlap = tonumber(ARGV[3])
+local fallback_ms = tonumber(ARGV[4]) * 1000
+
+-- Stale entries dropped per call at most. Sampling already bounds the work, this keeps
+-- the writes bounded too.
+local MAX_DROPPED = 100
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- Waiters whose presence lease lapsed (their worker died before clean_up ran) are ghosts
+local function is_live(user)
+    local lease = redis.call('ZSCORE', 'presence', user)
+    return lease and tonumber(lease) >= now_ms
+end
+
+local meta = redis.call('HMGET', 'user_meta:{' .. current_user .. '}', 'interests', 'searching_since', 'status')
+local interests_raw = meta[1]
+if not interests_raw then
+    return nil
+end
+
+-- Already matched, the match notification is on its way
+if meta[3] ~= 'idle' and meta[3] ~= 'searching' then
+    return {}
+end
+
+local own_topics = {}
+local own_count = 0
+for topic in string.gmatch(interests_raw, '([^,]+)') do
+    if not own_topics[topic] then
+        own_topics[topic] = true
+        own_count = own_count + 1
+    end
+end
+
+-- Shared interests a user still insists on, given how long they have been searching
+local function required_overlap(topic_count, searching_since)
+    if searching_since and now_ms - tonumber(searching_since) >= fallback_ms then
+        return 1
+    end
+    return math.max(1, math.min(min_overlap, topic_count))
+end
+
+local own_required = required_overlap(own_count, meta[2])
+
+-- SEARCH PHASE: Sample candidates evenly from every interest set (bounded by max_candidates)
+local per_set = math.max(1, math.floor(max_candidates / own_count))
+local seen = {}
+local best, best_channel, best_interests, best_score = nil, nil, nil, 0
+local inspected = 0
+local dropped = 0
+
+for topic in pairs(own_topics) do
+    if inspected >= max_candidates then
+        break
+    end
+
+    local sample = redis.call('SRANDMEMBER', 'interest:{' .. topic .. '}', per_set)
+    for i, candidate in ipairs(sample) do
+        if inspected >= max_candidates then
+            break
+        end
+
+        if candidate ~= current_user and not seen[candidate] then
+            seen[candidate] = true
+            inspected = inspected + 1
+
+            local cmeta = redis.call('HMGET', 'user_meta:{' .. candidate .. '}', 'interests', 'channel', 'status', 'searching_since')
+            if not (cmeta[1] and cmeta[2] and cmeta[3] == 'searching' and is_live(candidate)) then
+                -- Stale entry (no metadata, no longer searching or a ghost), drop it
+                if dropped < MAX_DROPPED then
+                    redis.call('SREM', 'interest:{' .. topic .. '}', candidate)
+                    dropped = dropped + 1
+                end
+            else
+                local score = 0
+                local candidate_count = 0
+                for ctopic in string.gmatch(cmeta[1], '([^,]+)') do
+                    candidate_count = candidate_count + 1
+                    if own_topics[ctopic] then
+                        score = score + 1
+                    end
+                end
+
+                if score > best_score
+                    and score >= own_required
+                    and score >= required_overlap(candidate_count, cmeta[4]) then
+                    best, best_channel, best_interests, best_score = candidate, cmeta[2], cmeta[1], score
+                    if best_score == own_count then
+                        break -- Can't do better than sharing every interest
+                    end
+                end
+            end
+        end
+    end
+
+    if best_score == own_count then
+        break
+    end
+end
+
+if best then
+    -- CLEANUP PHASE: Scrub both users from every set they were waiting in
+    for topic in string.gmatch(best_interests, '([^,]+)') do
+        redis.call('SREM', 'interest:{' .. topic .. '}', best)
+    end
+    for topic in pairs(own_topics) do
+        redis.call('SREM', 'interest:{' .. topic .. '}', current_user)
+    end
+
+    -- CREATE THE MATCH
+    redis.call('HSET', 'user_meta:{' .. current_user .. '}', 'partner', best, 'status', 'chatting')
+    redis.call('HSET', 'user_meta:{' .. best .. '}', 'partner', current_user, 'status', 'chatting')
+    redis.call('HDEL', 'user_meta:{' .. current_user .. '}', 'searching_since')
+    redis.call('HDEL', 'user_meta:{' .. best .. '}', 'searching_since')
+
+    return {best, best_channel}
+end
+
+-- QUEUE PHASE: No acceptable partner yet, join every interest set.
+-- HSETNX keeps the original search start so retries still count towards the fallback.
+for topic in pairs(own_topics) do
+    redis.call('SADD', 'interest:{' .. topic .. '}', current_user)
+    redis.call('SADD', 'queued_interests', topic)
+end
+
+redis.call('HSETNX', 'user_meta:{' .. current_user .. '}', 'searching_since', now_ms)
+redis.call('HSET', 'user_meta:{' .. current_user .. '}', 'status', 'searching')
+
+return {}
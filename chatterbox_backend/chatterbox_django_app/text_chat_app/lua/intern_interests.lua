@@ -0,0 +1,36 @@
+-- KEYS[1] : The interest catalog hash ("interest_catalog"): "n:{name}" -> ID, "i:{ID}" -> name,
+--           "size" and "epoch" (set when the catalog is created, changes if it was lost)
+-- ARGV[1] : Maximum number of interests in the catalog
+-- ARGV[2..]: Normalized interest names
+-- Returns   : {epoch, ID of each name in order}, nil for new names that don't fit in a full catalog
+
+local catalog = KEYS[1]
+local max_size = tonumber(ARGV[1])
+
+local epoch = redis.call('HGET', catalog, 'epoch')
+if not epoch then
+    local time = redis.call('TIME')
+    epoch = time[1] .. '.' .. time[2]
+    redis.call('HSET', catalog, 'epoch', epoch)
+end
+
+local result = {epoch}
+for i = 2, #ARGV do
+    local name = ARGV[i]
+    local id = redis.call('HGET', catalog, 'n:' .. name)
+
+    if not id then
+        -- IDs are handed out in order and never reused
+        local size = tonumber(redis.call('HGET', catalog, 'size') or '0')
+        if size < max_size then
+            id = tostring(redis.call('HINCRBY', catalog, 'size', 1))
+            redis.call('HSET', catalog, 'n:' .. name, id, 'i:' .. id, name)
+        else
+            id = false
+        end
+    end
+
+    result[#result + 1] = id
+end
+
+return result
@@ -1,18 +1,19 @@
--- KEYS[1...N] : The interest set keys (e.g., "interest:rock", "interest:coding")
--- ARGV[1]     : User ID (e.g., "user123")
--- ARGV[2]     : Channel Name (from Django Channels)
--- ARGV[3]     : Comma-separated string of interests (for easy cleanup later)
+-- KEYS[1] : The user's metadata hash (e.g., "user_meta:{user123}")
+-- ARGV[1] : Channel Name (from Django Channels)
+-- ARGV[2] : Comma-separated interest IDs from the interest catalog (for easy cleanup later)
 
-local user_id = ARGV[1]
-local channel_name = ARGV[2]
-local interests_str = ARGV[3]
+local user_key = KEYS[1]
+local channel_name = ARGV[1]
+local interests_str = ARGV[2]
 
 -- Save user metadata to a Hash
 -- This allows the server to remember the user's "state"
-redis.call('HSET', 'user_meta:' .. user_id, 
+redis.call('HSET', user_key,
     'channel', channel_name, 
     'interests', interests_str,
     'status', 'searching'
 )
+-- A new search drops the offer to hand an HTTP-matched chat over (see claim_handover.lua)
+redis.call('HDEL', user_key, 'room', 'role')
 
-return nil
\ No newline at end of file
+return nil
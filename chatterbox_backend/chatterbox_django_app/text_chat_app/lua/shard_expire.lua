@@ -0,0 +1,16 @@
+-- Cluster-safe step of MATCH_QUEUE_MODE = "sharded" (see sharded_matching.py).
+-- Pops users whose presence lease lapsed, so exactly one sweeper cleans each of them up.
+--
+-- KEYS[1] : The presence leases (presence)
+-- ARGV[1] : Maximum number of expired users to pop
+-- Returns   : List of expired user ids
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now_ms, 'LIMIT', 0, tonumber(ARGV[1]))
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+end
+
+return expired
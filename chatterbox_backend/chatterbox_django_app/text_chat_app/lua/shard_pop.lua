@@ -0,0 +1,18 @@
+-- Cluster-safe step of MATCH_QUEUE_MODE = "sharded" (see sharded_matching.py).
+-- Pops the oldest waiter of one interest queue. Each interest_q:{topic} hashes to its
+-- own slot, so queues spread over every node of the cluster.
+--
+-- KEYS[1] : The interest queue (interest_q:{topic})
+-- ARGV[1] : User ID to skip, e.g. the caller themselves ('' to skip nobody)
+-- Returns   : {user_id, enqueued_ms} of the popped waiter, or nil if nobody else is waiting
+
+-- Look at the two oldest entries in case the first one is the skipped user
+local head = redis.call('ZRANGE', KEYS[1], 0, 1, 'WITHSCORES')
+for i = 1, #head, 2 do
+    if head[i] ~= ARGV[1] then
+        redis.call('ZREM', KEYS[1], head[i])
+        return {head[i], head[i + 1]}
+    end
+end
+
+return nil
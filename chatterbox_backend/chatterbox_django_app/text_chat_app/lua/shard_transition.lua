@@ -0,0 +1,51 @@
+-- Cluster-safe step of MATCH_QUEUE_MODE = "sharded" (see sharded_matching.py).
+-- Moves one user to a new status only if they are in an expected one (compare-and-set).
+-- It only touches the user's own hash, so it runs on whichever node owns that slot.
+--
+-- KEYS[1] : The user's metadata hash (user_meta:{user_id})
+-- ARGV[1] : Comma-separated statuses the user must currently be in ('*' for any)
+-- ARGV[2] : New status ('' deletes the metadata, used on disconnect)
+-- ARGV[3] : New partner pointer ('' clears it)
+-- ARGV[4] : Partner the user must currently point at ('' for any)
+-- Returns   : {channel, interests, previous_partner} or nil if the user is missing or in another state
+
+local user_key = KEYS[1]
+
+local meta = redis.call('HMGET', user_key, 'status', 'channel', 'interests', 'partner')
+if not meta[1] then
+    return nil -- No metadata (set_profile not called yet, or the user disconnected)
+end
+
+if ARGV[1] ~= '*' then
+    local allowed = false
+    for status in string.gmatch(ARGV[1], '([^,]+)') do
+        if status == meta[1] then
+            allowed = true
+            break
+        end
+    end
+    if not allowed then
+        return nil
+    end
+end
+
+if ARGV[4] ~= '' and meta[4] ~= ARGV[4] then
+    return nil
+end
+
+-- false values would truncate the reply, so missing fields are returned as ''
+local result = {meta[2] or '', meta[3] or '', meta[4] or ''}
+
+if ARGV[2] == '' then
+    redis.call('DEL', user_key)
+    return result
+end
+
+redis.call('HSET', user_key, 'status', ARGV[2])
+if ARGV[3] == '' then
+    redis.call('HDEL', user_key, 'partner')
+else
+    redis.call('HSET', user_key, 'partner', ARGV[3])
+end
+
+return result
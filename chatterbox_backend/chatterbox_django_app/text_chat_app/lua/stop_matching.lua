@@ -1,13 +1,20 @@
--- KEYS[1...N] : The interest set keys (e.g., "interest:rock", "interest:coding")
 -- ARGV[1] : current_user
+-- Returns   : 1 if the user was removed from their queues, 0 if they had no interests saved
 
 local current_user = ARGV[1]
 
-for i, interest_set in ipairs(KEYS) do
-    redis.call('SREM', interest_set, current_user)
+local interests_raw = redis.call('HGET', 'user_meta:{' .. current_user .. '}', 'interests')
+if not interests_raw then
+    return 0
+end
+
+for topic in string.gmatch(interests_raw, '([^,]+)') do
+    redis.call('SREM', 'interest:{' .. topic .. '}', current_user)
+    redis.call('ZREM', 'interest_q:{' .. topic .. '}', current_user) -- FIFO mode queues
 end
 
 -- Update status to idle
-redis.call('HSET', 'user_meta:' .. current_user, 'status', 'idle')
+redis.call('HSET', 'user_meta:{' .. current_user .. '}', 'status', 'idle')
+redis.call('HDEL', 'user_meta:{' .. current_user .. '}', 'searching_since') -- overlap mode fallback timer
 
-return nil
\ No newline at end of file
+return 1
@@ -0,0 +1,42 @@
+-- Cleans up users whose presence lease lapsed, i.e. their worker died (OOM kill, restart)
+-- before disconnect could run clean_up.lua. Same cleanup as clean_up.lua, in bounded batches.
+--
+-- ARGV[1] : Maximum number of expired users to clean up in this call (bounds script time)
+-- Returns   : Flat list {partner_id, partner_channel, ...} of live partners left in a dead chat
+
+local batch = tonumber(ARGV[1])
+
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local partners = {}
+local expired = redis.call('ZRANGEBYSCORE', 'presence', '-inf', now_ms, 'LIMIT', 0, batch)
+
+for i, user_id in ipairs(expired) do
+    local user_key = 'user_meta:{' .. user_id .. '}'
+    local meta = redis.call('HMGET', user_key, 'partner', 'interests')
+
+    -- Unlink the partner if they still point back at the ghost
+    if meta[1] then
+        local partner_key = 'user_meta:{' .. meta[1] .. '}'
+        local partner_meta = redis.call('HMGET', partner_key, 'partner', 'channel')
+        if partner_meta[1] == user_id then
+            redis.call('HDEL', partner_key, 'partner')
+            redis.call('HSET', partner_key, 'status', 'idle')
+            table.insert(partners, meta[1])
+            table.insert(partners, partner_meta[2] or '')
+        end
+    end
+
+    if meta[2] then
+        for topic in string.gmatch(meta[2], '([^,]+)') do
+            redis.call('SREM', 'interest:{' .. topic .. '}', user_id)
+            redis.call('ZREM', 'interest_q:{' .. topic .. '}', user_id)
+        end
+    end
+
+    redis.call('DEL', user_key)
+    redis.call('ZREM', 'presence', user_id)
+end
+
+return partners
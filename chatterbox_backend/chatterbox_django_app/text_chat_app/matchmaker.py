@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import uuid
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from core.redis_client import get_redis_client
+from core.services.circuit_breaker import CircuitBreaker
+from core.services.script_registry import ScriptRegistry
+from .sharded_matching import ShardedMatching
+
+logger = logging.getLogger(__name__)
+
+# batch_match script to use for each MATCH_QUEUE_MODE
+BATCH_MATCH_SCRIPTS = {
+    "random": "batch_match",
+    "fifo": "batch_match_fifo",
+    "overlap": "batch_match_overlap",
+    "sharded": "batch_match", # ShardedMatching.batch_match, no single script
+}
+
+
+class Matchmaker:
+    """
+    Per-worker background task that pairs queued users in bulk.
+
+    Users who get no immediate match in find_match stay in their interest queues.
+    Every tick, one batch_match call pairs up to MATCHMAKER_BATCH_SIZE of them and the
+    matchmaker pushes the match and room assignment to both channels, so clients
+    don't have to keep retrying start_matching. Matching is suspended while the
+    common pool's circuit breaker is open.
+    """
+
+    # Class-level state: one matchmaker task per worker process
+    _task = None
+
+    def __init__(self):
+        self.redis_client = None
+        self.channel_layer = get_channel_layer()
+        self.script_name = BATCH_MATCH_SCRIPTS[settings.MATCH_QUEUE_MODE]
+
+    @classmethod
+    def ensure_started(cls):
+        """Starts the matchmaker on the running event loop if it isn't running already."""
+        if not settings.MATCHMAKER_ENABLED:
+            return
+
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.get_running_loop().create_task(cls()._run())
+            logger.info("Matchmaker started.")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Error during matchmaker tick: {e}")
+
+            await asyncio.sleep(settings.MATCHMAKER_TICK)
+
+    async def tick(self) -> int:
+        """Runs one matching batch and notifies every matched pair. Returns the number of pairs."""
+        if self.redis_client is None:
+            self.redis_client = await get_redis_client()
+
+        if CircuitBreaker.get("common").is_open:
+            # Redis is failing, handlers are failing fast, don't add batches to its load
+            return 0
+
+        if settings.MATCH_QUEUE_MODE == "sharded":
+            result = await ShardedMatching(self.redis_client).batch_match(
+                settings.MATCHMAKER_BATCH_SIZE, settings.MATCHMAKER_SCAN_LIMIT
+            )
+        else:
+            result = await self._batch_match()
+
+        for i in range(0, len(result), 4):
+            caller_id, caller_channel, callee_id, callee_channel = result[i:i + 4]
+            await self.announce_match(caller_id, caller_channel, callee_id, callee_channel)
+
+        return len(result) // 4
+
+    async def _batch_match(self):
+        args = [settings.MATCHMAKER_BATCH_SIZE, settings.MATCHMAKER_SCAN_LIMIT]
+        if settings.MATCH_QUEUE_MODE == "overlap":
+            args += [
+                settings.MATCH_OVERLAP_CANDIDATES,
+                settings.MATCH_OVERLAP_MIN,
+                settings.MATCH_OVERLAP_FALLBACK,
+            ]
+
+        return await ScriptRegistry.call(self.redis_client, self.script_name, 0, *args)
+
+    async def announce_match(self, caller_id, caller_channel, callee_id, callee_channel):
+        # Create room and notify both users (no channel layer group, partners message each other directly)
+        room_name = f"room_{uuid.uuid4().hex[:8]}"
+
+        for channel, partner_id, partner_channel, role in (
+            (caller_channel, callee_id, callee_channel, "caller"),
+            (callee_channel, caller_id, caller_channel, "callee"),
+        ):
+            await self.channel_layer.send(
+                channel,
+                {
+                    "type": "handle_match_found",
+                    "partner_user_id": partner_id,
+                    "partner_channel": partner_channel,
+                },
+            )
+            await self.channel_layer.send(
+                channel,
+                {
+                    "type": "handle_room_assignment",
+                    "room_name": room_name,
+                    "role": role,  # for webRTC communication
+                },
+            )
@@ -0,0 +1,115 @@
+"""
+Typed client -> server messages.
+
+Every JSON frame is decoded straight into the struct its "type" names, in one pass with
+msgspec, and binary frames decode their MessagePack body into the same structs. A frame
+that doesn't fit (bad JSON, unknown type, missing or mistyped field) raises
+InvalidMessage before any handler runs, so it is rejected with an error response
+instead of failing inside a handler. Keys the server doesn't read ("description",
+"timestamp") are skipped.
+"""
+
+from typing import Any, Union
+
+import msgspec
+
+# Raised by the decoders on a malformed frame. Its ValidationError subclass means the
+# frame parsed but doesn't match a message (unknown type, missing or mistyped field).
+InvalidMessage = msgspec.DecodeError
+SchemaMismatch = msgspec.ValidationError
+
+
+class InterestsData(msgspec.Struct):
+    interests: list[str] = []
+
+
+class ChatData(msgspec.Struct):
+    message: str
+
+
+class Message(msgspec.Struct, tag_field="type"):
+    """Base of the client messages, "type" selects the struct."""
+
+
+class SubmitInterests(Message, tag="submit_interests"):
+    data: InterestsData
+
+
+class StartMatching(Message, tag="start_matching"):
+    pass
+
+
+class EndMatching(Message, tag="end_matching"):
+    pass
+
+
+class ChatMessage(Message, tag="chat_message"):
+    data: ChatData
+
+
+class EndChat(Message, tag="end_chat"):
+    pass
+
+
+class WebrtcSignal(Message, tag="webrtc_signal"):
+    data: Any = None # SDP / ICE candidate object, relayed as-is
+
+
+class Envelope(msgspec.Struct):
+    """A JSON frame's type and its "data" as the raw JSON the client sent (relayed frames)."""
+    type: str = ""
+    data: msgspec.Raw = msgspec.Raw(b"null")
+
+
+# "type" -> message struct
+MESSAGES = {
+    cls.__struct_config__.tag: cls
+    for cls in (SubmitInterests, StartMatching, EndMatching, ChatMessage, EndChat, WebrtcSignal)
+}
+
+# Relayed to the partner exactly as the client sent them. Chat bodies are validated first,
+# signalling bodies are opaque to the server
+RELAYED = {ChatMessage, WebrtcSignal}
+
+_json_decoder = msgspec.json.Decoder(Union[tuple(MESSAGES.values())])
+_envelope_decoder = msgspec.json.Decoder(Envelope)
+
+# Raw JSON "data" of a relayed frame, decoded into the message's data struct when needed
+_data_decoders = {
+    ChatMessage: msgspec.json.Decoder(ChatData),
+}
+
+_EMPTY_MAP = b"\x80" # MessagePack {}
+
+# Binary bodies are the "data" object, decoded into the message's data struct
+_body_decoders = {
+    SubmitInterests: msgspec.msgpack.Decoder(InterestsData),
+    ChatMessage: msgspec.msgpack.Decoder(ChatData),
+}
+
+
+def decode_json(text: str) -> Message:
+    """Decodes a JSON frame into its message struct, raises InvalidMessage."""
+    return _json_decoder.decode(text)
+
+
+def decode_envelope(text: str) -> Envelope:
+    """
+    Decodes a JSON frame's envelope, raises InvalidMessage. The data is checked to be JSON
+    but not decoded. With duplicate keys the last one wins, like in the partner's decoder.
+    """
+    return _envelope_decoder.decode(text)
+
+
+def decode_data(cls, data: bytes):
+    """Decodes the raw JSON data of a relayed frame into the message's data struct, raises InvalidMessage."""
+    return _data_decoders[cls].decode(data)
+
+
+def decode_body(cls, body: bytes) -> Message:
+    """Builds a message from a binary frame's body, raises InvalidMessage."""
+    decoder = _body_decoders.get(cls)
+    if decoder is None:
+        return cls()
+    # An empty body means an empty data object
+    return cls(data=decoder.decode(body or _EMPTY_MAP))
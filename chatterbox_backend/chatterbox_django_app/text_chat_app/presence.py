@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from core.metrics import PRESENCE_ENDED_CHATS
+from core.redis_client import get_redis_client
+from core.services.script_registry import ScriptRegistry
+from .admission import Admission
+from .interests import InterestCatalog
+from .sharded_matching import PRESENCE_KEY, ShardedMatching
+
+logger = logging.getLogger(__name__)
+
+# Leases renewed per ZADD, keeps each command small when a worker holds many sockets
+RENEW_CHUNK = 1000
+
+
+class Presence:
+    """
+    Lease-based presence, so users whose worker died are not matched or kept in chats.
+
+    Every connected user holds a lease in the presence sorted set (score = expiry in ms).
+    A per-worker background task renews the leases of its own sockets every
+    PRESENCE_HEARTBEAT seconds, then sweeps leases that lapsed PRESENCE_LEASE seconds
+    after their worker stopped renewing: the ghost is cleaned up like a disconnect
+    and its partner is told the chat ended. The matching scripts skip ghosts until then.
+    """
+
+    # Class-level state: one heartbeat task per worker process
+    _task = None
+    local_users = {} # user_id -> channel of the socket holding the lease on this worker
+
+    def __init__(self):
+        self.redis_client = None
+        self.channel_layer = get_channel_layer()
+
+    @classmethod
+    def ensure_started(cls):
+        """Starts the heartbeat on the running event loop if it isn't running already."""
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.get_running_loop().create_task(cls()._run())
+            logger.info("Presence heartbeat started.")
+
+    @staticmethod
+    def lease_expiry() -> int:
+        return int((time.time() + settings.PRESENCE_LEASE) * 1000)
+
+    @classmethod
+    async def join(cls, redis_client, user_id, channel):
+        await redis_client.zadd(PRESENCE_KEY, {user_id: cls.lease_expiry()})
+        cls.local_users[user_id] = channel
+
+    @classmethod
+    def leave(cls, user_id, channel):
+        # The lease itself is removed by clean_up. A reconnect that opened before the old
+        # socket closed owns the entry now, keep it.
+        if cls.local_users.get(user_id) == channel:
+            del cls.local_users[user_id]
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Error during presence heartbeat: {e}")
+
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT)
+
+    async def tick(self) -> int:
+        """Renews this worker's leases and sweeps lapsed ones. Returns the number of partners notified."""
+        if self.redis_client is None:
+            self.redis_client = await get_redis_client("housekeeping")
+
+        await self.renew()
+
+        await InterestCatalog.check(self.redis_client)
+
+        if settings.WS_GLOBAL_MAX_CONNECTIONS:
+            # Live leases are the users online across all workers, for the global connection budget
+            Admission.refresh(await self.redis_client.zcount(PRESENCE_KEY, int(time.time() * 1000), "+inf"))
+
+        if settings.MATCH_QUEUE_MODE == "sharded":
+            result = await ShardedMatching(self.redis_client).sweep_presence(settings.PRESENCE_SWEEP_BATCH)
+        else:
+            result = await self._sweep()
+
+        for i in range(0, len(result), 2):
+            partner_id, partner_channel = result[i:i + 2]
+            if partner_channel:
+                await self.channel_layer.send(partner_channel, {"type": "handle_partner_ended_chat"})
+
+        PRESENCE_ENDED_CHATS.inc(amount=len(result) // 2)
+        return len(result) // 2
+
+    async def renew(self):
+        expiry = self.lease_expiry()
+        # Copy first, sockets connect and disconnect while the ZADDs are awaited
+        users = list(Presence.local_users)
+        for i in range(0, len(users), RENEW_CHUNK):
+            # No XX: a reconnected user's lease may have been removed by the old socket's
+            # clean_up. A lease re-added for a user that just left lapses and is swept.
+            await self.redis_client.zadd(
+                PRESENCE_KEY, {user_id: expiry for user_id in users[i:i + RENEW_CHUNK]}
+            )
+
+    async def _sweep(self):
+        return await ScriptRegistry.call(self.redis_client, "sweep_presence", 0, settings.PRESENCE_SWEEP_BATCH)
@@ -0,0 +1,210 @@
+import time
+
+from core.services.script_registry import ScriptRegistry
+
+# Stale waiters (matched elsewhere or disconnected) popped per queue before moving on
+MAX_STALE_POPS = 10
+
+# Sorted set of presence leases, user_id scored by lease expiry in ms (see presence.py)
+PRESENCE_KEY = "presence"
+
+
+def user_key(user_id: str) -> str:
+    # The braces are a Redis Cluster hash tag, all of a user's state lives in one slot
+    return f"user_meta:{{{user_id}}}"
+
+
+def queue_key(topic: str) -> str:
+    return f"interest_q:{{{topic}}}"
+
+
+def split_interests(interests_raw: str) -> list:
+    return [topic for topic in interests_raw.split(",") if topic]
+
+
+class ShardedMatching:
+    """
+    Redis Cluster compatible matching, used when MATCH_QUEUE_MODE = "sharded".
+
+    The other modes match inside one Lua script that reads the partner's hash, which a
+    cluster can't run when the two users hash to different slots. Here every script
+    touches a single key declared in KEYS, and a match is built from steps:
+
+    1. lock the caller (searching/idle -> matching) so nobody else can claim them,
+    2. pop the oldest waiter of each interest_q:{topic} and claim them with a
+       compare-and-set (searching -> chatting, pointing back at the caller),
+    3. point the caller at the claimed partner (matching -> chatting), or, if nobody was
+       claimable, unlock them (matching -> searching) and ZADD them to their queues.
+
+    Waiters that fail the claim are stale and stay dropped from the queue they were
+    popped from. Methods return the same values as the single-node scripts they replace.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    async def _evalsha(self, script_name, key, *args):
+        return await ScriptRegistry.call(self.redis_client, script_name, 1, key, *args)
+
+    async def _transition(self, user_id, from_statuses, to_status, partner="", expect_partner=""):
+        return await self._evalsha(
+            "shard_transition", user_key(user_id), from_statuses, to_status, partner, expect_partner
+        )
+
+    async def _pop(self, topic, skip_user=""):
+        return await self._evalsha("shard_pop", queue_key(topic), skip_user)
+
+    async def _is_live(self, user_id):
+        # Waiters whose presence lease lapsed (their worker died before clean_up ran) are ghosts
+        lease = await self.redis_client.zscore(PRESENCE_KEY, user_id)
+        return lease is not None and lease >= time.time() * 1000
+
+    async def _dequeue(self, user_id, interests_raw):
+        # Single-key commands, the cluster pipeline routes each one to its slot
+        pipe = self.redis_client.pipeline(transaction=False)
+        for topic in split_interests(interests_raw):
+            pipe.zrem(queue_key(topic), user_id)
+        await pipe.execute()
+
+    async def _enqueue(self, user_id, interests_raw, enqueued_ms=None):
+        # NX keeps the original enqueue time if the user retries, so their place in line is kept
+        score = enqueued_ms if enqueued_ms is not None else int(time.time() * 1000)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for topic in split_interests(interests_raw):
+            pipe.zadd(queue_key(topic), {user_id: score}, nx=True)
+            pipe.sadd("queued_interests", topic)
+        await pipe.execute()
+
+    async def _claim(self, topic, skip_user="", partner_id=""):
+        """
+        Pops waiters from one queue until one is claimed: matched to partner_id (-> chatting),
+        or just locked (-> matching) without one. Returns (user, channel, interests, enqueued_ms).
+        """
+        to_status = "chatting" if partner_id else "matching"
+        for _ in range(MAX_STALE_POPS):
+            popped = await self._pop(topic, skip_user)
+            if popped is None:
+                return None
+
+            candidate, enqueued_ms = popped
+            if not await self._is_live(candidate):
+                continue
+            claimed = await self._transition(candidate, "searching", to_status, partner=partner_id)
+            if claimed is not None:
+                return candidate, claimed[0], claimed[1], int(float(enqueued_ms))
+            # Stale entry (no metadata, no longer searching or a ghost), drop it and keep looking
+        return None
+
+    async def _release(self, user_id, partner_id, interests_raw, enqueued_ms):
+        # Puts a claimed user back in line when the other side of the match went away
+        if await self._transition(user_id, "chatting", "searching", expect_partner=partner_id) is not None:
+            await self._enqueue(user_id, interests_raw, enqueued_ms)
+
+    async def _unlink_partner(self, user_id, partner_id):
+        # Only touch the partner if they still point back at this user
+        if not partner_id:
+            return None
+        partner = await self._transition(partner_id, "chatting", "idle", expect_partner=user_id)
+        return [partner_id, partner[0] if partner else ""]
+
+    async def find_match(self, user_id):
+        locked = await self._transition(user_id, "searching,idle", "matching")
+        if locked is None:
+            if not await self.redis_client.exists(user_key(user_id)):
+                return None
+            return [] # Already matched by someone else, the match notification is on its way
+
+        interests_raw = locked[1]
+        for topic in split_interests(interests_raw):
+            claim = await self._claim(topic, skip_user=user_id, partner_id=user_id)
+            if claim is None:
+                continue
+
+            partner_id, partner_channel, partner_interests, enqueued_ms = claim
+            # The caller is locked, so this only fails if they disconnected in the meantime
+            if await self._transition(user_id, "matching", "chatting", partner=partner_id) is None:
+                await self._release(partner_id, user_id, partner_interests, enqueued_ms)
+                return []
+
+            await self._dequeue(partner_id, partner_interests)
+            await self._dequeue(user_id, interests_raw)
+            return [partner_id, partner_channel]
+
+        # No partner found, unlock before queueing so waiters are always claimable
+        if await self._transition(user_id, "matching", "searching") is not None:
+            await self._enqueue(user_id, interests_raw)
+        return []
+
+    async def stop_matching(self, user_id):
+        previous = await self._transition(user_id, "searching,idle", "idle")
+        if previous is None:
+            return 0
+        await self._dequeue(user_id, previous[1])
+        return 1
+
+    async def end_chat(self, user_id):
+        previous = await self._transition(user_id, "chatting", "idle")
+        if previous is None:
+            return None
+        return await self._unlink_partner(user_id, previous[2])
+
+    async def clean_up(self, user_id):
+        previous = await self._transition(user_id, "*", "")
+        await self.redis_client.zrem(PRESENCE_KEY, user_id)
+        if previous is None:
+            return None
+        await self._dequeue(user_id, previous[1])
+        return await self._unlink_partner(user_id, previous[2])
+
+    async def end_stale_chat(self, user_id, partner_id):
+        # The user reconnected before their old socket was cleaned up, end the old socket's chat
+        await self.redis_client.hdel(user_key(user_id), "partner")
+        return await self._unlink_partner(user_id, partner_id)
+
+    async def sweep_presence(self, batch):
+        """Cleans up users whose presence lease lapsed. Returns {partner_id, partner_channel, ...} to notify."""
+        partners = []
+        for user_id in await self._evalsha("shard_expire", PRESENCE_KEY, batch):
+            partner = await self.clean_up(user_id)
+            if partner and partner[1]:
+                partners += partner
+        return partners
+
+    async def batch_match(self, max_pairs, scan_limit):
+        """Pairs the oldest waiters of sampled topics. Returns {user_a, channel_a, user_b, channel_b, ...}."""
+        matched = []
+        topics = await self.redis_client.srandmember("queued_interests", scan_limit)
+
+        for topic in topics:
+            while len(matched) < max_pairs * 4:
+                # Lock the first waiter, then claim a second one for them
+                first = await self._claim(topic)
+                if first is None:
+                    break
+
+                user_a, channel_a, interests_a, enqueued_a = first
+                second = await self._claim(topic, skip_user=user_a, partner_id=user_a)
+                if second is None:
+                    # Only one valid waiter left, put them back in line
+                    if await self._transition(user_a, "matching", "searching") is not None:
+                        await self._enqueue(user_a, interests_a, enqueued_a)
+                    break
+
+                user_b, channel_b, interests_b, enqueued_b = second
+                if await self._transition(user_a, "matching", "chatting", partner=user_b) is None:
+                    await self._release(user_b, user_a, interests_b, enqueued_b)
+                    continue
+
+                await self._dequeue(user_a, interests_a)
+                await self._dequeue(user_b, interests_b)
+                matched += [user_a, channel_a, user_b, channel_b]
+
+            # Drop topics nobody is waiting on from the index. Not atomic with the queue,
+            # a waiter queued in between is still found by find_match and re-adds the topic.
+            if not await self.redis_client.zcard(queue_key(topic)):
+                await self.redis_client.srem("queued_interests", topic)
+
+            if len(matched) >= max_pairs * 4:
+                break
+
+        return matched
@@ -0,0 +1,94 @@
+from unittest import mock
+
+import redis
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, override_settings
+from text_chat_app.admission import (
+    GLOBAL_FULL_CLOSE_CODE,
+    WORKER_FULL_CLOSE_CODE,
+    Admission,
+)
+from text_chat_app.consumers import DEGRADED_CLOSE_CODE, ChatConsumer
+from .utils import (
+    IN_MEMORY_CHANNEL_LAYERS,
+    device_id,
+    fake_redis_client,
+    requires_fakeredis,
+    reset_worker_state,
+)
+
+
+@override_settings(WS_MAX_CONNECTIONS_PER_WORKER=2, WS_GLOBAL_MAX_CONNECTIONS=0)
+class AdmissionTests(SimpleTestCase):
+    def setUp(self):
+        reset_worker_state()
+
+    def test_worker_limit(self):
+        Admission.admit("a", "channel.a")
+        Admission.admit("b", "channel.b")
+        self.assertEqual(Admission.check("c"), WORKER_FULL_CLOSE_CODE)
+
+    def test_replacing_a_socket_is_always_admitted(self):
+        Admission.admit("a", "channel.a")
+        Admission.admit("b", "channel.b")
+        self.assertIsNone(Admission.check("a"))
+        self.assertEqual(Admission.admit("a", "channel.a2"), "channel.a")
+        self.assertEqual(len(Admission.sockets), 2)
+
+    def test_replaced_socket_does_not_release_its_replacement(self):
+        Admission.admit("a", "channel.a")
+        Admission.admit("a", "channel.a2")
+        Admission.release("a", "channel.a")
+        self.assertEqual(Admission.sockets, {"a": "channel.a2"})
+        Admission.release("a", "channel.a2")
+        self.assertEqual(Admission.sockets, {})
+
+    @override_settings(WS_GLOBAL_MAX_CONNECTIONS=3)
+    def test_global_budget_counts_admissions_since_refresh(self):
+        Admission.refresh(2)
+        self.assertIsNone(Admission.check("a"))
+        Admission.admit("a", "channel.a")
+        self.assertEqual(Admission.check("b"), GLOBAL_FULL_CLOSE_CODE)
+        Admission.refresh(1)
+        self.assertIsNone(Admission.check("b"))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConnectAdmissionTests(SimpleTestCase):
+    def setUp(self):
+        reset_worker_state()
+        self.user_id = device_id("admission")
+
+    def communicator(self):
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/textchat?id={self.user_id}")
+
+    async def test_failed_connect_releases_its_admission(self):
+        redis_client = mock.Mock()
+        redis_client.hget = mock.AsyncMock(side_effect=redis.exceptions.ConnectionError("Redis is down"))
+
+        with mock.patch("text_chat_app.consumers.get_redis_client", mock.AsyncMock(return_value=redis_client)):
+            for _ in range(3):
+                communicator = self.communicator()
+                connected, close_code = await communicator.connect()
+                self.assertFalse(connected)
+                self.assertEqual(close_code, DEGRADED_CLOSE_CODE)
+
+        self.assertEqual(Admission.sockets, {})
+        self.assertEqual(Admission.admitted_since_refresh, 3)
+
+    @requires_fakeredis
+    async def test_disconnect_releases_its_admission(self):
+        redis_client = fake_redis_client()
+
+        with mock.patch("text_chat_app.consumers.get_redis_client", mock.AsyncMock(return_value=redis_client)), \
+                mock.patch("text_chat_app.consumers.Matchmaker.ensure_started"), \
+                mock.patch("text_chat_app.consumers.Presence.ensure_started"), \
+                mock.patch("text_chat_app.consumers.WorkerDrain.install"), \
+                mock.patch("text_chat_app.consumers.CleanupCoalescer.submit"):
+            communicator = self.communicator()
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertIn(self.user_id, Admission.sockets)
+            await communicator.disconnect()
+
+        self.assertEqual(Admission.sockets, {})
@@ -0,0 +1,95 @@
+import asyncio
+import time
+from unittest import mock
+
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, override_settings
+from text_chat_app.cleanup import CleanupCoalescer
+from text_chat_app.presence import Presence
+from text_chat_app.sharded_matching import PRESENCE_KEY, user_key
+from .utils import IN_MEMORY_CHANNEL_LAYERS, fake_redis_client, requires_fakeredis, reset_worker_state
+
+
+@requires_fakeredis
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CLEANUP_BATCH_SIZE=2)
+@mock.patch.object(CleanupCoalescer, "_run", mock.AsyncMock()) # flushed by the tests
+class CleanupCoalescerTests(SimpleTestCase):
+    modes = ("random", "sharded")
+
+    def setUp(self):
+        reset_worker_state()
+        self.addCleanup(reset_worker_state)
+
+    async def start(self):
+        self.channel_layer = get_channel_layer()
+        self.coalescer = CleanupCoalescer()
+        self.coalescer.redis_client = self.redis_client = fake_redis_client()
+
+    async def chatting(self, user_id, partner_id, channel=None):
+        await self.redis_client.hset(user_key(user_id), mapping={
+            "channel": channel or await self.channel_layer.new_channel(),
+            "interests": "1",
+            "status": "chatting",
+            "partner": partner_id,
+        })
+        await self.redis_client.zadd(PRESENCE_KEY, {user_id: int(time.time() * 1000) + 60_000})
+
+    async def notified(self, user_id):
+        channel = await self.redis_client.hget(user_key(user_id), "channel")
+        return (await asyncio.wait_for(self.channel_layer.receive(channel), 1))["type"]
+
+    async def assert_not_notified(self, user_id):
+        channel = await self.redis_client.hget(user_key(user_id), "channel")
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.channel_layer.receive(channel), 0.05)
+
+    async def test_disconnects_are_cleaned_up_in_batches(self):
+        for mode in self.modes:
+            with self.subTest(mode=mode), override_settings(MATCH_QUEUE_MODE=mode):
+                await self.start()
+                for i in range(3):
+                    await self.chatting(f"gone{i}", f"left{i}", channel=f"chan.gone{i}")
+                    await self.chatting(f"left{i}", f"gone{i}")
+                    CleanupCoalescer.submit(f"gone{i}", f"chan.gone{i}")
+
+                self.assertEqual(await self.coalescer.flush(), 3)
+                for i in range(3):
+                    self.assertFalse(await self.redis_client.exists(user_key(f"gone{i}")))
+                    self.assertIsNone(await self.redis_client.zscore(PRESENCE_KEY, f"gone{i}"))
+                    self.assertEqual(await self.redis_client.hmget(user_key(f"left{i}"), "partner", "status"), [None, "idle"])
+                    self.assertEqual(await self.notified(f"left{i}"), "handle_partner_ended_chat")
+
+    async def test_reconnected_user_keeps_the_new_session(self):
+        for mode in self.modes:
+            with self.subTest(mode=mode), override_settings(MATCH_QUEUE_MODE=mode):
+                await self.start()
+                # Reconnected on this worker and searching again, the old chat is left over
+                await self.chatting("user", "old", channel="chan.new")
+                await self.redis_client.hset(user_key("user"), "status", "searching")
+                await self.chatting("old", "user")
+                # Its lease went with the old session's
+                await self.redis_client.zrem(PRESENCE_KEY, "user")
+                Presence.local_users["user"] = "chan.new"
+                CleanupCoalescer.submit("user", "chan.old")
+
+                self.assertEqual(await self.coalescer.flush(), 1)
+                self.assertEqual(
+                    await self.redis_client.hmget(user_key("user"), "channel", "status", "partner"),
+                    ["chan.new", "searching", None],
+                )
+                self.assertIsNotNone(await self.redis_client.zscore(PRESENCE_KEY, "user"))
+                self.assertEqual(await self.notified("old"), "handle_partner_ended_chat")
+                Presence.local_users.clear()
+
+    async def test_reconnected_user_in_a_new_chat_is_left_alone(self):
+        for mode in self.modes:
+            with self.subTest(mode=mode), override_settings(MATCH_QUEUE_MODE=mode):
+                await self.start()
+                await self.chatting("user", "new", channel="chan.new")
+                await self.chatting("new", "user")
+                CleanupCoalescer.submit("user", "chan.old")
+
+                self.assertEqual(await self.coalescer.flush(), 1)
+                self.assertEqual(await self.redis_client.hmget(user_key("user"), "partner", "status"), ["new", "chatting"])
+                self.assertEqual(await self.redis_client.hget(user_key("new"), "partner"), "user")
+                await self.assert_not_notified("new")
@@ -0,0 +1,214 @@
+import time
+
+from django.test import SimpleTestCase, override_settings
+from core.services.script_registry import ScriptRegistry
+from text_chat_app.consumers import MATCH_SCRIPTS, find_match_args
+from text_chat_app.sharded_matching import PRESENCE_KEY, user_key
+from .utils import fake_redis_client, requires_fakeredis
+
+
+class MatchScriptTestCase(SimpleTestCase):
+    def setUp(self):
+        self.redis_client = fake_redis_client()
+
+    async def join(self, user_id, interests="1"):
+        await ScriptRegistry.call(self.redis_client, "set_profile", 1, user_key(user_id), f"chan.{user_id}", interests)
+        await self.redis_client.zadd(PRESENCE_KEY, {user_id: int(time.time() * 1000) + 60_000})
+
+    async def find_match(self, mode, user_id):
+        with override_settings(MATCH_QUEUE_MODE=mode):
+            return await ScriptRegistry.call(self.redis_client, MATCH_SCRIPTS[mode], 0, *find_match_args(user_id))
+
+
+@requires_fakeredis
+class FindMatchTests(MatchScriptTestCase):
+    modes = ("random", "fifo", "overlap")
+
+    async def test_retry_is_not_matched_with_itself(self):
+        for mode in self.modes:
+            with self.subTest(mode=mode):
+                await self.redis_client.flushall()
+                await self.join("a")
+                self.assertEqual(await self.find_match(mode, "a"), [])
+                self.assertEqual(await self.find_match(mode, "a"), [])
+                self.assertEqual(await self.redis_client.hget(user_key("a"), "status"), "searching")
+
+    async def test_matched_user_is_not_matched_again(self):
+        for mode in self.modes:
+            with self.subTest(mode=mode):
+                await self.redis_client.flushall()
+                for user_id in ("a", "b", "c"):
+                    await self.join(user_id)
+                self.assertEqual(await self.find_match(mode, "a"), [])
+                self.assertEqual(await self.find_match(mode, "b"), ["a", "chan.a"])
+
+                # A retry of b that raced the match, c is waiting for the next one
+                self.assertEqual(await self.find_match(mode, "c"), [])
+                self.assertEqual(await self.find_match(mode, "b"), [])
+                self.assertEqual(await self.redis_client.hmget(user_key("b"), "partner", "status"), ["a", "chatting"])
+
+    async def test_queued_caller_leaves_every_queue_once_matched(self):
+        await self.join("a", "1,2")
+        self.assertEqual(await self.find_match("random", "a"), [])
+        await self.join("b", "1")
+        await self.redis_client.sadd("interest:{1}", "b")
+
+        self.assertEqual(await self.find_match("random", "a"), ["b", "chan.b"])
+        self.assertEqual(await self.redis_client.smembers("interest:{1}"), set())
+        self.assertEqual(await self.redis_client.smembers("interest:{2}"), set())
+
+    async def test_stale_queued_user_is_skipped(self):
+        for mode in self.modes:
+            with self.subTest(mode=mode):
+                await self.redis_client.flushall()
+                for user_id in ("a", "b", "c"):
+                    await self.join(user_id)
+                await self.redis_client.hset(user_key("a"), mapping={"status": "chatting", "partner": "z"})
+                await self.redis_client.zadd(PRESENCE_KEY, {"b": 0})
+                await self.redis_client.sadd("interest:{1}", "a", "b")
+                await self.redis_client.zadd("interest_q:{1}", {"a": 1, "b": 2})
+
+                self.assertEqual(await self.find_match(mode, "c"), [])
+                self.assertEqual(await self.redis_client.hmget(user_key("a"), "partner", "status"), ["z", "chatting"])
+
+    async def test_stale_entries_dropped_per_call_are_capped(self):
+        await self.join("a")
+        await self.redis_client.sadd("interest:{1}", *(f"ghost{i}" for i in range(150)))
+
+        self.assertEqual(await self.find_match("random", "a"), [])
+        self.assertEqual(await self.redis_client.scard("interest:{1}"), 51) # 50 ghosts and the caller
+        self.assertEqual(await self.find_match("random", "a"), [])
+        self.assertEqual(await self.redis_client.smembers("interest:{1}"), {"a"})
+
+    async def test_batch_match_skips_stale_waiters(self):
+        for user_id in ("a", "b", "c", "d"):
+            await self.join(user_id)
+        await self.redis_client.hset(user_key("a"), mapping={"status": "chatting", "partner": "z"})
+        await self.redis_client.zadd(PRESENCE_KEY, {"b": 0})
+        await self.redis_client.sadd("interest:{1}", "a", "b", "c", "d")
+        await self.redis_client.sadd("queued_interests", "1")
+
+        matched = await ScriptRegistry.call(self.redis_client, "batch_match", 0, 10, 10)
+        self.assertEqual(sorted(matched), ["c", "chan.c", "chan.d", "d"])
+        self.assertEqual(await self.redis_client.hget(user_key("a"), "partner"), "z")
+
+    async def test_fifo_matches_the_oldest_waiter_across_interests(self):
+        await self.join("caller", "1,2")
+        for user_id, topic, enqueued in (("newer", "1", 200), ("older", "2", 100), ("oldest_stale", "2", 50)):
+            await self.join(user_id, topic)
+            await self.redis_client.zadd(f"interest_q:{{{topic}}}", {user_id: enqueued})
+        await self.redis_client.zadd(PRESENCE_KEY, {"oldest_stale": 0})
+
+        self.assertEqual(await self.find_match("fifo", "caller"), ["older", "chan.older"])
+        self.assertEqual(await self.redis_client.zrange("interest_q:{1}", 0, -1), ["newer"])
+        self.assertEqual(await self.redis_client.zrange("interest_q:{2}", 0, -1), [])
+        self.assertEqual(await self.redis_client.hget("match_wait_seconds", "count"), "2")
+
+    async def test_fifo_retry_keeps_its_place_in_line(self):
+        await self.join("a")
+        await self.join("b")
+        self.assertEqual(await self.find_match("fifo", "a"), [])
+        enqueued = await self.redis_client.zscore("interest_q:{1}", "a")
+        self.assertEqual(await self.find_match("fifo", "a"), [])
+        self.assertEqual(await self.redis_client.zscore("interest_q:{1}", "a"), enqueued)
+        self.assertEqual(await self.find_match("fifo", "b"), ["a", "chan.a"])
+
+    async def test_batch_match_fifo_pairs_the_oldest_live_waiters(self):
+        for user_id in ("chatting", "ghost", "c", "d", "e"):
+            await self.join(user_id)
+        await self.redis_client.hset(user_key("chatting"), "status", "chatting")
+        await self.redis_client.zadd(PRESENCE_KEY, {"ghost": 0})
+        await self.redis_client.zadd("interest_q:{1}", {"chatting": 1, "ghost": 2, "c": 3, "d": 4, "e": 5})
+        await self.redis_client.sadd("queued_interests", "1")
+
+        matched = await ScriptRegistry.call(self.redis_client, "batch_match_fifo", 0, 10, 10)
+        self.assertEqual(matched, ["c", "chan.c", "d", "chan.d"])
+        # The leftover waiter is put back with its original enqueue time
+        self.assertEqual(await self.redis_client.zrange("interest_q:{1}", 0, -1, withscores=True), [("e", 5.0)])
+
+
+@requires_fakeredis
+@override_settings(MATCH_OVERLAP_CANDIDATES=32, MATCH_OVERLAP_MIN=2, MATCH_OVERLAP_FALLBACK=20)
+class OverlapMatchTests(MatchScriptTestCase):
+    async def searching_since(self, user_id, seconds_ago):
+        await self.redis_client.hset(user_key(user_id), "searching_since", int((time.time() - seconds_ago) * 1000))
+
+    async def queue(self, user_id, interests):
+        await self.join(user_id, interests)
+        for topic in interests.split(","):
+            await self.redis_client.sadd(f"interest:{{{topic}}}", user_id)
+        await self.redis_client.sadd("queued_interests", *interests.split(","))
+        await self.searching_since(user_id, 0)
+
+    async def test_candidate_sharing_the_most_interests_wins(self):
+        await self.queue("one", "1,7")
+        await self.queue("two", "1,2,8")
+        await self.queue("three", "1,2,3,9")
+        await self.join("caller", "1,2,3,4")
+
+        self.assertEqual(await self.find_match("overlap", "caller"), ["three", "chan.three"])
+        for topic in ("1", "2", "3", "4"):
+            self.assertNotIn("three", await self.redis_client.smembers(f"interest:{{{topic}}}"))
+        self.assertIsNone(await self.redis_client.hget(user_key("three"), "searching_since"))
+
+    async def test_ties_match_one_candidate(self):
+        await self.queue("x", "1,2,7")
+        await self.queue("y", "1,2,8")
+        await self.join("caller", "1,2")
+
+        [partner, _] = await self.find_match("overlap", "caller")
+        other = ({"x", "y"} - {partner}).pop()
+        self.assertEqual(await self.redis_client.hget(user_key(other), "status"), "searching")
+        self.assertEqual(await self.redis_client.smembers("interest:{1}"), {other})
+
+    async def test_single_shared_interest_waits_for_the_fallback(self):
+        await self.queue("x", "1,7")
+        await self.join("caller", "1,2")
+
+        self.assertEqual(await self.find_match("overlap", "caller"), [])
+        self.assertEqual(await self.redis_client.smembers("interest:{1}"), {"x", "caller"})
+
+        # Both sides have to have waited long enough
+        await self.searching_since("caller", 30)
+        self.assertEqual(await self.find_match("overlap", "caller"), [])
+        await self.searching_since("x", 30)
+        self.assertEqual(await self.find_match("overlap", "caller"), ["x", "chan.x"])
+
+    async def test_no_shared_interest_never_matches(self):
+        await self.queue("x", "7")
+        await self.searching_since("x", 30)
+        await self.join("caller", "1")
+        await self.searching_since("caller", 30)
+        self.assertEqual(await self.find_match("overlap", "caller"), [])
+
+    async def test_stale_sampled_candidates_are_dropped(self):
+        await self.queue("chatting", "1")
+        await self.redis_client.hset(user_key("chatting"), "status", "chatting")
+        await self.queue("ghost", "1")
+        await self.redis_client.zadd(PRESENCE_KEY, {"ghost": 0})
+        await self.join("caller", "1")
+
+        self.assertEqual(await self.find_match("overlap", "caller"), [])
+        self.assertEqual(await self.redis_client.smembers("interest:{1}"), {"caller"})
+
+    async def batch_match(self):
+        return await ScriptRegistry.call(self.redis_client, "batch_match_overlap", 0, 10, 10, 32, 2, 20)
+
+    async def test_batch_pairs_waiters_by_overlap(self):
+        await self.queue("a", "1,2,3")
+        await self.queue("b", "1,8")
+        await self.queue("c", "1,2,3")
+        await self.queue("d", "1,9")
+        await self.redis_client.srem("queued_interests", "2", "3", "8", "9")
+
+        matched = await self.batch_match()
+        pairs = {frozenset(matched[i:i + 4:2]) for i in range(0, len(matched), 4)}
+        self.assertEqual(pairs, {frozenset({"a", "c"})})
+        self.assertEqual(await self.redis_client.smembers("interest:{1}"), {"b", "d"})
+
+    async def test_batch_drops_a_bounded_number_of_stale_waiters(self):
+        await self.redis_client.sadd("interest:{1}", *(f"ghost{i}" for i in range(150)))
+        await self.redis_client.sadd("queued_interests", "1")
+
+        self.assertEqual(await ScriptRegistry.call(self.redis_client, "batch_match_overlap", 0, 10, 10, 200, 2, 20), [])
+        self.assertEqual(await self.redis_client.scard("interest:{1}"), 50)
@@ -0,0 +1,75 @@
+from django.test import SimpleTestCase, override_settings
+from text_chat_app.interests import CATALOG_KEY, InterestCatalog, normalize
+from .utils import fake_redis_client, requires_fakeredis, reset_worker_state
+
+
+@override_settings(INTEREST_MAX_PER_USER=3, INTEREST_MAX_LENGTH=12)
+class NormalizeTests(SimpleTestCase):
+    def test_case_width_and_whitespace(self):
+        for interest in ("Music", "  music ", "MUSIC", "ｍｕｓｉｃ", "#music"):
+            with self.subTest(interest=interest):
+                self.assertEqual(normalize(interest), "music")
+        self.assertEqual(normalize("Tv\t  Shows"), "tv shows")
+
+    @override_settings(INTEREST_MAX_LENGTH=32)
+    def test_aliases(self):
+        self.assertEqual(normalize("  Video  GAMES"), "gaming")
+        self.assertEqual(normalize("Films"), "movies")
+        self.assertEqual(normalize("Anime & Manga"), "anime")
+
+    def test_too_long_or_empty_is_dropped(self):
+        self.assertEqual(normalize("a" * 13), "")
+        self.assertEqual(normalize("a" * 12), "a" * 12)
+        self.assertEqual(normalize("   "), "")
+
+    def test_deduplicated_and_capped_in_submission_order(self):
+        self.assertEqual(
+            InterestCatalog.normalize_all(["Music", "songs", "", "Code", "x" * 20, "art", "books"]),
+            ["music", "coding", "art"],
+        )
+
+
+@requires_fakeredis
+@override_settings(INTEREST_CATALOG_SIZE=3)
+class InterestCatalogTests(SimpleTestCase):
+    def setUp(self):
+        reset_worker_state()
+        self.addCleanup(reset_worker_state)
+        self.redis_client = fake_redis_client()
+
+    async def test_ids_are_stable_across_calls_and_workers(self):
+        ids = await InterestCatalog.resolve(self.redis_client, ["Music", "art"])
+        self.assertEqual(len(set(ids)), 2)
+
+        # Cached, no round trip
+        self.assertEqual(await InterestCatalog.resolve(self.redis_client, ["ART", "songs"]), ids[::-1])
+
+        # Another worker, with an empty cache, gets the same IDs
+        reset_worker_state()
+        self.assertEqual(await InterestCatalog.resolve(self.redis_client, ["art", "music"]), ids[::-1])
+
+    async def test_full_catalog_drops_new_interests(self):
+        ids = await InterestCatalog.resolve(self.redis_client, ["a", "b", "c"])
+        with self.assertLogs("text_chat_app.interests", "WARNING"):
+            self.assertEqual(await InterestCatalog.resolve(self.redis_client, ["d", "a"]), ids[:1])
+
+    async def test_new_epoch_drops_the_cached_ids(self):
+        [music, art] = await InterestCatalog.resolve(self.redis_client, ["music", "art"])
+
+        # Redis lost the catalog, and another worker interned in a different order
+        await self.redis_client.delete(CATALOG_KEY)
+        await InterestCatalog._intern(self.redis_client, ["art", "music"])
+
+        # Only "books" is unknown here, the epoch change re-resolves the cached names too
+        self.assertEqual(await InterestCatalog.resolve(self.redis_client, ["music", "art", "books"]), [art, music, "3"])
+        self.assertEqual(InterestCatalog.epoch, await self.redis_client.hget(CATALOG_KEY, "epoch"))
+
+    async def test_check_drops_the_cache_of_a_lost_catalog(self):
+        await InterestCatalog.resolve(self.redis_client, ["music"])
+        await InterestCatalog.check(self.redis_client)
+        self.assertTrue(InterestCatalog.ids)
+
+        await self.redis_client.delete(CATALOG_KEY)
+        with self.assertLogs("text_chat_app.interests", "WARNING"):
+            await InterestCatalog.check(self.redis_client)
+        self.assertEqual((InterestCatalog.ids, InterestCatalog.epoch), ({}, None))
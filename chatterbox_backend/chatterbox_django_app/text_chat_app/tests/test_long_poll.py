@@ -0,0 +1,127 @@
+import asyncio
+import time
+from unittest import mock
+
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, override_settings
+from core.services.circuit_breaker import OPEN, CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from text_chat_app.admission import Admission
+from text_chat_app.consumers import ChatConsumer
+from text_chat_app.interests import InterestCatalog
+from text_chat_app.long_poll import LongPollMatch
+from text_chat_app.presence import Presence
+from text_chat_app.sharded_matching import PRESENCE_KEY, user_key
+from .utils import (
+    IN_MEMORY_CHANNEL_LAYERS,
+    device_id,
+    requires_fakeredis,
+    reset_worker_state,
+    use_fake_redis,
+)
+
+
+@requires_fakeredis
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, MATCH_QUEUE_MODE="random", CLEANUP_COALESCE_WINDOW=0)
+@mock.patch("text_chat_app.matchmaker.Matchmaker.ensure_started", mock.Mock())
+@mock.patch("text_chat_app.presence.Presence.ensure_started", mock.Mock())
+@mock.patch("text_chat_app.drain.WorkerDrain.install", mock.Mock())
+class LongPollMatchTests(SimpleTestCase):
+    def setUp(self):
+        reset_worker_state()
+        self.redis_client = use_fake_redis(self)
+
+    async def connect(self, name):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/textchat?id={device_id(name)}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await self.receive_types(communicator, 1), ["connection_established"])
+        return communicator
+
+    async def send(self, communicator, message_type, data=None):
+        await communicator.send_json_to({"type": message_type, "data": data} if data else {"type": message_type})
+
+    async def receive_types(self, communicator, count):
+        return [(await communicator.receive_json_from())["type"] for _ in range(count)]
+
+    async def matched_over_http(self, interest):
+        partner = await self.connect("partner")
+        await self.send(partner, "submit_interests", {"interests": [interest]})
+        await self.send(partner, "start_matching")
+        self.assertEqual(await self.receive_types(partner, 2), ["success", "no_match"])
+
+        match = await LongPollMatch(device_id("http")).run([interest], timeout=5)
+        self.assertEqual(match["partner_user_id"], device_id("partner"))
+        self.assertEqual(await self.receive_types(partner, 2), ["success", "success_matched"])
+        return partner, match
+
+    async def test_socket_takes_over_the_chat(self):
+        partner, match = await self.matched_over_http("music")
+
+        socket = await self.connect("http")
+        self.assertEqual(await self.receive_types(socket, 1), ["success"])
+        resumed = await socket.receive_json_from()
+        self.assertEqual((resumed["type"], resumed["data"]), ("success_matched", {"role": match["role"]}))
+
+        # Gives the partner's consumer a moment to handle the redirect
+        self.assertTrue(await partner.receive_nothing())
+        await self.send(partner, "chat_message", {"message": "hi"})
+        self.assertEqual((await socket.receive_json_from())["data"], {"message": "hi"})
+        await self.send(socket, "chat_message", {"message": "hello"})
+        self.assertEqual((await partner.receive_json_from())["data"], {"message": "hello"})
+
+        await self.send(socket, "end_chat")
+        self.assertEqual(await self.receive_types(partner, 1), ["partner_left_chat"])
+        await socket.disconnect()
+        await partner.disconnect()
+
+    async def test_offer_renews_the_lease_once(self):
+        partner, _ = await self.matched_over_http("music")
+        self.assertIsNotNone(await self.redis_client.zscore(PRESENCE_KEY, device_id("http")))
+        self.assertEqual(
+            await self.redis_client.hmget(user_key(device_id("http")), "status", "partner"),
+            ["chatting", device_id("partner")],
+        )
+        await partner.disconnect()
+
+    async def test_ended_chat_is_not_resumed(self):
+        partner, _ = await self.matched_over_http("music")
+        await self.send(partner, "end_chat")
+        self.assertEqual(await self.receive_types(partner, 1), ["success"])
+
+        socket = await self.connect("http")
+        self.assertTrue(await socket.receive_nothing())
+        self.assertIsNone(await self.redis_client.hget(user_key(device_id("http")), "room"))
+        await socket.disconnect()
+        await partner.disconnect()
+
+    async def test_late_find_match_is_bounded_by_the_timeout(self):
+        never = asyncio.get_running_loop().create_future()
+        late = mock.AsyncMock(side_effect=DeadlineExceeded("common", 1, never))
+
+        with mock.patch("text_chat_app.long_poll.run_script", late), \
+                mock.patch("text_chat_app.long_poll.CleanupCoalescer.submit") as submit:
+            match = await asyncio.wait_for(LongPollMatch(device_id("http")).run(["music"], timeout=0.1), 1)
+
+        self.assertIsNone(match)
+        # Shielded, a match it still makes is ended by the cleanup
+        self.assertFalse(never.cancelled())
+        submit.assert_called_once_with(device_id("http"), mock.ANY)
+
+    async def test_redis_calls_go_through_the_breaker(self):
+        breaker = CircuitBreaker.get("common")
+        with mock.patch.object(breaker, "call", wraps=breaker.call) as call, \
+                mock.patch("text_chat_app.long_poll.run_script", mock.AsyncMock(return_value=[])):
+            self.assertIsNone(await LongPollMatch(device_id("http")).run(["music"], timeout=0))
+        called = [c.args[0] for c in call.call_args_list]
+        self.assertIn(self.redis_client.hget, called)
+        self.assertIn(Presence.join, called)
+
+    async def test_open_circuit_fails_fast(self):
+        await InterestCatalog.resolve(self.redis_client, ["music"])
+        breaker = CircuitBreaker.get("common")
+        breaker.state, breaker.opened_at = OPEN, time.monotonic()
+
+        with self.assertRaises(CircuitOpenError):
+            await asyncio.wait_for(LongPollMatch(device_id("http")).run(["music"], timeout=5), 1)
+        self.assertEqual(Admission.global_count, 0)
+        self.assertEqual(Presence.local_users, {})
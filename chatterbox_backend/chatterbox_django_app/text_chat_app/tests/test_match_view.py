@@ -0,0 +1,33 @@
+import json
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+from text_chat_app.views import match_view
+from core.services.circuit_breaker import DeadlineExceeded
+from .utils import device_id, reset_worker_state
+
+
+class MatchViewValidationTests(SimpleTestCase):
+    def setUp(self):
+        reset_worker_state()
+
+    async def get(self, query):
+        response = await match_view(RequestFactory().get("/textchat/match/", query))
+        return response.status_code, json.loads(response.content)
+
+    async def test_invalid_id(self):
+        status, body = await self.get({"id": "not-a-hash", "interests": "music"})
+        self.assertEqual((status, body["type"]), (400, "error"))
+
+    async def test_non_finite_or_malformed_timeout(self):
+        for timeout in ("nan", "NaN", "inf", "-inf", "soon"):
+            with self.subTest(timeout=timeout):
+                status, body = await self.get({"id": device_id("user"), "interests": "music", "timeout": timeout})
+                self.assertEqual((status, body["description"]), (400, "Invalid timeout"))
+
+    async def test_slow_redis_is_reported_as_degraded(self):
+        slow = mock.AsyncMock(side_effect=DeadlineExceeded("common", 1, mock.Mock()))
+        with mock.patch("text_chat_app.views.LongPollMatch.run", slow):
+            status, body = await self.get({"id": device_id("user"), "interests": "music"})
+        self.assertEqual((status, body["type"]), (503, "service_degraded"))
+        self.assertEqual(body["data"], {"retry_after_ms": 1000})
@@ -0,0 +1,102 @@
+import json
+from unittest import mock
+
+import msgpack
+from django.test import SimpleTestCase
+from text_chat_app import messages, wire
+from text_chat_app.consumers import HANDLERS
+from .utils import consumer, sent_json
+
+
+class MessagesTests(SimpleTestCase):
+    def test_json_frame_decodes_into_its_struct(self):
+        message = messages.decode_json(json.dumps({
+            "type": "submit_interests",
+            "description": "skipped",
+            "timestamp": "skipped",
+            "data": {"interests": ["music"]},
+        }))
+        self.assertEqual(message, messages.SubmitInterests(data=messages.InterestsData(interests=["music"])))
+        self.assertEqual(messages.decode_json('{"type":"start_matching"}'), messages.StartMatching())
+
+    def test_frame_not_matching_a_message_is_a_schema_mismatch(self):
+        for text in (
+            '{"type":"unknown"}',
+            '{"data":{}}',
+            '{"type":"submit_interests"}',
+            '{"type":"submit_interests","data":{"interests":"music"}}',
+            '{"type":"chat_message","data":{"message":5}}',
+        ):
+            with self.subTest(text=text), self.assertRaises(messages.SchemaMismatch):
+                messages.decode_json(text)
+
+    def test_malformed_json_is_not_a_schema_mismatch(self):
+        with self.assertRaises(messages.InvalidMessage) as raised:
+            messages.decode_json('{"type":')
+        self.assertNotIsInstance(raised.exception, messages.SchemaMismatch)
+
+    def test_envelope_keeps_the_data_raw(self):
+        envelope = messages.decode_envelope('{"type":"webrtc_signal","data":{"type":"offer", "sdp":"v=0"}}')
+        self.assertEqual(envelope.type, "webrtc_signal")
+        self.assertEqual(bytes(envelope.data), b'{"type":"offer", "sdp":"v=0"}')
+        self.assertEqual(messages.decode_envelope('{"type":"a","type":"b"}').type, "b")
+
+    def test_binary_body_decodes_into_its_struct(self):
+        self.assertEqual(
+            messages.decode_body(messages.SubmitInterests, msgpack.packb({"interests": ["music"]})),
+            messages.SubmitInterests(data=messages.InterestsData(interests=["music"])),
+        )
+        self.assertEqual(messages.decode_body(messages.SubmitInterests, b""), messages.SubmitInterests(data=messages.InterestsData()))
+        self.assertEqual(messages.decode_body(messages.EndChat, b"ignored"), messages.EndChat())
+
+        with self.assertRaises(messages.SchemaMismatch):
+            messages.decode_body(messages.SubmitInterests, msgpack.packb({"interests": "music"}))
+        with self.assertRaises(messages.InvalidMessage):
+            messages.decode_body(messages.ChatMessage, b"\xc1")
+
+
+class DispatchTests(SimpleTestCase):
+    def test_every_message_has_a_handler(self):
+        self.assertEqual(set(HANDLERS), set(messages.MESSAGES.values()))
+
+    async def test_decoded_message_reaches_its_handler(self):
+        handler = mock.AsyncMock()
+        with mock.patch.dict(HANDLERS, {messages.SubmitInterests: handler}):
+            chat_consumer = consumer()
+            await chat_consumer.receive(text_data='{"type":"submit_interests","data":{"interests":["music"]}}')
+            await chat_consumer.receive(bytes_data=wire.MESSAGE_CODES["submit_interests"].to_bytes() + msgpack.packb({"interests": ["art"]}))
+
+        [json_call, binary_call] = handler.await_args_list
+        self.assertEqual(json_call.args[1].data.interests, ["music"])
+        self.assertEqual(binary_call.args[1].data.interests, ["art"])
+        chat_consumer.send.assert_not_awaited()
+
+    async def test_bad_frames_never_reach_a_handler(self):
+        handlers = {message_class: mock.AsyncMock() for message_class in HANDLERS}
+        with mock.patch.dict(HANDLERS, handlers):
+            chat_consumer = consumer()
+            await chat_consumer.receive(text_data="not json")
+            await chat_consumer.receive(text_data='{"type":"unknown"}')
+            await chat_consumer.receive(text_data='{"type":"submit_interests","data":{"interests":5}}')
+
+            binary_consumer = consumer(binary=True)
+            await binary_consumer.receive(bytes_data=b"\xff")
+            await binary_consumer.receive(bytes_data=wire.MESSAGE_CODES["submit_interests"].to_bytes() + b"\xc1")
+
+        for handler in handlers.values():
+            handler.assert_not_awaited()
+        self.assertEqual(
+            [(response["type"], response["description"].split(":")[0]) for response in sent_json(chat_consumer)],
+            [("error", "Invalid JSON format"), ("error", "Invalid message"), ("error", "Invalid message")],
+        )
+        self.assertEqual(
+            [wire.decode_frame(call.kwargs["bytes_data"])[0] for call in binary_consumer.send.await_args_list],
+            ["error", "error"],
+        )
+
+    async def test_handler_failure_is_reported_to_the_client(self):
+        with mock.patch.dict(HANDLERS, {messages.EndChat: mock.AsyncMock(side_effect=RuntimeError)}):
+            chat_consumer = consumer()
+            with self.assertLogs("text_chat_app.consumers", "ERROR"):
+                await chat_consumer.receive(text_data='{"type":"end_chat"}')
+        self.assertEqual(sent_json(chat_consumer)[0]["description"], "An unexpected error occurred.")
@@ -0,0 +1,30 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from core import metrics
+from text_chat_app import views
+from text_chat_app.interests import CATALOG_KEY
+from .utils import fake_redis_client, requires_fakeredis
+
+
+@requires_fakeredis
+@override_settings(MATCH_QUEUE_MODE="random", METRICS_QUEUE_SAMPLE=50, METRICS_QUEUE_TOP=2)
+class QueueGaugeTests(SimpleTestCase):
+    async def test_only_the_largest_sampled_queues_get_a_series(self):
+        redis_client = fake_redis_client()
+        for interest_id, (name, users) in enumerate([("art", 1), ('x" } 1\nevil 9', 3), ("music", 2)], 1):
+            await redis_client.sadd("queued_interests", interest_id)
+            await redis_client.sadd(f"interest:{{{interest_id}}}", *[f"user{i}" for i in range(users)])
+            await redis_client.hset(CATALOG_KEY, f"i:{interest_id}", name)
+
+        views._last_sample = 0.0
+        with mock.patch("text_chat_app.views.get_redis_client", mock.AsyncMock(return_value=redis_client)):
+            await views._sample_redis_gauges()
+
+        self.assertEqual(
+            list(metrics.INTEREST_QUEUE_USERS.samples()),
+            [
+                'chatterbox_interest_queue_users{interest="x\\" } 1\\nevil 9"} 3.0',
+                'chatterbox_interest_queue_users{interest="music"} 2.0',
+            ],
+        )
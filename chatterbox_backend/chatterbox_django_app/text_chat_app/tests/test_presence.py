@@ -0,0 +1,106 @@
+import asyncio
+import time
+from unittest import mock
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from text_chat_app.cleanup import CleanupCoalescer
+from text_chat_app.presence import Presence
+from text_chat_app.sharded_matching import PRESENCE_KEY, user_key
+from .utils import IN_MEMORY_CHANNEL_LAYERS, fake_redis_client, requires_fakeredis, reset_worker_state
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+@requires_fakeredis
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, PRESENCE_SWEEP_BATCH=10)
+@mock.patch.object(CleanupCoalescer, "_run", mock.AsyncMock()) # flushed by the tests
+class PresenceSweepTests(SimpleTestCase):
+    modes = ("random", "sharded")
+
+    def setUp(self):
+        reset_worker_state()
+        self.addCleanup(reset_worker_state)
+
+    async def start(self):
+        self.channel_layer = get_channel_layer()
+        self.presence = Presence()
+        self.presence.redis_client = self.redis_client = fake_redis_client()
+
+    async def user(self, user_id, lease, partner=None, channel=None):
+        channel = channel or await self.channel_layer.new_channel()
+        meta = {"channel": channel, "interests": "1", "status": "chatting" if partner else "searching"}
+        if partner:
+            meta["partner"] = partner
+        else:
+            # Sharded mode only has the FIFO queues
+            if settings.MATCH_QUEUE_MODE != "sharded":
+                await self.redis_client.sadd("interest:{1}", user_id)
+            await self.redis_client.zadd("interest_q:{1}", {user_id: now_ms()})
+        await self.redis_client.hset(user_key(user_id), mapping=meta)
+        await self.redis_client.zadd(PRESENCE_KEY, {user_id: lease})
+        return channel
+
+    async def assert_swept(self, user_id):
+        self.assertFalse(await self.redis_client.exists(user_key(user_id)))
+        self.assertIsNone(await self.redis_client.zscore(PRESENCE_KEY, user_id))
+        self.assertNotIn(user_id, await self.redis_client.smembers("interest:{1}"))
+        self.assertIsNone(await self.redis_client.zscore("interest_q:{1}", user_id))
+
+    async def test_expired_leases_are_swept(self):
+        for mode in self.modes:
+            with self.subTest(mode=mode), override_settings(MATCH_QUEUE_MODE=mode):
+                await self.start()
+                await self.user("ghost", now_ms() - 1000, partner="partner")
+                partner_channel = await self.user("partner", now_ms() + 60_000, partner="ghost")
+                await self.user("queued_ghost", now_ms() - 1000)
+                Presence.local_users["partner"] = partner_channel
+
+                self.assertEqual(await self.presence.tick(), 1)
+                await self.assert_swept("ghost")
+                await self.assert_swept("queued_ghost")
+                self.assertEqual(await self.redis_client.hmget(user_key("partner"), "partner", "status"), [None, "idle"])
+                self.assertGreater(await self.redis_client.zscore(PRESENCE_KEY, "partner"), now_ms())
+                event = await asyncio.wait_for(self.channel_layer.receive(partner_channel), 1)
+                self.assertEqual(event["type"], "handle_partner_ended_chat")
+                Presence.local_users.clear()
+
+    @override_settings(PRESENCE_SWEEP_BATCH=2)
+    async def test_sweep_is_bounded(self):
+        await self.start()
+        for i in range(3):
+            await self.user(f"ghost{i}", now_ms() - 1000 + i)
+
+        await self.presence.tick()
+        self.assertEqual(await self.redis_client.zrange(PRESENCE_KEY, 0, -1), ["ghost2"])
+        await self.presence.tick()
+        await self.assert_swept("ghost2")
+
+    async def test_sweep_recovers_users_a_failed_cleanup_batch_dropped(self):
+        await self.start()
+        coalescer = CleanupCoalescer()
+        coalescer.redis_client = self.redis_client
+        await self.user("gone", now_ms() + 60_000, partner="partner")
+        partner_channel = await self.user("partner", now_ms() + 60_000, partner="gone")
+        Presence.local_users["partner"] = partner_channel
+
+        # The socket closed, then the batch script failed after the user was popped
+        CleanupCoalescer.submit("gone", await self.redis_client.hget(user_key("gone"), "channel"))
+        with mock.patch.object(coalescer, "_clean_up_batch", mock.AsyncMock(side_effect=ConnectionError)), \
+                self.assertRaises(ConnectionError):
+            await coalescer.flush()
+        self.assertEqual(CleanupCoalescer._pending, {})
+
+        # Nobody renews the lease any more, once it lapses the sweep does the cleanup
+        await self.presence.tick()
+        self.assertIsNotNone(await self.redis_client.hget(user_key("gone"), "partner"))
+        await self.redis_client.zadd(PRESENCE_KEY, {"gone": now_ms() - 1})
+
+        self.assertEqual(await self.presence.tick(), 1)
+        await self.assert_swept("gone")
+        self.assertEqual(await self.redis_client.hget(user_key("partner"), "status"), "idle")
+        event = await asyncio.wait_for(self.channel_layer.receive(partner_channel), 1)
+        self.assertEqual(event["type"], "handle_partner_ended_chat")
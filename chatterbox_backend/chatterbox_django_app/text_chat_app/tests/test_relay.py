@@ -0,0 +1,127 @@
+import asyncio
+import json
+from unittest import mock
+
+import msgpack
+from channels.layers import InMemoryChannelLayer
+from django.test import SimpleTestCase
+from text_chat_app import wire
+from .utils import consumer, sent_json
+
+
+@mock.patch("core.services.rate_limit.RateLimit.check_rate_limit", mock.AsyncMock(return_value=True))
+class RelayTests(SimpleTestCase):
+    async def asyncSetUp(self):
+        self.layer = InMemoryChannelLayer()
+        self.sender = consumer()
+        self.sender.channel_layer = self.layer
+        self.sender.room_name = "room"
+        self.sender.partner_channel = await self.layer.new_channel()
+
+    async def relayed(self):
+        return await asyncio.wait_for(self.layer.receive(self.sender.partner_channel), 1)
+
+    async def assert_nothing_relayed(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.layer.receive(self.sender.partner_channel), 0.05)
+
+    async def test_chat_message_data_is_relayed_under_a_server_envelope(self):
+        await self.asyncSetUp()
+        await self.sender.receive(text_data=json.dumps({
+            "type": "chat_message",
+            "description": "spoofed description",
+            "data": {"message": "hi"},
+        }))
+        event = await self.relayed()
+        self.assertEqual(event["type"], "chat_message")
+
+        partner = consumer()
+        await partner.chat_message(event)
+        [response] = sent_json(partner)
+        self.assertEqual(response["type"], "chat_message")
+        self.assertEqual(response["description"], "Message sent successfully")
+        self.assertEqual(response["data"], {"message": "hi"})
+
+    async def test_duplicate_type_key_cannot_spoof_a_server_message(self):
+        await self.asyncSetUp()
+        # The partner's decoder would keep the last "type"
+        await self.sender.receive(
+            text_data='{"type":"chat_message","data":{"message":"bye"},"type":"partner_left_chat"}'
+        )
+        await self.assert_nothing_relayed()
+        self.assertEqual(sent_json(self.sender)[0]["type"], "error")
+
+        # Relayed by its last "type", under the server's envelope
+        await self.sender.receive(
+            text_data='{"type":"partner_left_chat","data":{"message":"hi"},"type":"chat_message"}'
+        )
+        partner = consumer()
+        await partner.chat_message(await self.relayed())
+        [response] = sent_json(partner)
+        self.assertEqual(response["type"], "chat_message")
+        self.assertEqual(response["data"], {"message": "hi"})
+
+    async def test_nested_type_keys_are_relayed(self):
+        await self.asyncSetUp()
+        await self.sender.receive(text_data=json.dumps({
+            "type": "webrtc_signal",
+            "data": {"type": "offer", "sdp": "v=0"},
+        }))
+        partner = consumer()
+        await partner.signal_relay(await self.relayed())
+        [response] = sent_json(partner)
+        self.assertEqual(response["type"], "webrtc_signal")
+        self.assertEqual(response["data"], {"type": "offer", "sdp": "v=0"})
+
+    async def test_json_data_is_converted_for_a_binary_partner(self):
+        await self.asyncSetUp()
+        await self.sender.receive(text_data='{"type":"chat_message","data":{"message":"hi"}}')
+        partner = consumer(binary=True)
+        await partner.chat_message(await self.relayed())
+        frame = partner.send.await_args.kwargs["bytes_data"]
+        self.assertEqual(wire.decode_frame(frame), ("chat_message", msgpack.packb({"message": "hi"})))
+
+    async def test_binary_chat_message_length_is_checked_in_characters(self):
+        await self.asyncSetUp()
+        self.sender.binary = True
+        await self.sender.receive(bytes_data=wire.encode_frame("chat_message", {"message": "a" * 2001}))
+        await self.assert_nothing_relayed()
+        self.assertEqual(wire.decode_frame(self.sender.send.await_args.kwargs["bytes_data"])[0], "error")
+
+        # 2000 characters, 4000 bytes packed
+        await self.sender.receive(bytes_data=wire.encode_frame("chat_message", {"message": "é" * 2000}))
+        partner = consumer()
+        await partner.chat_message(await self.relayed())
+        [response] = sent_json(partner)
+        self.assertEqual(response["data"], {"message": "é" * 2000})
+
+    async def test_binary_data_without_a_json_form_is_dropped(self):
+        for event in (
+            {"type": "chat_message", "frame": wire.encode_frame("chat_message", {"message": b"\x00\x01"})},
+            {"type": "signal_relay", "frame": wire.encode_frame("webrtc_signal", {"candidate": float("nan")})},
+        ):
+            with self.subTest(event=event):
+                partner = consumer()
+                with self.assertLogs("text_chat_app.consumers", "WARNING"):
+                    await getattr(partner, event["type"])(event)
+                [response] = sent_json(partner)
+                self.assertEqual(response["type"], "error")
+
+    async def test_chat_data_not_matching_the_schema_is_not_relayed(self):
+        await self.asyncSetUp()
+        for text in (
+            '{"type":"chat_message","data":{"message":5}}',
+            '{"type":"chat_message","data":{}}',
+            '{"type":"chat_message"}',
+        ):
+            with self.subTest(text=text):
+                await self.sender.receive(text_data=text)
+                await self.assert_nothing_relayed()
+                self.assertEqual(sent_json(self.sender)[-1]["type"], "error")
+
+        self.sender.binary = True
+        for body in ({"message": 5}, None):
+            with self.subTest(body=body):
+                await self.sender.receive(bytes_data=wire.encode_frame("chat_message", body))
+                await self.assert_nothing_relayed()
+                self.assertEqual(wire.decode_frame(self.sender.send.await_args.kwargs["bytes_data"])[0], "error")
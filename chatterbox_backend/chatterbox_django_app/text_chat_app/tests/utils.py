@@ -0,0 +1,72 @@
+import hashlib
+import json
+import unittest
+from unittest import mock
+
+import redis.asyncio as redis
+from core import redis_client
+from core.services.circuit_breaker import CircuitBreaker
+from text_chat_app.admission import Admission
+from text_chat_app.cleanup import CleanupCoalescer
+from text_chat_app.consumers import ChatConsumer
+from text_chat_app.interests import InterestCatalog
+from text_chat_app.presence import Presence
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+# The Lua scripts run on fakeredis' embedded Lua, pip install "fakeredis[lua]"
+requires_fakeredis = unittest.skipIf(fakeredis is None, 'needs pip install "fakeredis[lua]"')
+
+
+def fake_redis_client():
+    """A fresh in-process Redis, shaped like the worker's common client."""
+    return fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+
+def use_fake_redis(test_case):
+    """Points the worker's Redis pools at one fresh in-process Redis until the test ends."""
+    server = fakeredis.FakeServer()
+    for pool_name in ("infra", "housekeeping", "common"):
+        pool = redis.ConnectionPool(
+            connection_class=fakeredis.aioredis.FakeConnection,
+            server=server,
+            decode_responses=True,
+        )
+        for attr, value in ((f"_{pool_name}_pool", pool), (f"_{pool_name}_client", redis.Redis(connection_pool=pool))):
+            test_case.addCleanup(setattr, redis_client, attr, getattr(redis_client, attr))
+            setattr(redis_client, attr, value)
+    return redis_client._common_client
+
+
+def device_id(name: str) -> str:
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def reset_worker_state():
+    """Forgets the per-worker class-level state the tests touch."""
+    Admission.sockets.clear()
+    Admission.global_count = 0
+    Admission.admitted_since_refresh = 0
+    Presence.local_users.clear()
+    CircuitBreaker._breakers.clear()
+    InterestCatalog.ids.clear()
+    InterestCatalog.epoch = None
+    CleanupCoalescer._pending.clear()
+
+
+def consumer(binary=False):
+    """A ChatConsumer without a socket, what it sends is recorded by its send mock."""
+    chat_consumer = ChatConsumer()
+    chat_consumer.user_id = "user"
+    chat_consumer.binary = binary
+    chat_consumer.send = mock.AsyncMock()
+    return chat_consumer
+
+
+def sent_json(chat_consumer):
+    return [json.loads(call.kwargs["text_data"]) for call in chat_consumer.send.await_args_list]
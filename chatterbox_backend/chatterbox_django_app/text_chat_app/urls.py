@@ -2,5 +2,6 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    # path('match/', views.match_view, name='match_view'),
+    path('match/', views.match_view, name='match_view'),
+    path('metrics/', views.metrics_view, name='metrics_view'),
 ]
@@ -1,9 +1,158 @@
-from django.shortcuts import render
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
-
-# Will not return a response until the user is matched or timeout of 120 seconds
-@api_view(['GET'])
-def match_view(request):
-    
-    return Response({"message": "Matched successfully."})
+import logging
+import math
+import re
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+from core import metrics
+from core.redis_client import get_redis_client, pool_in_use_connections
+from core.services.circuit_breaker import CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from .admission import Admission
+from .drain import WorkerDrain
+from .interests import CATALOG_KEY
+from .long_poll import Drained, LongPollMatch, Replaced
+
+logger = logging.getLogger(__name__)
+
+
+def _match_response(status, response_type, description, data=None, retry_after=None):
+    # Same shape as the WebSocket responses
+    body = {"type": response_type, "description": description}
+    if data is not None:
+        body["data"] = data
+    response = JsonResponse(body, status=status)
+    if retry_after is not None:
+        response["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+
+def _draining_response():
+    reconnect_after_ms = WorkerDrain.reconnect_after_ms()
+    return _match_response(
+        503, "server_draining", "Server is restarting, retry after the given delay",
+        {"reconnect_after_ms": reconnect_after_ms}, reconnect_after_ms / 1000,
+    )
+
+
+def _degraded_response(retry_after):
+    return _match_response(
+        503, "service_degraded", "Service is degraded, retry after the given delay",
+        {"retry_after_ms": int(retry_after * 1000)}, retry_after,
+    )
+
+
+# Will not return a response until the user is matched or timeout of 120 seconds (MATCH_LONG_POLL_TIMEOUT).
+# Long-poll matching for clients that can't keep a WebSocket open, see long_poll.py. A native
+# async view, so a parked request is a coroutine instead of a thread.
+@require_GET
+async def match_view(request):
+    user_id = request.GET.get("id", "")
+    if not re.fullmatch(r"[a-fA-F0-9]{64}", user_id):
+        return _match_response(400, "error", "Missing or invalid id, expected a SHA-256 hex digest")
+
+    # ?interests=music&interests=art or ?interests=music,art
+    interests = [
+        interest for value in request.GET.getlist("interests") for interest in value.split(",")
+    ]
+    try:
+        timeout = float(request.GET.get("timeout", settings.MATCH_LONG_POLL_TIMEOUT))
+    except ValueError:
+        timeout = math.nan
+    if not math.isfinite(timeout):
+        # float() also accepts "nan" and "inf", which the clamp below lets through
+        return _match_response(400, "error", "Invalid timeout")
+    timeout = min(max(timeout, 0), settings.MATCH_LONG_POLL_TIMEOUT)
+
+    # Same admission as a WebSocket connect, from process memory only
+    if WorkerDrain.draining:
+        metrics.CONNECTIONS_REJECTED.inc("draining")
+        return _draining_response()
+
+    breaker = CircuitBreaker.get("common")
+    if breaker.is_open:
+        metrics.CONNECTIONS_REJECTED.inc("degraded")
+        return _degraded_response(breaker.retry_after())
+
+    if Admission.check(user_id) is not None:
+        return _match_response(503, "error", "Server is busy, please try again", retry_after=1)
+
+    try:
+        match = await LongPollMatch(user_id).run(interests, timeout)
+    except ValueError as e:
+        return _match_response(400, "error", str(e))
+    except Replaced:
+        return _match_response(
+            409, "session_replaced", "You connected again from another socket or request, this one is closed"
+        )
+    except Drained:
+        return _draining_response()
+    except CircuitOpenError as e:
+        return _degraded_response(e.retry_after)
+    except DeadlineExceeded:
+        # Redis is slow rather than down, the circuit may still be closed
+        return _degraded_response(max(breaker.retry_after(), 1))
+    except Exception as e:
+        logger.exception(f"Error during long-poll matching: {e}")
+        return _match_response(500, "error", "Matching failed, please try again")
+
+    if match is None:
+        return _match_response(200, "no_match", "No match found, try again")
+    return _match_response(200, "success", "Match found", match)
+
+
+# Redis-backed gauges are sampled at most every METRICS_SAMPLE_INTERVAL seconds,
+# so scraping stays cheap no matter how often Prometheus (or anyone else) hits the endpoint.
+_last_sample = 0.0
+
+
+async def _sample_redis_gauges():
+    global _last_sample
+
+    now = time.monotonic()
+    if now - _last_sample < settings.METRICS_SAMPLE_INTERVAL:
+        return
+    _last_sample = now
+
+    redis_client = await get_redis_client("housekeeping")
+    topics = await redis_client.srandmember("queued_interests", settings.METRICS_QUEUE_SAMPLE)
+
+    if settings.MATCH_QUEUE_MODE in ("fifo", "sharded"):
+        prefix, size_command = "interest_q:", "zcard"
+    else:
+        prefix, size_command = "interest:", "scard"
+    pipe = redis_client.pipeline(transaction=False)
+    for topic in topics:
+        getattr(pipe, size_command)(f"{prefix}{{{topic}}}")
+    pipe.hgetall("match_wait_seconds")
+    # Queues are keyed by interest ID, the gauge is labelled with the interest's name
+    pipe.hmget(CATALOG_KEY, [f"i:{topic}" for topic in topics] or ["i:"])
+    *queue_sizes, match_wait, names = await pipe.execute()
+
+    # Interest names are client-submitted, keep the number of series small
+    largest = sorted(zip(queue_sizes, topics, names), reverse=True)[:settings.METRICS_QUEUE_TOP]
+    metrics.INTEREST_QUEUE_USERS.clear()
+    for size, topic, name in largest:
+        metrics.INTEREST_QUEUE_USERS.set(size, name or topic)
+
+    if match_wait:
+        buckets = [int(match_wait.get(f"le_{le}", 0)) for le in metrics.MATCH_WAIT_SECONDS.buckets]
+        buckets.append(int(match_wait.get("le_+Inf", 0)))
+        metrics.MATCH_WAIT_SECONDS.set_series((), buckets, float(match_wait.get("sum", 0)))
+
+
+# Prometheus text endpoint, one scrape reports the worker that served it (see the pid in chatterbox_worker_info)
+async def metrics_view(request):
+    try:
+        await _sample_redis_gauges()
+    except Exception:
+        pass  # Worker-local metrics are still worth returning when Redis is unavailable
+
+    for pool_name, in_use in pool_in_use_connections().items():
+        metrics.REDIS_POOL_IN_USE.set(in_use, pool_name)
+
+    return HttpResponse(
+        metrics.REGISTRY.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,64 @@
+"""
+Binary (MessagePack) wire protocol, negotiated at connect with ?protocol=msgpack
+or the "chatterbox.msgpack" WebSocket subprotocol. JSON stays the default.
+
+The data of chat and WebRTC frames is relayed to the partner as the sender wrote it, in
+either protocol, and only converted when the two ends speak different protocols.
+
+Every binary frame is one type-code byte followed by an optional MessagePack body:
+
+    [code][msgpack body]
+
+Client -> server bodies are the same objects JSON clients put under "data"
+(e.g. {"interests": ["coding"]} for submit_interests). Server -> client bodies are
+{"description": str, "data": ...}, except relayed frames which carry the sender's
+body untouched.
+"""
+
+import msgpack
+
+SUBPROTOCOL = "chatterbox.msgpack"
+
+MESSAGE_CODES = {
+    # Client -> server
+    "submit_interests": 1,
+    "start_matching": 2,
+    "end_matching": 3,
+    "chat_message": 4, # also server -> client (relayed)
+    "end_chat": 5,
+    "webrtc_signal": 6, # also server -> client (relayed)
+    # Server -> client
+    "connection_established": 20,
+    "success": 21,
+    "success_matched": 22,
+    "no_match": 23,
+    "error": 24,
+    "partner_left_chat": 25,
+    "server_draining": 26,
+    "service_degraded": 27,
+    "session_replaced": 28,
+}
+
+MESSAGE_TYPES = {code: message_type for message_type, code in MESSAGE_CODES.items()}
+
+# Pre-built single-byte headers so encoding a frame is one concatenation
+_HEADERS = {message_type: bytes([code]) for message_type, code in MESSAGE_CODES.items()}
+
+
+def decode_frame(frame: bytes):
+    """Splits a binary frame into (message type or None if unknown, raw body bytes)."""
+    if not frame:
+        return None, b""
+    return MESSAGE_TYPES.get(frame[0]), frame[1:]
+
+
+def encode_frame(message_type: str, body=None) -> bytes:
+    """Encodes a server -> client frame, the body is packed with MessagePack."""
+    if body is None:
+        return _HEADERS[message_type]
+    return _HEADERS[message_type] + msgpack.packb(body)
+
+
+def unpack(raw: bytes):
+    """Decodes a body, raises ValueError on malformed MessagePack."""
+    return msgpack.unpackb(raw) if raw else None